@@ -10,22 +10,16 @@ def get_total_announcements_count():
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 import io
 import base64
-import qrcode
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
-from supabase import create_client, Client
-import overpy
+from utils.supabase_client import get_auth_client, pool_stats, supabase_or_none
 import os
+import sys
 import time
 import requests
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from urllib.parse import quote
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import Config
-from sms_service import sms_service
 from upi_payment_service import upi_payment_service
-from tasks import process_incident_notification, send_weather_alert
 from services.weather_service import WeatherService
 from services.optimized_weather_service import OptimizedWeatherService
 from repositories.weather_repo import WeatherRepository
@@ -37,8 +31,17 @@ from utils.error_handling import handle_errors
 from services.incident_service import IncidentService
 from repositories.incident_repo import IncidentRepository
 from repositories.request_repo import RequestRepository
+from repositories.incident_cluster_repo import IncidentClusterRepository
+from repositories.duplicate_repo import DuplicateSignatureRepository
+from services.incident_cluster_service import IncidentClusterService
+from repositories.shelter_repo import ShelterRepository
+from repositories.unit_of_work import UnitOfWork, UnitOfWorkConflict
+from services.geocoding_service import GeocoderBusy, GeocodingService
+from repositories.notification_repo import NotificationRepository
+from utils.presence import mark_active
+from utils import metrics, request_budget
+from utils.metrics import InstrumentedHTTPAdapter
 import json
-from collections import defaultdict
 import re
 from datetime import datetime
 
@@ -50,109 +53,24 @@ APP_STATE = {
     "rate_limits": {
         "signup_attempts": {}
     },
-    "http_sessions": {}
+    "http_sessions": {},
+    "shelter_service": None,
+    "shelter_catalog": None,
+    "geocoder": None,
+    "cluster_rebuild_requested_at": 0.0
 }
 
 def consolidate_incidents_by_pincode(incidents):
     """
     Consolidate incidents by pincode and create unified descriptions
     """
-    if not incidents:
-        return []
-    
-    # Group incidents by pincode
-    pincode_groups = defaultdict(list)
-    for incident in incidents:
-        pincode = incident.get('pincode', 'unknown')
-        pincode_groups[pincode].append(incident)
-    
-    consolidated = []
-    for pincode, group_incidents in pincode_groups.items():
-        if len(group_incidents) == 1:
-            # Single incident, use as is
-            incident = group_incidents[0]
-            incident['report_count'] = 1
-            consolidated.append(incident)
-        else:
-            # Multiple incidents, consolidate
-            main_incident = group_incidents[0].copy()  # Use first incident as base
-            
-            # Get all descriptions and create unified description
-            descriptions = [inc.get('description', '') for inc in group_incidents if inc.get('description')]
-            if descriptions:
-                # Create a unified description from all reports
-                unified_desc = create_unified_description(descriptions)
-                main_incident['description'] = unified_desc
-            
-            # Update other fields
-            main_incident['report_count'] = len(group_incidents)
-            main_incident['severity'] = max([inc.get('severity', 'low') for inc in group_incidents], 
-                                           key=lambda x: {'low': 1, 'medium': 2, 'high': 3}.get(x, 1))
-            
-            # Get the most recent timestamp
-            timestamps = [inc.get('timestamp') for inc in group_incidents if inc.get('timestamp')]
-            if timestamps:
-                main_incident['timestamp'] = max(timestamps)
-            
-            consolidated.append(main_incident)
-    
-    # Sort by timestamp (most recent first)
-    consolidated.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-    return consolidated
+    return IncidentService.consolidate_by_pincode(incidents)
 
 def create_unified_description(descriptions):
     """
     Create a unified description from multiple incident descriptions
     """
-    if not descriptions:
-        return "Multiple reports of incident in this area"
-    
-    # Clean and normalize descriptions
-    cleaned_descriptions = []
-    for desc in descriptions:
-        if desc and desc.strip():
-            # Remove extra whitespace and normalize
-            cleaned = re.sub(r'\s+', ' ', desc.strip())
-            cleaned_descriptions.append(cleaned)
-    
-    if not cleaned_descriptions:
-        return "Multiple reports of incident in this area"
-    
-    if len(cleaned_descriptions) == 1:
-        return cleaned_descriptions[0]
-    
-    # Find common words and phrases
-    all_words = []
-    for desc in cleaned_descriptions:
-        words = re.findall(r'\b\w+\b', desc.lower())
-        all_words.extend(words)
-    
-    # Count word frequency
-    word_freq = defaultdict(int)
-    for word in all_words:
-        if len(word) > 3:  # Only consider meaningful words
-            word_freq[word] += 1
-    
-    # Get most common words
-    common_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:5]
-    
-    # Create unified description
-    if common_words:
-        key_terms = [word for word, freq in common_words if freq > 1]
-        if key_terms:
-            base_desc = f"Multiple reports of incident involving: {', '.join(key_terms)}. "
-        else:
-            base_desc = "Multiple reports of incident in this area. "
-    else:
-        base_desc = "Multiple reports of incident in this area. "
-    
-    # Add summary of individual descriptions
-    if len(cleaned_descriptions) <= 3:
-        base_desc += "Reports include: " + "; ".join(cleaned_descriptions[:3])
-    else:
-        base_desc += f"Reports include: {cleaned_descriptions[0]} and {len(cleaned_descriptions)-1} other reports"
-    
-    return base_desc
+    return IncidentService._unify_description(descriptions)
 
 # Simple rate limiting for signup (moved into APP_STATE)
 
@@ -161,12 +79,85 @@ if not Config.is_supabase_configured():
     print("Warning: SUPABASE_URL or SUPABASE_KEY is not set. Set them in environment or .env file.")
     print("Database features will be disabled.")
 
-supabase: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY) if Config.is_supabase_configured() else None
+# Lazy, per-process client shared with every other module (None when Supabase is not configured)
+supabase = supabase_or_none()
 
 # Helpers
 def sb_available() -> bool:
     return supabase is not None
 
+def incident_cluster_service():
+    return IncidentClusterService(IncidentClusterRepository(supabase), IncidentRepository(supabase))
+
+
+def shelter_service():
+    """Process-wide shelter lookup service so its Overpass tile cache is shared across requests."""
+    if APP_STATE["shelter_service"] is None:
+        from services.shelter_service import ShelterService
+        APP_STATE["shelter_service"] = ShelterService()
+    return APP_STATE["shelter_service"]
+
+def shelter_catalog():
+    """Nearest-shelter index over the shelters table, built and refreshed by a background thread in each process."""
+    if APP_STATE["shelter_catalog"] is None:
+        from services.shelter_service import ShelterCatalog
+        APP_STATE["shelter_catalog"] = ShelterCatalog()
+    catalog = APP_STATE["shelter_catalog"]
+    if sb_available():
+        # Normally already started at worker boot; otherwise starts here without blocking the request
+        catalog.start(ShelterRepository(supabase))
+    return catalog
+
+def start_background_services():
+    """Warm the per-process indexes at worker boot (see gunicorn.conf.py) so no request builds them."""
+    shelter_catalog()
+
+def geocoding_service():
+    """Process-wide geocoder so the Nominatim rate limit and in-flight coalescing span all requests."""
+    if APP_STATE["geocoder"] is None:
+        APP_STATE["geocoder"] = GeocodingService(Config.GEOCODE_CACHE_PATH, max_queue=Config.GEOCODE_QUEUE_MAX)
+    return APP_STATE["geocoder"]
+
+def refresh_incident_cluster(pincode):
+    """Best-effort recompute of a pincode's clusters (None: incidents without one) after incidents change outside report_incident."""
+    if not sb_available():
+        return
+    try:
+        incident_cluster_service().refresh_pincode(pincode)
+    except Exception as e:
+        print(f"Error refreshing incident clusters for {pincode}: {e}")
+
+def request_cluster_rebuild():
+    """Queue tasks.rebuild_incident_clusters for a Celery worker, at most once every 10 minutes per process."""
+    now = time.time()
+    if now - APP_STATE["cluster_rebuild_requested_at"] < 600:
+        return
+    APP_STATE["cluster_rebuild_requested_at"] = now
+    try:
+        from celery_config import celery
+        celery.send_task("tasks.rebuild_incident_clusters", retry=False)
+    except Exception as e:
+        print(f"Could not queue the incident cluster rebuild: {e}")
+
+def record_incident_cluster(incident_row):
+    """Best-effort fold of an incident inserted directly by a route into its cluster."""
+    if not sb_available() or not incident_row:
+        return
+    try:
+        incident_cluster_service().record_report(incident_row)
+    except Exception as e:
+        print(f"Error updating incident cluster: {e}")
+
+request_budget.init_app(app, max_calls=Config.REQUEST_CALL_BUDGET, max_ms=Config.REQUEST_BACKEND_MS_BUDGET,
+                        repeat_threshold=Config.REQUEST_REPEAT_THRESHOLD)
+metrics.init_app(app)
+
+@app.before_request
+def track_presence():
+    """Mark signed-in users as active, so alerts also land in their in-app inbox."""
+    if session.get("user_id"):
+        mark_active(session["user_id"])
+
 def require_role(required_role):
     def decorator(f):
         def decorated_function(*args, **kwargs):
@@ -193,7 +184,7 @@ def fetch_weather_data(location):
                 allowed_methods=frozenset(["GET"]) 
             )
             _weather_session = requests.Session()
-            adapter = HTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=20)
+            adapter = InstrumentedHTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=20)
             _weather_session.mount("http://", adapter)
             _weather_session.mount("https://", adapter)
             _weather_session.headers.update({
@@ -655,7 +646,9 @@ def delete_incident(incident_id):
         return False
     
     try:
-        supabase.table("incidents").delete().eq("id", incident_id).execute()
+        resp = supabase.table("incidents").delete().eq("id", incident_id).execute()
+        for row in (resp.data or []) if resp else []:
+            refresh_incident_cluster(row.get('pincode'))
         return True
     except Exception as e:
         print(f"Error deleting incident: {e}")
@@ -702,7 +695,7 @@ def signup():
         # Use AuthService + UserRepository
         try:
             user_repo = UserRepository(supabase)
-            auth_service = AuthService(supabase, user_repo)
+            auth_service = AuthService(get_auth_client(), user_repo)
             user_id = auth_service.signup(name, email, phone, password, place, city, state, pincode, role)
             if not user_id:
                 flash("Could not create account. Please try again.", "danger")
@@ -768,7 +761,7 @@ def signin():
         # Use AuthService and UserRepository
         try:
             user_repo = UserRepository(supabase)
-            auth_service = AuthService(supabase, user_repo)
+            auth_service = AuthService(get_auth_client(), user_repo)
             res = auth_service.signin(email_or_phone, password)
             if not res:
                 flash("Invalid credentials or user not found", "danger")
@@ -827,12 +820,15 @@ def dashboard():
 @require_role("admin")
 def admin_dashboard():
     # Get incidents for admin to review
-    incidents = []
+    pending_incidents = []
     announcements = []
     admin_operations = []
     weather_data = []
     total_incidents = 0
-    forwarded_incidents = 0
+    forwarded_incidents = []
+    forwarded_count = 0
+    duplicate_groups = []
+    admin_updates = []
     total_donations = 0
     total_amount = 0
     sms_configured = False
@@ -842,21 +838,30 @@ def admin_dashboard():
             # Check and update weather alerts (remove resolved ones)
             check_and_update_weather_alerts()
             
-            # Get all incidents
-            inc_resp = supabase.table("incidents").select("*").order("timestamp", desc=True).execute()
-            all_incidents = inc_resp.data if inc_resp and inc_resp.data else []
-            
-            # Separate pending and forwarded incidents
-            pending_incidents = [i for i in all_incidents if i.get('status') != 'forwarded']
-            forwarded_incidents = [i for i in all_incidents if i.get('status') == 'forwarded']
-            
-            # Consolidate incidents by pincode via service (same behavior)
-            pending_incidents = IncidentService.consolidate_by_pincode(pending_incidents)
-            forwarded_incidents = IncidentService.consolidate_by_pincode(forwarded_incidents)
-            
-            # Get statistics
-            total_incidents = len(all_incidents)
-            forwarded_count = len([i for i in all_incidents if i.get('status') == 'forwarded'])
+            # Read the incrementally maintained per-pincode clusters
+            inc_repo = IncidentRepository(supabase)
+            total_incidents = inc_repo.count()
+            forwarded_count = inc_repo.count('forwarded')
+            try:
+                cluster_service = IncidentClusterService(IncidentClusterRepository(supabase), inc_repo)
+                if total_incidents and not cluster_service.has_clusters():
+                    # Backfill runs in a worker; the page shows the clusters once it lands
+                    request_cluster_rebuild()
+                    flash("Incident groups are being built; refresh in a minute.", "info")
+                pending_incidents = cluster_service.consolidated('pending')
+                forwarded_incidents = cluster_service.consolidated('forwarded')
+            except Exception as cluster_err:
+                # Cluster table not migrated yet: regroup raw incidents as before
+                print(f"Incident clusters unavailable, consolidating raw incidents: {cluster_err}")
+                all_incidents = inc_repo.list_all()
+                pending_incidents = IncidentService.consolidate_by_pincode([i for i in all_incidents if i.get('status') != 'forwarded'])
+                forwarded_incidents = IncidentService.consolidate_by_pincode([i for i in all_incidents if i.get('status') == 'forwarded'])
+
+            # Near-duplicate report groups across pincodes, precomputed by tasks.refresh_duplicate_groups
+            try:
+                duplicate_groups = DuplicateSignatureRepository(supabase).load_groups()[:10]
+            except Exception as dup_err:
+                print(f"Duplicate detection unavailable: {dup_err}")
             
             # Get donation statistics (include verified, completed, success, paid)
             try:
@@ -965,6 +970,7 @@ def admin_dashboard():
                          weather_data=weather_data,
                          total_incidents=total_incidents,
                          forwarded_incidents_count=forwarded_count,
+                         duplicate_groups=duplicate_groups,
                          total_donations=total_donations,
                          total_amount=total_amount,
                          sms_configured=sms_configured)
@@ -1291,7 +1297,8 @@ def report_incident():
 
         try:
             inc_repo = IncidentRepository(supabase)
-            inc_service = IncidentService(inc_repo, session=session)
+            inc_service = IncidentService(inc_repo, session=session,
+                                          cluster_service=IncidentClusterService(IncidentClusterRepository(supabase), inc_repo))
             new_id = inc_service.report_incident(session["user_id"], {
                 "location": location,
                 "address": address,
@@ -1371,6 +1378,7 @@ def donate():
             if method == "upi":
                 # Generate direct UPI QR with fixed receiving UPI ID
                 try:
+                    import qrcode
                     receiver_upi = getattr(upi_payment_service, 'upi_id', None) or "devsakhya2004@okicici"
                     upi_link = f"upi://pay?pa={receiver_upi}&pn={donor_name}&am={amount}&cu=INR"
                     qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
@@ -1618,7 +1626,9 @@ def forward_incident():
         req_repo = RequestRepository(supabase)
         ann_repo = AnnouncementRepository(supabase)
         ann_service = AnnouncementService(ann_repo, UserRepository(supabase), session)
-        inc_service = IncidentService(inc_repo, req_repo, ann_service, sms_service, Config, session)
+        from sms_service import sms_service
+        inc_service = IncidentService(inc_repo, req_repo, ann_service, sms_service, Config, session,
+                                      cluster_service=IncidentClusterService(IncidentClusterRepository(supabase), inc_repo))
         result = inc_service.forward_incident(session["user_id"], int(incident_id))
         if result.get("already"):
             flash("This incident has already been forwarded to government", "warning")
@@ -1822,21 +1832,27 @@ def assign_emergency_team():
             "assigned_at": datetime.now().isoformat(),
         }
 
-        ins = supabase.table("emergency_assignments").insert(assignment_payload).execute()
-        if not ins or not ins.data:
-            flash("Could not create team assignment.", "danger")
-            return redirect(url_for("government_dashboard"))
-
-        supabase.table("emergency_units").update({
+        # One round trip, all or nothing; the unit is claimed only if no concurrent dispatch took it first
+        uow = UnitOfWork(supabase)
+        uow.update("emergency_units", {
             "status": "Busy",
             "last_update": datetime.now().isoformat(),
-        }).eq("id", int(unit_id)).execute()
-
-        supabase.table("requests").update({
+        }, {"id": int(unit_id)}, exclude={"status": "Busy"}, expect=True)
+        ins = uow.insert("emergency_assignments", assignment_payload)
+        uow.update("requests", {
             "status": "assigned",
             "assigned_at": datetime.now().isoformat(),
-        }).eq("id", int(request_id)).execute()
+        }, {"id": int(request_id)})
+        try:
+            written = uow.commit()
+        except UnitOfWorkConflict:
+            flash(f"{unit.get('unit_name')} is already on another assignment.", "warning")
+            return redirect(url_for("government_dashboard"))
+        if not written[ins]:
+            flash("Could not create team assignment.", "danger")
+            return redirect(url_for("government_dashboard"))
 
+        # Best-effort, outside the unit: a failed notification must not undo the dispatch
         try:
             supabase.table("emergency_notifications").insert({
                 "request_id": int(request_id),
@@ -1935,6 +1951,21 @@ def notify_emergency_head():
         flash(f"Error sending notification: {err}", "danger")
     return redirect(url_for("government_dashboard"))
 
+def iter_assignment_updates(assignment_ids, columns="id, assignment_id, author_id, rescued_count, critical_count, message, created_at",
+                            page_size=1000, chunk_size=200):
+    """Yield the updates of the given assignments, paging by id so PostgREST's max-rows cap never truncates them."""
+    for start in range(0, len(assignment_ids), chunk_size):
+        chunk = assignment_ids[start:start + chunk_size]
+        last_id = 0
+        while True:
+            resp = (supabase.table("emergency_updates").select(columns).in_("assignment_id", chunk)
+                    .gt("id", last_id).order("id").limit(page_size).execute())
+            rows = resp.data if resp and resp.data else []
+            yield from rows
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1]["id"]
+
 @app.route("/emergency_dashboard")
 @require_role("emergency")
 def emergency_dashboard():
@@ -1979,13 +2010,15 @@ def emergency_dashboard():
             active_assignments = len(assignments)
             completed_tasks = len(completed_assignments)
             
-            # Calculate total rescued count from updates
-            for assignment in all_assignments:
-                up_resp = supabase.table("emergency_updates").select("rescued_count").eq("assignment_id", assignment.get("id")).execute()
-                if up_resp and up_resp.data:
-                    for update in up_resp.data:
-                        if update.get('rescued_count'):
-                            rescued_count += int(update.get('rescued_count', 0))
+            # Updates for all my assignments, read in pages (not one query per assignment): the
+            # rescued total and the three most recent per active assignment both come from them
+            updates_by_assignment = {}
+            for update in iter_assignment_updates([a.get("id") for a in all_assignments]):
+                updates_by_assignment.setdefault(update.get("assignment_id"), []).append(update)
+                if update.get('rescued_count'):
+                    rescued_count += int(update.get('rescued_count', 0))
+            for updates in updates_by_assignment.values():
+                updates.sort(key=lambda u: u.get("created_at") or "", reverse=True)
             
             # Notifications to me if I am head
             notif_resp = supabase.table("emergency_notifications").select("*, requests(incidents(location, description))").eq("head_id", session.get("user_id")).order("created_at", desc=True).execute()
@@ -1997,8 +2030,7 @@ def emergency_dashboard():
             
             # Recent updates per assignment
             for a in assignments:
-                up_resp = supabase.table("emergency_updates").select("*").eq("assignment_id", a.get("id")).order("created_at", desc=True).limit(3).execute()
-                updates_map[a.get("id")] = up_resp.data if up_resp and up_resp.data else []
+                updates_map[a.get("id")] = updates_by_assignment.get(a.get("id"), [])[:3]
                 
         except Exception as err:
             flash(f"Error loading assignments: {err}", "danger")
@@ -2058,36 +2090,38 @@ def head_assign_unit():
             flash("Unit not found", "danger")
             return redirect(url_for("emergency_dashboard"))
         unit = u_resp.data[0]
-        # Mark unit Busy
-        supabase.table("emergency_units").update({"status": "Busy", "last_update": None}).eq("id", int(unit_id)).execute()
-        # Fetch incident location
-        req_resp = supabase.table("requests").select("incident_id").eq("id", int(request_id)).limit(1).execute()
-        incident_id = req_resp.data[0]["incident_id"] if req_resp and req_resp.data else None
-        loc_text = None
-        if incident_id:
-            inc_resp = supabase.table("incidents").select("location").eq("id", incident_id).limit(1).execute()
-            loc_text = inc_resp.data[0]["location"] if inc_resp and inc_resp.data else None
+        # Fetch incident location (embedded, one query)
+        req_resp = supabase.table("requests").select("incident_id, incidents(location)").eq("id", int(request_id)).limit(1).execute()
+        incident = (req_resp.data[0].get("incidents") if req_resp and req_resp.data else None) or {}
+        loc_text = incident.get("location")
         # Create assignment under my user as lead
         payload = {
             "request_id": int(request_id),
             "team_name": unit["unit_name"],
-            "team_type": unit["unit_category"],
+            "team_type": _team_type_from_unit_category(unit.get("unit_category")),
             "team_lead_id": session.get("user_id"),
             "location_text": loc_text,
             "notes": f"Assigned unit #{unit['id']}",
             "status": "Assigned",
         }
-        supabase.table("emergency_assignments").insert(payload).execute()
+        uow = UnitOfWork(supabase)
+        # Mark unit Busy, unless a concurrent assignment already did
+        uow.update("emergency_units", {"status": "Busy", "last_update": None}, {"id": int(unit_id)},
+                   exclude={"status": "Busy"}, expect=True)
+        uow.insert("emergency_assignments", payload)
         # Move request out of pending/notified → assigned
-        try:
-            supabase.table("requests").update({
-                "status": "assigned",
-                "assigned_at": datetime.now().isoformat()
-            }).eq("id", int(request_id)).execute()
-        except Exception:
-            pass
+        uow.update("requests", {
+            "status": "assigned",
+            "assigned_at": datetime.now().isoformat()
+        }, {"id": int(request_id)})
         # Mark notification acknowledged if exists
-        supabase.table("emergency_notifications").update({"status": "Acknowledged"}).eq("request_id", int(request_id)).eq("head_id", session.get("user_id")).execute()
+        uow.update("emergency_notifications", {"status": "Acknowledged"},
+                   {"request_id": int(request_id), "head_id": session.get("user_id")})
+        try:
+            uow.commit()
+        except UnitOfWorkConflict:
+            flash(f"{unit['unit_name']} is already on another assignment.", "warning")
+            return redirect(url_for("emergency_dashboard"))
         flash("Unit assigned and government notified.", "success")
     except Exception as err:
         flash(f"Error assigning unit: {err}", "danger")
@@ -2197,6 +2231,7 @@ def emergency_update():
                         
                         if secondary_incident_resp and secondary_incident_resp.data:
                             secondary_incident_id = secondary_incident_resp.data[0]['id']
+                            record_incident_cluster(secondary_incident_resp.data[0])
                             
                             # Get admin user ID for the request
                             admin_resp = supabase.table("users").select("id").eq("role", "admin").limit(1).execute()
@@ -2379,47 +2414,41 @@ def complete_assignment():
         return redirect(url_for("emergency_dashboard"))
     
     try:
-        # Verify assignment belongs to current user
-        assignment_resp = supabase.table("emergency_assignments").select("id, team_lead_id").eq("id", assignment_id).eq("team_lead_id", session.get("user_id")).execute()
+        # Verify assignment belongs to current user (and get the request to update with it)
+        assignment_resp = supabase.table("emergency_assignments").select("id, team_lead_id, request_id").eq("id", assignment_id).eq("team_lead_id", session.get("user_id")).execute()
         
         if not assignment_resp or not assignment_resp.data:
             flash("Assignment not found or access denied", "danger")
             return redirect(url_for("emergency_dashboard"))
         
-        # Get assignment details to update related records
-        assignment_details = supabase.table("emergency_assignments").select("request_id").eq("id", assignment_id).execute()
-        request_id = assignment_details.data[0]['request_id'] if assignment_details and assignment_details.data else None
+        request_id = assignment_resp.data[0].get('request_id')
         
+        uow = UnitOfWork(supabase)
         # Update assignment status to completed
-        update_result = supabase.table("emergency_assignments").update({
+        uow.update("emergency_assignments", {
             "status": "Completed",
             "completed_at": datetime.now().isoformat()
-        }).eq("id", assignment_id).execute()
-        
-        if update_result.data:
-            # Create completion update
-            update_payload = {
-                "assignment_id": int(assignment_id),
-                "author_id": session.get("user_id"),
-                "message": f"Assignment completed. {completion_notes}".strip(),
-                "status": "completed"
-            }
-            supabase.table("emergency_updates").insert(update_payload).execute()
-            
+        }, {"id": int(assignment_id), "team_lead_id": session.get("user_id")}, expect=True)
+        # Create completion update
+        uow.insert("emergency_updates", {
+            "assignment_id": int(assignment_id),
+            "author_id": session.get("user_id"),
+            "message": f"Assignment completed. {completion_notes}".strip(),
+            "status": "completed"
+        })
+        if request_id:
             # Update request status to completed
-            if request_id:
-                supabase.table("requests").update({
-                    "status": "completed",
-                    "completed_at": datetime.now().isoformat()
-                }).eq("id", request_id).execute()
-                
-                # Update government notification status to completed
-                supabase.table("emergency_notifications").update({
-                    "status": "Completed"
-                }).eq("request_id", request_id).execute()
-            
+            uow.update("requests", {
+                "status": "completed",
+                "completed_at": datetime.now().isoformat()
+            }, {"id": request_id})
+            # Update government notification status to completed
+            uow.update("emergency_notifications", {"status": "Completed"}, {"request_id": request_id})
+        
+        try:
+            uow.commit()
             flash("Assignment completed successfully! Status updated in government dashboard.", "success")
-        else:
+        except UnitOfWorkConflict:
             flash("Failed to complete assignment.", "danger")
             
     except Exception as err:
@@ -2473,6 +2502,7 @@ def request_additional_support():
             
             if support_incident_resp and support_incident_resp.data:
                 support_incident_id = support_incident_resp.data[0]['id']
+                record_incident_cluster(support_incident_resp.data[0])
                 
                 # Create request for government
                 admin_resp = supabase.table("users").select("id").eq("role", "admin").limit(1).execute()
@@ -2551,20 +2581,20 @@ def assign_more_teams():
             flash("No emergency heads available", "danger")
             return redirect(url_for("government_dashboard"))
         
-        # Create additional assignments for each selected unit
-        created_assignments = []
+        # All selected units in one query
+        units_resp = supabase.table("emergency_units").select("*").in_("id", [int(u) for u in unit_ids]).execute()
+        units_by_id = {u["id"]: u for u in (units_resp.data if units_resp and units_resp.data else [])}
+        
+        # Create additional assignments for each selected unit, written together in one unit of work
+        assignment_payloads = []
+        notification_payloads = []
         for unit_id in unit_ids:
-            # Get unit details
-            unit_resp = supabase.table("emergency_units").select("*, users(name, email)").eq("id", unit_id).execute()
-            
-            if not unit_resp or not unit_resp.data:
+            unit_data = units_by_id.get(int(unit_id))
+            if not unit_data:
                 continue
             
-            unit_data = unit_resp.data[0]
-            team_lead = unit_data.get('users', {})
-            
             # Assign to an available emergency head (round-robin)
-            head_index = len(created_assignments) % len(emergency_heads)
+            head_index = len(assignment_payloads) % len(emergency_heads)
             assigned_head = emergency_heads[head_index]
             
             new_assignment_payload = {
@@ -2579,19 +2609,22 @@ def assign_more_teams():
                 "notes": f"Additional team assignment. {notes}".strip()
             }
             
-            assignment_result = supabase.table("emergency_assignments").insert(new_assignment_payload).execute()
+            assignment_payloads.append(new_assignment_payload)
             
-            if assignment_result and assignment_result.data:
-                created_assignments.append(assignment_result.data[0])
-                
-                # Create notification for the emergency head
-                notification_payload = {
-                    "head_id": assigned_head['id'],
-                    "request_id": original_assignment.get('request_id'),
-                    "message": f"Additional team assignment for incident at {original_incident.get('location', 'Emergency Location')}. Unit: {unit_data.get('unit_name', 'Emergency Unit')}",
-                    "status": "Pending"
-                }
-                supabase.table("emergency_notifications").insert(notification_payload).execute()
+            # Notification for the emergency head
+            notification_payloads.append({
+                "gov_id": session.get("user_id"),
+                "head_id": assigned_head['id'],
+                "request_id": original_assignment.get('request_id'),
+                "status": "Pending"
+            })
+        
+        created_assignments = []
+        if assignment_payloads:
+            uow = UnitOfWork(supabase)
+            uow.insert("emergency_assignments", assignment_payloads)
+            uow.insert("emergency_notifications", notification_payloads)
+            created_assignments = uow.commit()[0]
         
         if created_assignments:
             flash(f"Successfully assigned {len(created_assignments)} additional team(s)!", "success")
@@ -2611,7 +2644,9 @@ def gov_delete_incident(incident_id: int):
         flash("Database is not configured.", "danger")
         return redirect(url_for("government_dashboard"))
     try:
-        supabase.table("incidents").delete().eq("id", int(incident_id)).execute()
+        resp = supabase.table("incidents").delete().eq("id", int(incident_id)).execute()
+        for row in (resp.data or []) if resp else []:
+            refresh_incident_cluster(row.get('pincode'))
         flash("Incident deleted.", "success")
     except Exception as err:
         flash(f"Error deleting incident: {err}", "danger")
@@ -2674,18 +2709,6 @@ def notify_admin_resolved():
             flash("Incident data not found", "danger")
             return redirect(url_for("government_dashboard"))
         
-        # Update incident status to resolved
-        supabase.table("incidents").update({
-            "status": "resolved",
-            "resolved_at": datetime.now().isoformat()
-        }).eq("id", incident_data['id']).execute()
-        
-        # Update request status to completed
-        supabase.table("requests").update({
-            "status": "completed",
-            "completed_at": datetime.now().isoformat()
-        }).eq("id", request_id).execute()
-        
         # Create admin notification announcement
         admin_resp = supabase.table("users").select("id").eq("role", "admin").limit(1).execute()
         admin_id = admin_resp.data[0]['id'] if admin_resp and admin_resp.data else session.get("user_id")
@@ -2719,9 +2742,26 @@ Stay safe and thank you for your coordination.
             "timestamp": "now()"
         }
         
-        ann_result = supabase.table("announcements").insert(resolution_announcement).execute()
+        # Incident resolved, request completed and admin announcement written together
+        uow = UnitOfWork(supabase)
+        uow.update("incidents", {
+            "status": "resolved",
+            "resolved_at": datetime.now().isoformat()
+        }, {"id": incident_data['id']})
+        uow.update("requests", {
+            "status": "completed",
+            "completed_at": datetime.now().isoformat()
+        }, {"id": int(request_id)})
+        ann = uow.insert("announcements", resolution_announcement)
+        try:
+            written = uow.commit()
+        except Exception as err:
+            # Through apply_unit_of_work a failed announcement rolls the resolution back with it
+            flash(f"Disaster not marked as resolved: could not notify admin ({err}).", "danger")
+            return redirect(url_for("government_dashboard"))
+        refresh_incident_cluster(incident_data.get('pincode'))
         
-        if ann_result and ann_result.data:
+        if written[ann]:
             flash("✅ Disaster marked as resolved! Admin has been notified to review announcements.", "success")
         else:
             flash("Disaster marked as resolved but failed to notify admin.", "warning")
@@ -2743,158 +2783,79 @@ def nearby_shelters():
             flash("Please enter a location", "warning")
             return redirect(url_for("nearby_shelters"))
 
+        from services.shelter_service import classify_shelter, estimate_capacity, rank_nearest
+
         try:
-            # Get user coordinates using geopy with timeout
-            geolocator = Nominatim(user_agent="disaster_management", timeout=10)
-            location = geolocator.geocode(user_location, timeout=10)
+            # Get user coordinates from the cached, rate-limited geocoder
+            location = geocoding_service().geocode(user_location)
             
             if not location:
                 flash("Could not find the location. Please try a different address.", "warning")
                 return redirect(url_for("nearby_shelters"))
             
-            user_lat, user_lon = location.latitude, location.longitude
+            user_lat, user_lon = location["lat"], location["lon"]
             
-            # Search for shelters using Overpass API (OpenStreetMap)
-            api = overpy.Overpass()
+            # Imported OSM shelters are answered from the in-memory catalog without any network call
+            catalog_hits = []
+            try:
+                catalog_hits = shelter_catalog().nearest(user_lat, user_lon, k=50, radius_km=10)
+            except Exception as err:
+                print(f"Shelter catalog unavailable, falling back to Overpass: {err}")
             
-            # Query for public gathering places: schools, colleges, auditoriums, museums, parks
-            query = f"""
-            [out:json][timeout:25];
-            (
-              node["amenity"="shelter"](around:10000,{user_lat},{user_lon});
-              node["building"="school"](around:10000,{user_lat},{user_lon});
-              node["building"="college"](around:10000,{user_lat},{user_lon});
-              node["amenity"="community_centre"](around:10000,{user_lat},{user_lon});
-              node["amenity"="place_of_worship"](around:10000,{user_lat},{user_lon});
-              node["building"="church"](around:10000,{user_lat},{user_lon});
-              node["building"="temple"](around:10000,{user_lat},{user_lon});
-              node["building"="mosque"](around:10000,{user_lat},{user_lon});
-              node["amenity"="auditorium"](around:10000,{user_lat},{user_lon});
-              node["tourism"="museum"](around:10000,{user_lat},{user_lon});
-              node["leisure"="park"](around:10000,{user_lat},{user_lon});
-              node["leisure"="sports_centre"](around:10000,{user_lat},{user_lon});
-              node["amenity"="theatre"](around:10000,{user_lat},{user_lon});
-              node["amenity"="conference_centre"](around:10000,{user_lat},{user_lon});
-              way["amenity"="shelter"](around:10000,{user_lat},{user_lon});
-              way["building"="school"](around:10000,{user_lat},{user_lon});
-              way["building"="college"](around:10000,{user_lat},{user_lon});
-              way["amenity"="community_centre"](around:10000,{user_lat},{user_lon});
-              way["amenity"="place_of_worship"](around:10000,{user_lat},{user_lon});
-              way["building"="church"](around:10000,{user_lat},{user_lon});
-              way["building"="temple"](around:10000,{user_lat},{user_lon});
-              way["building"="mosque"](around:10000,{user_lat},{user_lon});
-              way["amenity"="auditorium"](around:10000,{user_lat},{user_lon});
-              way["tourism"="museum"](around:10000,{user_lat},{user_lon});
-              way["leisure"="park"](around:10000,{user_lat},{user_lon});
-              way["leisure"="sports_centre"](around:10000,{user_lat},{user_lon});
-              way["amenity"="theatre"](around:10000,{user_lat},{user_lon});
-              way["amenity"="conference_centre"](around:10000,{user_lat},{user_lon});
-            );
-            out body;
-            >;
-            out skel qt;
-            """
+            for row, distance in catalog_hits:
+                shelter_type = row.get("shelter_type") or "Database Shelter"
+                shelters.append({
+                    "name": row["name"],
+                    "type": shelter_type,
+                    "address": row.get("location"),
+                    "distance": f"{distance:.1f} km",
+                    "distance_km": distance,
+                    "lat": float(row["latitude"]),
+                    "lon": float(row["longitude"]),
+                    "capacity": f"{row['available']}/{row['capacity']}" if row.get("capacity") else estimate_capacity(shelter_type),
+                    "phone": row.get("phone") or "Contact not available"
+                })
             
-            result = api.query(query)
+            # Search for shelters using Overpass API (OpenStreetMap), served from cached ~5 km tiles,
+            # only when the catalog has nothing for this area
+            candidates = [] if catalog_hits else shelter_service().candidates(user_lat, user_lon, radius_km=10)
             
-            # Process results
-            for node in result.nodes:
-                # Only include places with actual names, skip generic ones
-                shelter_name = node.tags.get("name")
-                if not shelter_name or shelter_name in ["", "Unnamed", "Unknown"]:
-                    continue
-                
-                # Determine shelter type based on tags
-                if node.tags.get("amenity") == "shelter":
-                    shelter_type = "Emergency Shelter"
-                elif node.tags.get("building") == "school":
-                    shelter_type = "School"
-                elif node.tags.get("building") == "college":
-                    shelter_type = "College"
-                elif node.tags.get("amenity") == "place_of_worship":
-                    shelter_type = "Place of Worship"
-                elif node.tags.get("building") in ["church", "temple", "mosque"]:
-                    shelter_type = node.tags.get("building").title()
-                elif node.tags.get("amenity") == "community_centre":
-                    shelter_type = "Community Center"
-                elif node.tags.get("amenity") == "auditorium":
-                    shelter_type = "Auditorium"
-                elif node.tags.get("tourism") == "museum":
-                    shelter_type = "Museum"
-                elif node.tags.get("leisure") == "park":
-                    shelter_type = "Park"
-                elif node.tags.get("leisure") == "sports_centre":
-                    shelter_type = "Sports Center"
-                elif node.tags.get("amenity") == "theatre":
-                    shelter_type = "Theater"
-                elif node.tags.get("amenity") == "conference_centre":
-                    shelter_type = "Conference Center"
-                else:
-                    shelter_type = "Public Facility"
-                
-                # Calculate distance
-                shelter_lat = float(node.lat)
-                shelter_lon = float(node.lon)
-                distance = geodesic((user_lat, user_lon), (shelter_lat, shelter_lon)).kilometers
-                
-                # Get contact information
-                phone = node.tags.get("phone") or node.tags.get("contact:phone") or "Contact not available"
-                
-                # Estimate capacity based on type
-                if shelter_type in ["School", "College"]:
-                    capacity = "Large (500+ people)"
-                elif shelter_type in ["Church", "Temple", "Mosque"]:
-                    capacity = "Medium (100-500 people)"
-                elif shelter_type == "Park":
-                    capacity = "Very Large (1000+ people)"
-                elif shelter_type == "Museum":
-                    capacity = "Medium (200-500 people)"
-                elif shelter_type in ["Auditorium", "Theater"]:
-                    capacity = "Large (300-800 people)"
-                elif shelter_type == "Conference Center":
-                    capacity = "Large (200-1000 people)"
-                elif shelter_type == "Sports Center":
-                    capacity = "Very Large (500+ people)"
-                else:
-                    capacity = "Contact for details"
-                
+            # Rank the tile candidates: vectorized distances, nearest 50 within the original 10 km radius
+            for node, distance in rank_nearest(user_lat, user_lon, candidates, k=50, radius_km=10):
+                tags = node["tags"]
+                shelter_type = node.get("type") or classify_shelter(tags)
                 shelters.append({
-                    "name": shelter_name,
+                    "name": tags["name"],
                     "type": shelter_type,
-                    "address": f"Lat: {shelter_lat:.4f}, Lon: {shelter_lon:.4f}",
+                    "address": f"Lat: {node['lat']:.4f}, Lon: {node['lon']:.4f}",
                     "distance": f"{distance:.1f} km",
-                    "lat": shelter_lat,
-                    "lon": shelter_lon,
-                    "capacity": capacity,
-                    "phone": phone
+                    "distance_km": distance,
+                    "lat": node["lat"],
+                    "lon": node["lon"],
+                    "capacity": estimate_capacity(shelter_type),
+                    "phone": tags.get("phone") or tags.get("contact:phone") or "Contact not available"
                 })
             
-            # Also get shelters from database as backup
+            # Also list database shelters that have no coordinates (located ones come from the catalog)
             if sb_available():
                 try:
-                    resp = supabase.table("shelters").select("*").execute()
-                    db_shelters = resp.data if resp and resp.data else []
+                    db_shelters = ShelterRepository(supabase).list_unlocated()
                     
                     for shelter in db_shelters:
-                        # Calculate distance to database shelter
-                        shelter_lat = 0  # You'd need to add lat/lon to your database
-                        shelter_lon = 0
-                        distance = geodesic((user_lat, user_lon), (shelter_lat, shelter_lon)).kilometers if shelter_lat != 0 else "N/A"
-                        
                         shelters.append({
                             "name": shelter["name"],
                             "type": "Database Shelter",
                             "address": shelter["location"],
                             "capacity": f"{shelter['available']}/{shelter['capacity']}",
-                            "distance": f"{distance:.1f} km" if distance != "N/A" else "N/A",
-                            "lat": shelter_lat,
-                            "lon": shelter_lon
+                            "distance": "N/A",
+                            "lat": 0,
+                            "lon": 0
                         })
                 except Exception as err:
                     pass  # Continue with OSM results
             
             # Sort by distance (nearest first)
-            shelters.sort(key=lambda x: float(x["distance"].split()[0]) if x["distance"] != "N/A" else float('inf'))
+            shelters.sort(key=lambda x: x.get("distance_km", float('inf')))
             
             if not shelters:
                 flash("No shelters found nearby. Try expanding your search area.", "info")
@@ -2922,6 +2883,116 @@ def nearby_shelters():
 
     return render_template("nearby_shelters.html", shelters=shelters, user_location=user_location)
 
+@app.route("/api/geocode")
+def api_geocode():
+    """Cached geocoding for the browser, so pages never call Nominatim directly"""
+    if "user" not in session:
+        return jsonify({"error": "Please sign in first"}), 401
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"error": "Query parameter q is required"}), 400
+    
+    try:
+        location = geocoding_service().geocode(query)
+    except GeocoderBusy:
+        return jsonify({"error": "Location search is busy, please try again shortly", "busy": True}), 503, {"Retry-After": "5"}
+    except Exception as e:
+        return jsonify({"error": f"Geocoding failed: {e}"}), 502
+    
+    if not location:
+        return jsonify({"error": "Location not found"}), 404
+    return jsonify(location)
+
+@app.route("/api/notifications")
+def api_notifications():
+    """In-app inbox for the signed-in user, as JSON"""
+    if "user" not in session:
+        return jsonify({"error": "Please sign in first"}), 401
+    if not sb_available():
+        return jsonify({"error": "Database not configured"}), 500
+    unread_only = request.args.get("unread") == "1"
+    try:
+        items = NotificationRepository(supabase).list_inbox(session["user_id"], unread_only=unread_only)
+    except Exception as e:
+        return jsonify({"error": f"Could not load notifications: {e}"}), 500
+    return jsonify({"notifications": items})
+
+@app.route("/api/notifications/read", methods=["POST"])
+def api_notifications_read():
+    if "user" not in session:
+        return jsonify({"error": "Please sign in first"}), 401
+    if not sb_available():
+        return jsonify({"error": "Database not configured"}), 500
+    ids = [int(i) for i in ((request.get_json(silent=True) or {}).get("ids") or []) if str(i).isdigit()]
+    try:
+        NotificationRepository(supabase).mark_read(session["user_id"], ids, datetime.now().isoformat())
+    except Exception as e:
+        return jsonify({"error": f"Could not update notifications: {e}"}), 500
+    return jsonify({"success": True, "updated": len(ids)})
+
+@app.route("/api/push/subscribe", methods=["POST"])
+def api_push_subscribe():
+    """Save the browser's Web Push subscription (PushSubscription.toJSON()) for the signed-in user"""
+    if "user" not in session:
+        return jsonify({"error": "Please sign in first"}), 401
+    if not sb_available():
+        return jsonify({"error": "Database not configured"}), 500
+    if not Config.is_push_configured():
+        return jsonify({"error": "Push notifications are not configured"}), 503
+    subscription = request.get_json(silent=True) or {}
+    keys = subscription.get("keys") or {}
+    if not subscription.get("endpoint") or not keys.get("p256dh") or not keys.get("auth"):
+        return jsonify({"error": "Invalid subscription"}), 400
+    try:
+        NotificationRepository(supabase).save_push_subscription(session["user_id"], subscription)
+    except Exception as e:
+        return jsonify({"error": f"Could not save subscription: {e}"}), 500
+    return jsonify({"success": True, "vapid_public_key": Config.VAPID_PUBLIC_KEY})
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition: requests, Celery tasks and queues, outbound HTTP, caches and SMS"""
+    allowed = (Config.METRICS_PUBLIC
+               or (Config.METRICS_TOKEN and request.headers.get("Authorization") == f"Bearer {Config.METRICS_TOKEN}")
+               or request.remote_addr in Config.METRICS_ALLOWED_IPS)
+    if not allowed:
+        return "Unauthorized\n", 401
+    lines = []
+    for histogram in (metrics.request_latency, metrics.request_backend_calls, metrics.celery_task_duration,
+                      metrics.outbound_latency, metrics.sms_lane_latency):
+        lines += metrics.render_histogram(histogram)
+    lines += metrics.render_counter(metrics.outbound_errors)
+    lines += metrics.render_values("celery_queue_depth", "gauge", "Messages waiting in each Celery queue",
+                                   ("queue",), metrics.celery_queue_depths())
+
+    # Caches of this process, only those already created (scraping must not build them)
+    caches = {}
+    if APP_STATE["shelter_service"] is not None:
+        caches["shelter_tiles"] = APP_STATE["shelter_service"].cache
+    if APP_STATE["geocoder"] is not None:
+        caches["geocode"] = APP_STATE["geocoder"]
+    lines += metrics.render_values("cache_hits_total", "counter", "Cache hits", ("cache",),
+                                   {name: c.hits for name, c in caches.items()})
+    lines += metrics.render_values("cache_misses_total", "counter", "Cache misses", ("cache",),
+                                   {name: c.misses for name, c in caches.items()})
+    lines += metrics.render_values("cache_hit_ratio", "gauge", "Cache hits over lookups", ("cache",),
+                                   {name: c.hits / (c.hits + c.misses) for name, c in caches.items() if c.hits + c.misses})
+
+    pool = pool_stats()
+    lines += metrics.render_values("supabase_pool_requests_total", "counter", "Supabase HTTP requests from this process", (), {"": pool["requests"]})
+    lines += metrics.render_values("supabase_pool_errors_total", "counter", "Supabase HTTP requests that raised", (), {"": pool["errors"]})
+    lines += metrics.render_values("supabase_pool_in_flight", "gauge", "Supabase HTTP requests in flight", (), {"": pool["in_flight"]})
+    lines += metrics.render_values("supabase_pool_connections", "gauge", "Open Supabase connections", (), {"": pool["connections"]})
+
+    # The SMS service is only loaded by routes that send; report it once it is
+    sms_module = sys.modules.get("sms_service")
+    if sms_module is not None:
+        lines += metrics.render_values("sms_log_queue_depth", "gauge", "SMS log rows buffered in this process", (),
+                                       {"": sms_module.sms_service.log_queue_depth()})
+        lines += metrics.render_values("sms_segments_sent_total", "counter", "Billable SMS segments sent by this process", (),
+                                       {"": sms_module.sms_service.segments_sent})
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 @app.route("/announcements")
 def announcements():
     if "user" not in session:
@@ -2947,11 +3018,7 @@ def logout():
     session.pop("user_id", None)
     session.pop("user_email", None)
     session.pop("user_role", None)
-    try:
-        if sb_available():
-            supabase.auth.sign_out()
-    except Exception:
-        pass
+    # Sign-ins use a throwaway auth client (get_auth_client), so there is no Supabase session to end here
     flash("Logged out successfully!", "info")
     return redirect(url_for("home"))
 
@@ -2984,4 +3051,5 @@ def admin_verify_donation(transaction_id):
     return redirect(url_for("pending_donations"))
 
 if __name__ == "__main__":
+    start_background_services()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Benchmark for near-duplicate incident detection (MinHash/LSH)
+
+Generates synthetic incident reports, plants near-duplicates with reworded
+descriptions and mistyped pincodes, and measures indexing throughput, query
+latency and recall/precision of the planted pairs.
+
+Usage: python -m benchmarks.bench_duplicate_detection [num_reports]
+"""
+import random
+import sys
+import time
+
+from services.duplicate_detection import DuplicateReportIndex
+
+EVENTS = ['flood', 'fire', 'landslide', 'building collapse', 'gas leak', 'road accident',
+          'power line down', 'tree fall', 'waterlogging', 'cyclone damage', 'earthquake cracks']
+CITIES = ['Mumbai', 'Pune', 'Chennai', 'Kolkata', 'Delhi', 'Bangalore', 'Hyderabad', 'Patna', 'Guwahati']
+SYLLABLES = ['ra', 'ma', 'ni', 'shi', 'ko', 'pal', 'van', 'gar', 'pur', 'nag', 'tol', 'dev', 'sam',
+             'kan', 'bha', 'lak', 'sri', 'hal', 'ven', 'dur', 'mir', 'tan', 'gop', 'jai', 'kal']
+
+
+def _word(rng, parts):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(parts))
+
+
+def make_vocabulary(rng, size=5000):
+    return [_word(rng, rng.randint(2, 4)) for _ in range(size)]
+
+
+def make_report(rng, vocab, i):
+    words = [rng.choice(EVENTS)] + [rng.choice(vocab) for _ in range(rng.randint(8, 14))]
+    return {
+        'id': i,
+        'location': f"{_word(rng, 3).title()} {rng.choice(['Nagar', 'Colony', 'Road', 'Market'])}",
+        'city': rng.choice(CITIES),
+        'pincode': str(rng.randint(100000, 999999)),
+        'description': ' '.join(words),
+    }
+
+
+def make_duplicate(rng, vocab, base, i):
+    """Same event re-reported: a couple of words changed and a one-digit pincode typo."""
+    dup = dict(base, id=i)
+    words = base['description'].split()
+    for _ in range(2):
+        words[rng.randrange(1, len(words))] = rng.choice(vocab)
+    dup['description'] = ' '.join(words)
+    pin = list(base['pincode'])
+    pos = rng.randrange(len(pin))
+    pin[pos] = str((int(pin[pos]) + 1) % 10)
+    dup['pincode'] = ''.join(pin)
+    return dup
+
+
+def main(n=100_000, dup_rate=0.05, seed=42):
+    rng = random.Random(seed)
+    vocab = make_vocabulary(rng)
+    reports, planted = [], set()
+    for i in range(1, n + 1):
+        if reports and rng.random() < dup_rate:
+            base = rng.choice(reports[-5000:])
+            reports.append(make_duplicate(rng, vocab, base, i))
+            planted.add(frozenset((base['id'], i)))
+        else:
+            reports.append(make_report(rng, vocab, i))
+
+    index = DuplicateReportIndex()
+    found = set()
+    start = time.perf_counter()
+    for r in reports:
+        for other, _ in index.add(r):
+            found.add(frozenset((r['id'], other)))
+    build_s = time.perf_counter() - start
+
+    probes = rng.sample(reports, 2000)
+    latencies = []
+    for r in probes:
+        t0 = time.perf_counter()
+        index.find_duplicates(r)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+
+    hits = len(planted & found)
+    print(f"reports indexed:     {n}")
+    print(f"index build:         {build_s:.2f}s ({n / build_s:,.0f} reports/s)")
+    print(f"query p50 / p99:     {latencies[len(latencies) // 2] * 1000:.3f} ms / {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms")
+    print(f"planted duplicates:  {len(planted)}")
+    print(f"recall:              {hits / max(len(planted), 1):.3f}")
+    print(f"precision:           {hits / max(len(found), 1):.3f} ({len(found)} pairs flagged)")
+    print(f"candidate groups:    {len(index.candidate_groups())}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,80 @@
+"""
+Benchmark for process start-up: how long importing the web app and the Celery task module takes
+
+Each run imports the module in a fresh interpreter with ``python -X importtime``
+and reports the median cumulative import time over the runs, the modules that
+cost the most, and the child's peak RSS. Both entry points matter: every
+gunicorn worker pays for ``import app`` and every Celery worker (and every
+autoscaled replica) for ``import tasks`` before it serves anything.
+
+Modules that only some requests need (numpy via the user directory and shelter
+index, qrcode/PIL, overpy, the Celery app in the web process) are imported on
+first use, so they should not show up in the top list for ``app``.
+
+Usage: python -m benchmarks.bench_import_time [module ...] [--runs N] [--top N]
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+_PROBE = ("import resource, sys; import {module}; "
+          "sys.stderr.write('peak_rss_kb: %d\\n' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+
+
+def measure(module: str) -> dict:
+    """One cold import of ``module`` in a fresh interpreter."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+                          cwd=root, capture_output=True, text=True, check=True)
+    timings, peak_rss_kb = {}, None
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings[name] = {'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000,
+                             'depth': (len(indent) - 1) // 2}
+        elif line.startswith('peak_rss_kb:'):
+            peak_rss_kb = int(line.split(':')[1])
+    return {'timings': timings, 'peak_rss_kb': peak_rss_kb}
+
+
+def bench(module: str, runs: int = 5, top: int = 10) -> dict:
+    samples = [measure(module) for _ in range(runs)]
+    totals = [s['timings'][module]['cumulative_ms'] for s in samples if module in s['timings']]
+    # Heaviest modules by cumulative time in the median run, excluding the module itself
+    median_run = sorted(samples, key=lambda s: s['timings'].get(module, {}).get('cumulative_ms', 0))[len(samples) // 2]
+    heaviest = sorted(((name, t['cumulative_ms']) for name, t in median_run['timings'].items()
+                       if name != module and t['depth'] <= 2), key=lambda item: -item[1])[:top]
+    return {
+        'module': module,
+        'runs': runs,
+        'import_ms_median': round(statistics.median(totals), 1) if totals else None,
+        'import_ms_min': round(min(totals), 1) if totals else None,
+        'peak_rss_mb': round(statistics.median(s['peak_rss_kb'] for s in samples) / 1024, 1),
+        'modules_loaded': len(median_run['timings']),
+        'heaviest': [{'module': name, 'cumulative_ms': round(ms, 1)} for name, ms in heaviest],
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    runs = top = None
+    modules = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--runs':
+            runs = int(args.pop(0))
+        elif arg == '--top':
+            top = int(args.pop(0))
+        else:
+            modules.append(arg)
+    results = [bench(m, runs or 5, top or 10) for m in (modules or ['app', 'tasks'])]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark for the in-memory user directory behind SMSService.get_nearby_users
+
+Loads synthetic phone-bearing users clustered around Indian cities and compares
+radius queries served from the grid index against a linear haversine scan over
+every user (what the old per-user loop amounted to, minus the geodesic cost).
+
+Usage: python -m benchmarks.bench_nearby_users [num_users]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+from services.user_directory import UserDirectory
+from utils.geo import haversine_km
+
+CITIES = [(19.0760, 72.8777), (18.5204, 73.8567), (28.6139, 77.2090), (13.0827, 80.2707),
+          (22.5726, 88.3639), (12.9716, 77.5946), (17.3850, 78.4867), (25.5941, 85.1376)]
+
+
+class SyntheticUserRepo:
+    def __init__(self, n, seed):
+        self.n = n
+        self.seed = seed
+
+    def latest_update(self):
+        return None
+
+    def iter_phone_users(self):
+        rng = random.Random(self.seed)
+        for i in range(self.n):
+            lat, lon = rng.choice(CITIES)
+            yield {
+                'id': f"u{i}",
+                'phone': f"+91{9000000000 + i}",
+                'latitude': lat + rng.gauss(0, 0.6),
+                'longitude': lon + rng.gauss(0, 0.6),
+                'pincode': str(rng.randint(110000, 860000)),
+            }
+
+
+def main(n=1_000_000, queries=500, radius_km=10, seed=42):
+    directory = UserDirectory()
+    start = time.perf_counter()
+    directory.load(SyntheticUserRepo(n, seed))
+    load_s = time.perf_counter() - start
+
+    rng = random.Random(seed + 1)
+    points = [(lat + rng.gauss(0, 0.3), lon + rng.gauss(0, 0.3)) for lat, lon in (rng.choice(CITIES) for _ in range(queries))]
+
+    latencies, found = [], 0
+    for lat, lon in points:
+        t0 = time.perf_counter()
+        found += len(directory.within_radius(lat, lon, radius_km))
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+
+    all_lat = directory._lat[:len(directory)]
+    all_lon = directory._lon[:len(directory)]
+    scan = []
+    scan_found = 0
+    for lat, lon in points[:50]:
+        t0 = time.perf_counter()
+        scan_found += int(np.count_nonzero(haversine_km(lat, lon, all_lat, all_lon) <= radius_km))
+        scan.append(time.perf_counter() - t0)
+    grid_found = sum(len(directory.within_radius(lat, lon, radius_km)) for lat, lon in points[:50])
+
+    print(f"users indexed:       {n}")
+    print(f"directory load:      {load_s:.2f}s ({n / load_s:,.0f} users/s)")
+    print(f"radius query p50/p99: {latencies[len(latencies) // 2] * 1000:.3f} ms / {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms")
+    print(f"avg users in {radius_km} km:  {found / queries:,.0f}")
+    print(f"full numpy scan p50: {sorted(scan)[len(scan) // 2] * 1000:.3f} ms")
+    print(f"results match scan:  {grid_found == scan_found}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,124 @@
+"""
+Benchmark for SMS fan-out: one task per phone vs. batched send_sms_batch tasks
+
+Runs both paths end to end against a local stub SMS provider (HTTP) and a stub
+Supabase client that charges a fixed round-trip per insert, and reports
+messages/sec, broker messages and log insert calls.
+
+- per-message: what tasks.py used to do. One serialized broker message,
+  a fresh HTTP connection and a single-row log insert per phone number.
+- batched: send_sms_batch. One broker message per SMS_BATCH_SIZE recipients,
+  the service's pooled session and buffered multi-row log inserts.
+
+Usage: python -m benchmarks.bench_sms_dispatch [num_recipients] [insert_rtt_ms]
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from config import Config
+from sms_service import SMSService
+from tasks import SMS_BATCH_SIZE
+
+
+class _ProviderStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"success": true, "textId": "1"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubTable:
+    def __init__(self, client):
+        self.client = client
+
+    def insert(self, rows):
+        self.client.insert_calls += 1
+        self.client.rows += len(rows) if isinstance(rows, list) else 1
+        return self
+
+    def execute(self):
+        time.sleep(self.client.rtt)
+        return type('Resp', (), {'data': [{'id': self.client.rows}]})()
+
+
+class StubSupabase:
+    def __init__(self, rtt_ms):
+        self.rtt = rtt_ms / 1000.0
+        self.insert_calls = 0
+        self.rows = 0
+
+    def table(self, name):
+        return _StubTable(self)
+
+
+def _task_message(task, args):
+    # Roughly what Celery puts on the broker per .delay() call
+    return json.dumps({'task': task, 'args': args, 'kwargs': {}}).encode()
+
+
+def per_message(service, recipients, message):
+    broker_bytes = 0
+    for user in recipients:
+        broker_bytes += len(_task_message('tasks.send_sms_notification', [None, user['phone'], message]))
+        resp = requests.post(service.TEXTBELT_URL, data={'phone': user['phone'], 'message': message, 'key': 'x'}, timeout=10)
+        sms_id = f"textbelt_{resp.json().get('textId')}"
+        row = service._sms_log_row(user['id'], user['phone'], message, None, 'sent', sms_id)
+        service.supabase.table('sms_notifications').insert(row).execute()
+    return len(recipients), broker_bytes
+
+
+def batched(service, recipients, message):
+    broker_bytes = messages = 0
+    for start in range(0, len(recipients), SMS_BATCH_SIZE):
+        chunk = recipients[start:start + SMS_BATCH_SIZE]
+        broker_bytes += len(_task_message('tasks.send_sms_batch', [None, chunk, message]))
+        messages += 1
+        service.send_batch(chunk, message)
+    service.flush_logs()
+    return messages, broker_bytes
+
+
+def main(n=5000, rtt_ms=5.0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _ProviderStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    Config.SMS_API_KEY = 'bench'
+    # Measure dispatch overhead, not the provider rate limit
+    Config.SMS_RATE_PER_SECOND = Config.SMS_RATE_BURST = 1e9
+    service = SMSService()
+    service.TEXTBELT_URL = f"http://127.0.0.1:{server.server_address[1]}/text"
+    recipients = [{'id': f"u{i}", 'phone': f"+91{9000000000 + i}"} for i in range(n)]
+    message = "WEATHER ALERT: heavy rain expected in your area. Stay indoors and follow official advisories."
+
+    logging.getLogger('sms_service').setLevel(logging.WARNING)
+
+    for label, path in (('per-message', per_message), ('batched', batched)):
+        service.supabase = StubSupabase(rtt_ms)
+        start = time.perf_counter()
+        broker_msgs, broker_bytes = path(service, recipients, message)
+        elapsed = time.perf_counter() - start
+        print(f"{label:12s} {n / elapsed:8,.0f} msg/s  {elapsed:6.2f}s  "
+              f"broker msgs {broker_msgs:6d} ({broker_bytes / 1024:,.0f} KiB)  "
+              f"log inserts {service.supabase.insert_calls}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 5.0)
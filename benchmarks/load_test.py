@@ -0,0 +1,317 @@
+"""
+End-to-end HTTP load test for the role dashboards and the incident intake route
+
+Seeds a realistic dataset into the in-memory Supabase stand-in
+(utils.inmemory_supabase, SUPABASE_URL=memory://), serves the Flask app on a
+local threaded HTTP server and drives it with concurrent virtual users. Each
+virtual user signs in through /signin and then loops through its role's
+journey:
+
+- citizen: dashboard, report_incident (POST), announcements
+- admin: admin_dashboard, announcements
+- government: government_dashboard
+- emergency: emergency_dashboard
+
+For every route it reports p50/p95/p99 latency, throughput, error count and
+backend calls per request (Supabase round trips made while serving it, from
+the X-Backend-Calls header utils.request_budget adds; each one also costs
+--latency-ms, so round-trip-heavy routes show up in latency too). Results are written as JSON so runs can be compared:
+
+    python -m benchmarks.load_test run --out benchmarks/results/before.json
+    python -m benchmarks.load_test run --out benchmarks/results/after.json
+    python -m benchmarks.load_test compare benchmarks/results/before.json benchmarks/results/after.json
+
+compare exits with status 1 when a route's p95 or backend calls per request
+regressed by more than --threshold (default 10%).
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+PASSWORD = 'loadtest-password'
+PINCODES = [f"4110{i:02d}" for i in range(40)]
+CAUSES = ['flood', 'fire', 'landslide', 'building collapse', 'storm']
+# Report text varies like real reports do; templated text would make every report a near-duplicate
+WORDS = ('water road bridge school market temple river bank hospital colony bus depot tree wall roof power line '
+         'families children elderly trapped stranded injured missing smoke debris mud current rising blocked '
+         'ambulance boats food shelter rescue urgent night morning since hours street lane sector highway '
+         'station crossing canal drain hill slope village apartment basement shop factory godown').split()
+
+JOURNEYS = {
+    'citizen': [('GET', '/dashboard'), ('POST', '/report_incident'), ('GET', '/announcements')],
+    'admin': [('GET', '/admin_dashboard'), ('GET', '/announcements')],
+    'government': [('GET', '/government_dashboard')],
+    'emergency': [('GET', '/emergency_dashboard')],
+}
+# Share of virtual users per role
+ROLE_MIX = {'citizen': 0.55, 'admin': 0.15, 'government': 0.15, 'emergency': 0.15}
+ROLE_IN_DB = {'citizen': 'user', 'admin': 'admin', 'government': 'government', 'emergency': 'emergency'}
+
+
+def _report_text(rng: random.Random) -> str:
+    return f"{rng.choice(CAUSES).title()} in ward {rng.randint(1, 120)}: " + ' '.join(rng.sample(WORDS, 9))
+
+
+def _ago(**delta) -> str:
+    return (datetime.now(timezone.utc) - timedelta(**delta)).isoformat()
+
+
+def seed(sb, scale: int = 1, rng: random.Random = None) -> dict:
+    """Populate every table the dashboards read; returns the sign-in emails per role.
+
+    ``scale`` 1 is a mid-sized city deployment: 2,000 citizens, 1,500 incidents,
+    900 requests, 60 units with assignments, updates and notifications.
+    """
+    rng = rng or random.Random(7)
+    accounts = defaultdict(list)
+    users = []
+    counts = {'citizen': 2000 * scale, 'admin': 3, 'government': 5, 'emergency': 15 * scale}
+    for role, n in counts.items():
+        for i in range(n):
+            email = f"{role}{i}@loadtest.in"
+            user = sb.auth.sign_up({'email': email, 'password': PASSWORD}).user
+            accounts[role].append(email)
+            users.append({'id': user.id, 'name': f"{role.title()} {i}", 'email': email, 'role': ROLE_IN_DB[role],
+                          'phone': f"+91{9000000000 + len(users)}", 'pincode': rng.choice(PINCODES),
+                          'is_emergency_head': role == 'emergency'})
+    sb.seed('users', users)
+    by_role = defaultdict(list)
+    for u in users:
+        by_role[u['role']].append(u['id'])
+
+    incidents = sb.seed('incidents', [{
+        'user_id': rng.choice(by_role['user']), 'location': f"Ward {rng.randint(1, 120)}, Pune",
+        'city': 'Pune', 'state': 'Maharashtra', 'pincode': rng.choice(PINCODES), 'cause': rng.choice(CAUSES),
+        'description': _report_text(rng),
+        'severity': rng.choice(['low', 'medium', 'high', 'critical']),
+        'status': 'forwarded' if i % 5 < 3 else 'pending', 'timestamp': _ago(minutes=i * 7),
+    } for i in range(1500 * scale)])
+
+    forwarded = [inc for inc in incidents if inc['status'] == 'forwarded']
+    statuses = ['pending'] * 3 + ['notified'] * 2 + ['assigned'] * 3 + ['completed'] * 2
+    requests_ = sb.seed('requests', [{
+        'admin_id': by_role['admin'][0], 'incident_id': inc['id'], 'status': statuses[i % len(statuses)],
+        'created_at': _ago(minutes=i * 5),
+    } for i, inc in enumerate(forwarded)])
+
+    heads = by_role['emergency']
+    units = sb.seed('emergency_units', [{
+        'head_id': head, 'unit_name': f"Team {h}-{category}", 'unit_category': category,
+        'status': rng.choice(['Free', 'Busy']),
+    } for h, head in enumerate(heads) for category in ['Rescue', 'Escort', 'Medical', 'ResourceCollector']])
+
+    active = [r for r in requests_ if r['status'] in ('assigned', 'completed')]
+    assignments = sb.seed('emergency_assignments', [{
+        'request_id': r['id'], 'unit_id': (unit := rng.choice(units))['id'], 'team_lead_id': unit['head_id'],
+        'team_name': unit['unit_name'], 'team_type': 'Rescue', 'location_text': 'Pune',
+        'status': 'Completed' if r['status'] == 'completed' else rng.choice(['Assigned', 'Enroute', 'OnSite']),
+        'assigned_at': _ago(minutes=i * 11),
+    } for i, r in enumerate(active)])
+    sb.seed('emergency_updates', [{
+        'assignment_id': a['id'], 'author_id': a['team_lead_id'], 'reached': True,
+        'rescued_count': rng.randint(0, 12), 'message': 'Situation under control', 'created_at': _ago(minutes=j * 13),
+    } for a in assignments for j in range(3)])
+    sb.seed('emergency_notifications', [{
+        'request_id': r['id'], 'gov_id': by_role['government'][0], 'head_id': rng.choice(heads),
+        'status': 'Pending' if r['status'] == 'notified' else 'Acknowledged',
+    } for r in requests_ if r['status'] != 'pending'])
+
+    sb.seed('announcements', [{
+        'admin_id': by_role['admin'][0], 'title': f"Advisory {i}", 'description': 'Stay away from the river banks.',
+        'severity': rng.choice(['low', 'medium', 'high']), 'is_weather_alert': False, 'timestamp': _ago(hours=i),
+    } for i in range(60)])
+    sb.seed('donations', [{
+        'user_id': rng.choice(by_role['user']), 'amount': rng.choice([100, 250, 500, 1000]),
+        'method': 'upi', 'status': rng.choice(['pending', 'completed', 'verified']),
+    } for _ in range(300 * scale)])
+    sb.seed('shelters', [{'name': f"Shelter {i}", 'location': f"School {i}, Pune", 'capacity': 200, 'available': 120}
+                         for i in range(40)])
+    return dict(accounts)
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, status: int, backend_calls: int):
+        with self.lock:
+            self.samples[route].append((seconds, status, backend_calls))
+
+    def summary(self, elapsed: float) -> dict:
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] * 1000 for s in samples)
+            calls = [s[2] for s in samples]
+            routes[route] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if s[1] >= 400),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'p50_ms': round(_percentile(latencies, 50), 2),
+                'p95_ms': round(_percentile(latencies, 95), 2),
+                'p99_ms': round(_percentile(latencies, 99), 2),
+                'mean_ms': round(statistics.fmean(latencies), 2),
+                'backend_calls_mean': round(statistics.fmean(calls), 2),
+                'backend_calls_max': max(calls),
+            }
+        return routes
+
+
+def _virtual_user(base_url: str, role: str, email: str, deadline: float, recorder: Recorder, rng: random.Random,
+                  passes: int = None):
+    import requests
+
+    http = requests.Session()
+    http.post(f"{base_url}/signin", data={'email_or_phone': email, 'password': PASSWORD}, allow_redirects=False)
+    done = 0
+    while time.perf_counter() < deadline or (passes is not None and done < passes):
+        done += 1
+        for method, path in JOURNEYS[role]:
+            data = None
+            if method == 'POST':
+                data = {'location': f"Ward {rng.randint(1, 120)}, Pune", 'city': 'Pune', 'state': 'Maharashtra',
+                        'pincode': rng.choice(PINCODES), 'cause': rng.choice(CAUSES),
+                        'description': _report_text(rng)}
+            start = time.perf_counter()
+            resp = http.request(method, f"{base_url}{path}", data=data, allow_redirects=False)
+            elapsed = time.perf_counter() - start
+            # A redirect back to sign-in means the journey is not exercising the route
+            status = 401 if resp.status_code in (301, 302) and '/signin' in resp.headers.get('Location', '') else resp.status_code
+            recorder.add(f"{method} {path}", elapsed, status, int(resp.headers.get('X-Backend-Calls', 0)))
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(users: int = 16, duration: float = 15.0, latency_ms: float = 2.0, scale: int = 1, seed_value: int = 7) -> dict:
+    os.environ['SUPABASE_URL'] = 'memory://'
+    os.environ['SUPABASE_MEMORY_LATENCY_MS'] = str(latency_ms)
+    os.environ.pop('SMS_API_KEY', None)
+    import logging
+    from werkzeug.serving import make_server
+
+    import app as app_module
+    from utils.supabase_client import get_supabase
+
+    logging.disable(logging.WARNING)
+    sb = get_supabase()
+    accounts = seed(sb, scale, random.Random(seed_value))
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    rng = random.Random(seed_value)
+    per_role = {role: max(1, int(share * users)) for role, share in ROLE_MIX.items()}
+    per_role['citizen'] += max(0, users - sum(per_role.values()))
+    roles = [role for role, n in per_role.items() for _ in range(n)]
+
+    # One untimed pass per role first, so one-off warm-ups (shelter catalog, cluster rebuild) are not measured
+    for role in ROLE_MIX:
+        _virtual_user(base_url, role, accounts[role][0], 0, Recorder(), random.Random(seed_value), passes=1)
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    deadline = start + duration
+    workers = [threading.Thread(target=_virtual_user, args=(base_url, role, rng.choice(accounts[role]), deadline,
+                                                            recorder, random.Random(rng.random())))
+               for role in roles]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    return {
+        'meta': {
+            'revision': _git_revision(),
+            'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'virtual_users': len(roles),
+            'roles': {role: roles.count(role) for role in ROLE_MIX},
+            'duration_s': round(elapsed, 2),
+            'backend_latency_ms': latency_ms,
+            'scale': scale,
+        },
+        'routes': recorder.summary(elapsed),
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.10) -> list[str]:
+    """Print a per-route comparison; returns the regressions beyond ``threshold``."""
+    regressions = []
+    print(f"{'route':28s} {'p95 ms':>26s} {'p99 ms':>26s} {'calls/req':>18s} {'rps':>22s}")
+    for route in sorted(set(baseline['routes']) | set(current['routes'])):
+        old, new = baseline['routes'].get(route), current['routes'].get(route)
+        if not old or not new:
+            print(f"{route:28s} {'only in ' + ('current' if new else 'baseline'):>26s}")
+            continue
+        cells = []
+        for key, width in (('p95_ms', 26), ('p99_ms', 26), ('backend_calls_mean', 18), ('throughput_rps', 22)):
+            change = (new[key] - old[key]) / old[key] if old[key] else 0.0
+            cells.append(f"{old[key]:g} -> {new[key]:g} ({change:+.0%})".rjust(width))
+            if key in ('p95_ms', 'backend_calls_mean') and change > threshold:
+                regressions.append(f"{route} {key} {old[key]:g} -> {new[key]:g}")
+        print(f"{route:28s} {' '.join(cells)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_p = sub.add_parser('run', help='seed, drive the app and write results')
+    run_p.add_argument('--users', type=int, default=16, help='concurrent virtual users')
+    run_p.add_argument('--duration', type=float, default=15.0, help='seconds to run')
+    run_p.add_argument('--latency-ms', type=float, default=2.0, help='simulated Supabase round trip')
+    run_p.add_argument('--scale', type=int, default=1, help='dataset size multiplier')
+    run_p.add_argument('--seed', type=int, default=7)
+    run_p.add_argument('--out', help='JSON results file (default: print only)')
+    cmp_p = sub.add_parser('compare', help='compare two result files')
+    cmp_p.add_argument('baseline')
+    cmp_p.add_argument('current')
+    cmp_p.add_argument('--threshold', type=float, default=0.10, help='relative regression that fails the comparison')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run(args.users, args.duration, args.latency_ms, args.scale, args.seed)
+        print(json.dumps(results, indent=2))
+        if args.out:
+            os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
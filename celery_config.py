@@ -24,11 +24,26 @@ celery.conf.update(
     task_soft_time_limit=25 * 60,  # 25 minutes
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
+    broker_transport_options={'queue_order_strategy': 'priority'},
 )
 
 # Task routes
+# SMS sends are split into priority lanes so a large broadcast cannot delay an incident warning.
+# send_sms_batch is queued per call on the lane matching the alert's severity (tasks.sms_lane);
+# the route below is only its default. Give the critical lane dedicated capacity, e.g.:
+#   celery -A celery_config worker -Q sms_critical -c 4 -n critical@%h
+#   celery -A celery_config worker -Q sms_critical,sms_high,sms_bulk -n sms@%h
+# kombu's Redis transport serves a worker's queues round-robin by default; the
+# 'priority' strategy below makes it always drain them in the order given to -Q,
+# so shared workers take critical and high work before bulk. (Ordering is only
+# between waiting messages: a bulk task already running is not preempted, which
+# is why the critical lane should still have dedicated workers.)
 celery.conf.task_routes = {
-    'tasks.send_sms_notification': {'queue': 'sms'},
+    'tasks.send_sms_notification': {'queue': 'sms_high'},
+    'tasks.send_sms_batch': {'queue': 'sms_bulk'},
+    # Non-SMS channels each have their own queue (notify_inapp, notify_push, notify_email),
+    # chosen per call by the notification engine, so each can get its own workers
+    'tasks.deliver_notifications': {'queue': 'notify_inapp'},
     'tasks.process_incident_notification': {'queue': 'incidents'},
     'tasks.send_weather_alert': {'queue': 'alerts'},
 }
@@ -43,6 +58,10 @@ celery.conf.beat_schedule = {
         'task': 'tasks.cleanup_old_notifications',
         'schedule': 86400.0,  # Every 24 hours
     },
+    'refresh-duplicate-groups': {
+        'task': 'tasks.refresh_duplicate_groups',
+        'schedule': 300.0,  # Every 5 minutes
+    },
 }
 
 celery.conf.timezone = 'Asia/Kolkata'
@@ -16,27 +16,67 @@ class Config:
     # Supabase Configuration
     SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
     SUPABASE_KEY = os.environ.get('SUPABASE_KEY', '')
+    # Shared HTTP pool per process for all Supabase calls (see utils.supabase_client)
+    SUPABASE_POOL_SIZE = int(os.environ.get('SUPABASE_POOL_SIZE', '20'))
+    SUPABASE_KEEPALIVE = int(os.environ.get('SUPABASE_KEEPALIVE', '10'))
+    SUPABASE_TIMEOUT = float(os.environ.get('SUPABASE_TIMEOUT', '10'))
+    # SUPABASE_URL=memory:// swaps in the in-memory stand-in, with this simulated latency per call
+    SUPABASE_MEMORY_LATENCY_MS = float(os.environ.get('SUPABASE_MEMORY_LATENCY_MS', '0'))
+    # Requests over either budget are logged with a per-table breakdown of their Supabase calls,
+    # and a query repeated this many times in one request is logged as a likely N+1
+    REQUEST_CALL_BUDGET = int(os.environ.get('REQUEST_CALL_BUDGET', '20'))
+    REQUEST_BACKEND_MS_BUDGET = float(os.environ.get('REQUEST_BACKEND_MS_BUDGET', '1000'))
+    REQUEST_REPEAT_THRESHOLD = int(os.environ.get('REQUEST_REPEAT_THRESHOLD', '5'))
+    # /metrics is closed unless the scraper sends "Authorization: Bearer <METRICS_TOKEN>", connects
+    # from an address in METRICS_ALLOWED_IPS (comma-separated), or METRICS_PUBLIC=true opts out
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+    METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'false').lower() == 'true'
     
     # Weather API Configuration (Optional)
     WEATHER_API_KEY = os.environ.get('WEATHER_API_KEY', '')
     
     # SMS Configuration (Free API)
     SMS_API_KEY = os.environ.get('SMS_API_KEY', '')
+    # Provider send rate shared by all SMS workers (tokens per second, burst size)
+    SMS_RATE_PER_SECOND = float(os.environ.get('SMS_RATE_PER_SECOND', '5'))
+    SMS_RATE_BURST = float(os.environ.get('SMS_RATE_BURST', '10'))
+    # Country code given to stored phone numbers that have none (utils.phone.normalize_phone)
+    DEFAULT_PHONE_COUNTRY_CODE = os.environ.get('DEFAULT_PHONE_COUNTRY_CODE', '91')
     
     # Twilio SMS Configuration (Optional)
     TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID', '')
     TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN', '')
     TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '')
     
+    # Web Push (VAPID) for browser notifications (optional; needs pywebpush)
+    VAPID_PUBLIC_KEY = os.environ.get('VAPID_PUBLIC_KEY', '')
+    VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
+    VAPID_SUBJECT = os.environ.get('VAPID_SUBJECT', 'mailto:alerts@resqchain.local')
+    PUSH_RATE_PER_SECOND = float(os.environ.get('PUSH_RATE_PER_SECOND', '100'))
+    
+    # SMTP for email alerts (optional)
+    SMTP_HOST = os.environ.get('SMTP_HOST', '')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+    SMTP_USER = os.environ.get('SMTP_USER', '')
+    SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+    MAIL_FROM = os.environ.get('MAIL_FROM', '')
+    EMAIL_RATE_PER_SECOND = float(os.environ.get('EMAIL_RATE_PER_SECOND', '10'))
+    
     # Razorpay Configuration - fully removed (using UPI only)
     
     # Redis Configuration for Celery
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Local SQLite cache for server-side geocoding (Nominatim)
+    GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH', 'geocode_cache.db')
+    # Lookups allowed to wait in each process for the Nominatim worker (1 request/s across all processes)
+    GEOCODE_QUEUE_MAX = int(os.environ.get('GEOCODE_QUEUE_MAX', '30'))
+    
     @classmethod
     def is_supabase_configured(cls):
         """Check if Supabase is properly configured"""
-        return bool(cls.SUPABASE_URL and cls.SUPABASE_KEY)
+        return bool(cls.SUPABASE_URL and (cls.SUPABASE_KEY or cls.SUPABASE_URL.startswith('memory://')))
     
     @classmethod
     def is_weather_api_configured(cls):
@@ -48,6 +88,16 @@ class Config:
         """Check if SMS service is configured"""
         return bool(cls.SMS_API_KEY or (cls.TWILIO_ACCOUNT_SID and cls.TWILIO_AUTH_TOKEN and cls.TWILIO_PHONE_NUMBER))
     
+    @classmethod
+    def is_push_configured(cls):
+        """Check if Web Push (VAPID) keys are configured"""
+        return bool(cls.VAPID_PUBLIC_KEY and cls.VAPID_PRIVATE_KEY)
+    
+    @classmethod
+    def is_email_configured(cls):
+        """Check if SMTP email is configured"""
+        return bool(cls.SMTP_HOST and cls.MAIL_FROM)
+    
     @classmethod
     def is_twilio_configured(cls):
         """Check if Twilio is properly configured"""
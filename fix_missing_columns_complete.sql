@@ -67,6 +67,7 @@ ALTER TABLE IF EXISTS public.users ADD COLUMN IF NOT EXISTS phone TEXT;
 ALTER TABLE IF EXISTS public.users ADD COLUMN IF NOT EXISTS latitude DECIMAL(10, 8);
 ALTER TABLE IF EXISTS public.users ADD COLUMN IF NOT EXISTS longitude DECIMAL(11, 8);
 ALTER TABLE IF EXISTS public.users ADD COLUMN IF NOT EXISTS is_emergency_head BOOLEAN DEFAULT FALSE;
+ALTER TABLE IF EXISTS public.users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
 
 -- Update users role constraint
 ALTER TABLE IF EXISTS public.users DROP CONSTRAINT IF EXISTS users_role_check;
@@ -104,6 +105,7 @@ CREATE TABLE IF NOT EXISTS public.sms_notifications (
     status TEXT NOT NULL CHECK (status IN ('sent', 'failed', 'pending')),
     twilio_sid TEXT,
     error_message TEXT,
+    segments SMALLINT,
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -127,13 +129,21 @@ CREATE TABLE IF NOT EXISTS public.weather_data (
 ALTER TABLE IF EXISTS public.weather_data ADD COLUMN IF NOT EXISTS pincode TEXT;
 ALTER TABLE IF EXISTS public.weather_data ADD COLUMN IF NOT EXISTS coordinates JSONB;
 
+-- Billable SMS segments per message (GSM-7 vs UCS-2 accounting)
+ALTER TABLE IF EXISTS public.sms_notifications ADD COLUMN IF NOT EXISTS segments SMALLINT;
+
 -- Create weather alerts sent table if it doesn't exist
 CREATE TABLE IF NOT EXISTS public.weather_alerts_sent (
     id BIGSERIAL PRIMARY KEY,
-    weather_id BIGINT REFERENCES public.weather_data(id) ON DELETE CASCADE,
+    weather_id BIGINT UNIQUE REFERENCES public.weather_data(id) ON DELETE CASCADE,
     sent_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- One marker per weather row, so concurrent alert checks cannot both send (drop existing duplicates first)
+DELETE FROM public.weather_alerts_sent a USING public.weather_alerts_sent b
+WHERE a.weather_id = b.weather_id AND a.id > b.id;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_weather_alerts_sent_weather_id ON public.weather_alerts_sent(weather_id);
+
 -- Add weather columns to announcements table
 ALTER TABLE IF EXISTS public.announcements 
 ADD COLUMN IF NOT EXISTS weather_data_id BIGINT REFERENCES public.weather_data(id),
@@ -149,6 +159,14 @@ CREATE TABLE IF NOT EXISTS public.shelters (
   created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Coordinates and OSM identity for shelters imported from OpenStreetMap extracts
+ALTER TABLE IF EXISTS public.shelters ADD COLUMN IF NOT EXISTS latitude DECIMAL(10, 8);
+ALTER TABLE IF EXISTS public.shelters ADD COLUMN IF NOT EXISTS longitude DECIMAL(11, 8);
+ALTER TABLE IF EXISTS public.shelters ADD COLUMN IF NOT EXISTS osm_id TEXT;
+ALTER TABLE IF EXISTS public.shelters ADD COLUMN IF NOT EXISTS shelter_type TEXT;
+ALTER TABLE IF EXISTS public.shelters ADD COLUMN IF NOT EXISTS phone TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_shelters_osm_id ON public.shelters(osm_id);
+
 CREATE TABLE IF NOT EXISTS public.team_allocations (
   id BIGSERIAL PRIMARY KEY,
   gov_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
@@ -195,11 +213,66 @@ CREATE TABLE IF NOT EXISTS public.resources (
   allocated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Per-pincode incident clusters maintained as reports arrive (read by the admin dashboard)
+CREATE TABLE IF NOT EXISTS public.incident_clusters (
+  id BIGSERIAL PRIMARY KEY,
+  pincode TEXT NOT NULL,
+  lane TEXT NOT NULL DEFAULT 'pending' CHECK (lane IN ('pending', 'forwarded')),
+  report_count INTEGER NOT NULL DEFAULT 0,
+  max_severity TEXT,
+  latest_timestamp TIMESTAMPTZ,
+  term_freq JSONB NOT NULL DEFAULT '{}'::jsonb,
+  recent_descriptions JSONB NOT NULL DEFAULT '[]'::jsonb,
+  representative JSONB,
+  version INTEGER NOT NULL DEFAULT 0,
+  UNIQUE (pincode, lane)
+);
+
+-- MinHash signatures of incident reports (written by the worker, base64 of 128 little-endian uint32)
+CREATE TABLE IF NOT EXISTS public.incident_signatures (
+  id BIGSERIAL PRIMARY KEY,
+  incident_id BIGINT NOT NULL UNIQUE REFERENCES public.incidents(id) ON DELETE CASCADE,
+  signature TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Latest near-duplicate report groups computed by the worker (single row read by the admin dashboard)
+CREATE TABLE IF NOT EXISTS public.incident_duplicate_groups (
+  id SMALLINT PRIMARY KEY CHECK (id = 1),
+  groups JSONB NOT NULL DEFAULT '[]'::jsonb,
+  computed_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- In-app notification inbox (one row per user per alert routed to the web app)
+CREATE TABLE IF NOT EXISTS public.notification_inbox (
+  id BIGSERIAL PRIMARY KEY,
+  user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  severity TEXT,
+  incident_id BIGINT REFERENCES public.incidents(id) ON DELETE CASCADE,
+  alert_key TEXT,
+  read_at TIMESTAMPTZ,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Browser Web Push subscriptions
+CREATE TABLE IF NOT EXISTS public.push_subscriptions (
+  id BIGSERIAL PRIMARY KEY,
+  user_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+  endpoint TEXT NOT NULL UNIQUE,
+  p256dh TEXT NOT NULL,
+  auth TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_users_role ON public.users(role);
 CREATE INDEX IF NOT EXISTS idx_users_phone ON public.users(phone);
 CREATE INDEX IF NOT EXISTS idx_users_location ON public.users(latitude, longitude);
 CREATE INDEX IF NOT EXISTS idx_users_emergency_head ON public.users(is_emergency_head);
+-- Watermark scans of changed users by the notification directory (services/user_directory.py)
+CREATE INDEX IF NOT EXISTS idx_users_updated_at ON public.users(updated_at, id);
 
 CREATE INDEX IF NOT EXISTS idx_incidents_user_id ON public.incidents(user_id);
 CREATE INDEX IF NOT EXISTS idx_incidents_status ON public.incidents(status);
@@ -217,9 +290,12 @@ CREATE INDEX IF NOT EXISTS idx_donations_payment_method ON public.donations(paym
 CREATE INDEX IF NOT EXISTS idx_sms_notifications_user_id ON public.sms_notifications(user_id);
 CREATE INDEX IF NOT EXISTS idx_sms_notifications_incident_id ON public.sms_notifications(incident_id);
 CREATE INDEX IF NOT EXISTS idx_sms_notifications_status ON public.sms_notifications(status);
+CREATE INDEX IF NOT EXISTS idx_sms_notifications_created_at ON public.sms_notifications(created_at);
+CREATE INDEX IF NOT EXISTS idx_weather_alerts_sent_sent_at ON public.weather_alerts_sent(sent_at);
 
 CREATE INDEX IF NOT EXISTS idx_weather_data_location ON public.weather_data(location);
 CREATE INDEX IF NOT EXISTS idx_weather_data_extreme ON public.weather_data(is_extreme);
+CREATE INDEX IF NOT EXISTS idx_weather_data_extreme_fetched_at ON public.weather_data(fetched_at DESC) WHERE is_extreme;
 
 CREATE INDEX IF NOT EXISTS idx_announcements_admin_id ON public.announcements(admin_id);
 CREATE INDEX IF NOT EXISTS idx_announcements_severity ON public.announcements(severity);
@@ -252,6 +328,11 @@ CREATE INDEX IF NOT EXISTS idx_medical_requests_status ON public.medical_request
 CREATE INDEX IF NOT EXISTS idx_resources_gov_id ON public.resources(gov_id);
 CREATE INDEX IF NOT EXISTS idx_resources_shelter_id ON public.resources(shelter_id);
 
+CREATE INDEX IF NOT EXISTS idx_incident_clusters_lane_latest ON public.incident_clusters(lane, latest_timestamp DESC);
+
+CREATE INDEX IF NOT EXISTS idx_notification_inbox_user_created ON public.notification_inbox(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_push_subscriptions_user_id ON public.push_subscriptions(user_id);
+
 -- Create triggers for updated_at timestamps
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -272,6 +353,69 @@ CREATE TRIGGER update_sms_notifications_updated_at
     BEFORE UPDATE ON public.sms_notifications
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+DROP TRIGGER IF EXISTS update_users_updated_at ON public.users;
+CREATE TRIGGER update_users_updated_at 
+    BEFORE UPDATE ON public.users
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Applies the writes of one logical operation in a single transaction (repositories/unit_of_work.py).
+-- ops: [{"op": "insert"|"update", "table", "values", "match", "exclude", "expect"}]; returns the rows
+-- each op wrote. An op with "expect": true that writes no row aborts the call, undoing every op.
+CREATE OR REPLACE FUNCTION public.apply_unit_of_work(ops JSONB)
+RETURNS JSONB AS $$
+DECLARE
+  op JSONB;
+  idx INTEGER := 0;
+  tbl TEXT;
+  rowset JSONB;
+  cols TEXT;
+  cond TEXT;
+  written JSONB;
+  results JSONB := '[]'::JSONB;
+BEGIN
+  FOR op IN SELECT value FROM jsonb_array_elements(ops) LOOP
+    tbl := op->>'table';
+    IF tbl IS NULL OR tbl NOT IN ('requests', 'incidents', 'announcements', 'emergency_units',
+                                  'emergency_assignments', 'emergency_updates', 'emergency_notifications') THEN
+      RAISE EXCEPTION 'unit_of_work: table % is not allowed', tbl;
+    END IF;
+    -- An insert may carry one row or an array of rows; columns are the union of their keys
+    rowset := CASE jsonb_typeof(op->'values') WHEN 'array' THEN op->'values' ELSE jsonb_build_array(op->'values') END;
+    SELECT string_agg(DISTINCT format('%I', key), ', ') INTO cols
+    FROM jsonb_array_elements(rowset) AS r(value), jsonb_object_keys(r.value) AS key;
+
+    IF op->>'op' = 'insert' THEN
+      EXECUTE format(
+        'WITH w AS (INSERT INTO public.%1$I (%2$s) SELECT %2$s FROM jsonb_populate_recordset(NULL::public.%1$I, $1) RETURNING *) '
+        'SELECT COALESCE(jsonb_agg(to_jsonb(w)), ''[]'') FROM w', tbl, cols)
+      INTO written USING rowset;
+    ELSIF op->>'op' = 'update' THEN
+      SELECT string_agg(format('t.%1$I = m.%1$I', key), ' AND ') INTO cond FROM jsonb_object_keys(op->'match') AS key;
+      IF cond IS NULL THEN
+        RAISE EXCEPTION 'unit_of_work: update on % needs a match', tbl;
+      END IF;
+      SELECT concat_ws(' AND ', cond, string_agg(format('t.%1$I <> x.%1$I', key), ' AND ')) INTO cond
+      FROM jsonb_object_keys(COALESCE(op->'exclude', '{}')) AS key;
+      EXECUTE format(
+        'WITH w AS (UPDATE public.%1$I t SET (%2$s) = (SELECT %2$s FROM jsonb_populate_record(NULL::public.%1$I, $1)) '
+        'FROM jsonb_populate_record(NULL::public.%1$I, $2) m, jsonb_populate_record(NULL::public.%1$I, $3) x '
+        'WHERE %3$s RETURNING t.*) '
+        'SELECT COALESCE(jsonb_agg(to_jsonb(w)), ''[]'') FROM w', tbl, cols, cond)
+      INTO written USING op->'values', op->'match', COALESCE(op->'exclude', '{}');
+    ELSE
+      RAISE EXCEPTION 'unit_of_work: unknown op %', op->>'op';
+    END IF;
+
+    IF COALESCE((op->>'expect')::BOOLEAN, FALSE) AND jsonb_array_length(written) = 0 THEN
+      RAISE EXCEPTION 'unit_of_work_conflict: op % on % matched no rows', idx, tbl;
+    END IF;
+    results := results || jsonb_build_array(written);
+    idx := idx + 1;
+  END LOOP;
+  RETURN results;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Grant permissions for Supabase
 GRANT ALL ON ALL TABLES IN SCHEMA public TO authenticated;
 GRANT ALL ON ALL TABLES IN SCHEMA public TO anon;
@@ -0,0 +1,9 @@
+"""
+Gunicorn settings, read automatically from the working directory (Procfile: gunicorn app:app)
+"""
+
+
+def post_worker_init(worker):
+    # Per-process indexes are built in each worker once it has loaded the app, never in the master
+    from app import start_background_services
+    start_background_services()
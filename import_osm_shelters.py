@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Bulk-import shelter candidates from a local OpenStreetMap extract into the shelters table
+
+Usage: python import_osm_shelters.py <extract.osm | extract.osm.bz2 | extract.osm.gz> [--dry-run]
+
+Extracts (e.g. from download.geofabrik.de) must be OSM XML; convert .pbf files
+first with `osmium cat input.osm.pbf -o output.osm.bz2`. The file is streamed
+twice so memory stays bounded: the first pass records which nodes the matching
+ways reference, the second emits matching nodes and the way centroids.
+"""
+import bz2
+import gzip
+import sys
+import xml.etree.ElementTree as ET
+from config import Config
+from services.shelter_service import ShelterService, classify_shelter
+
+BATCH_SIZE = 500
+SHELTER_TAGS = set(ShelterService.TAGS)
+
+
+def _open(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _elements(path, kinds):
+    """Stream (element, tags) for OSM elements of the given kinds, freeing memory as we go."""
+    with _open(path) as fh:
+        root = None
+        for event, elem in ET.iterparse(fh, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event != 'end':
+                continue
+            if elem.tag in kinds:
+                tags = {t.get('k'): t.get('v') for t in elem.iter('tag')}
+                yield elem, tags
+            if elem.tag in ('node', 'way', 'relation'):
+                # Drop finished elements from the tree so memory does not grow with the file
+                root.clear()
+
+
+def _is_shelter(tags):
+    return bool(tags.get('name')) and any((k, tags.get(k)) in SHELTER_TAGS for k in ('amenity', 'building', 'tourism', 'leisure'))
+
+
+def _capacity(tags):
+    try:
+        return max(int(tags.get('capacity', '0').strip()), 0)
+    except ValueError:
+        return 0
+
+
+def _shelter_row(osm_id, lat, lon, tags):
+    address = tags.get('addr:full') or ', '.join(
+        v for v in (tags.get('addr:housenumber'), tags.get('addr:street'), tags.get('addr:city')) if v
+    )
+    capacity = _capacity(tags)
+    return {
+        'osm_id': osm_id,
+        'name': tags['name'][:200],
+        'location': address or f"Lat: {lat:.4f}, Lon: {lon:.4f}",
+        'capacity': capacity,
+        'available': capacity,
+        'latitude': round(lat, 7),
+        'longitude': round(lon, 7),
+        'shelter_type': classify_shelter(tags),
+        'phone': tags.get('phone') or tags.get('contact:phone'),
+    }
+
+
+def iter_osm_shelters(path):
+    """Yield shelter rows for matching nodes and ways (ways placed at the centroid of their nodes)."""
+    way_refs = {}
+    for elem, tags in _elements(path, ('way',)):
+        if _is_shelter(tags):
+            way_refs[elem.get('id')] = ([nd.get('ref') for nd in elem.iter('nd')], tags)
+    wanted = {ref for refs, _ in way_refs.values() for ref in refs}
+
+    coords = {}
+    for elem, tags in _elements(path, ('node',)):
+        node_id = elem.get('id')
+        if node_id in wanted:
+            coords[node_id] = (float(elem.get('lat')), float(elem.get('lon')))
+        if _is_shelter(tags):
+            yield _shelter_row(f"node/{node_id}", float(elem.get('lat')), float(elem.get('lon')), tags)
+
+    for way_id, (refs, tags) in way_refs.items():
+        points = [coords[r] for r in refs if r in coords]
+        if points:
+            lat = sum(p[0] for p in points) / len(points)
+            lon = sum(p[1] for p in points) / len(points)
+            yield _shelter_row(f"way/{way_id}", lat, lon, tags)
+
+
+def import_osm_shelters(path, dry_run=False):
+    repo = None
+    if not dry_run:
+        if not Config.is_supabase_configured():
+            print("❌ Supabase not configured. Please set SUPABASE_URL and SUPABASE_KEY in .env file")
+            return
+        from repositories.shelter_repo import ShelterRepository
+        from utils.supabase_client import get_supabase
+        repo = ShelterRepository(get_supabase())
+
+    batch, total = {}, 0
+    for row in iter_osm_shelters(path):
+        batch[row['osm_id']] = row
+        if len(batch) >= BATCH_SIZE:
+            if repo:
+                repo.upsert_osm(list(batch.values()))
+            total += len(batch)
+            batch = {}
+            print(f"  ... {total} shelters imported")
+    if batch:
+        if repo:
+            repo.upsert_osm(list(batch.values()))
+        total += len(batch)
+
+    print(f"\n🎉 {'Found' if dry_run else 'Imported'} {total} shelters from {path}")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    print("🏠 Importing shelters from OpenStreetMap extract...")
+    print("=" * 50)
+    import_osm_shelters(args[0], dry_run='--dry-run' in sys.argv)
@@ -0,0 +1,148 @@
+-- Monthly partitioning for sms_notifications
+-- Run after complete_database_schema_fixed.sql / fix_missing_columns_complete.sql.
+-- Old months are then removed by dropping whole partitions (cleanup_old_notifications
+-- calls drop_sms_notification_partitions) instead of long row-by-row deletes.
+--
+-- weather_alerts_sent is NOT partitioned: its UNIQUE(weather_id) constraint, which stops
+-- concurrent alert checks from double-sending, cannot exist on a partitioned table unless
+-- it includes the partition key. It holds one row per alerted weather reading and is
+-- cleaned with bounded batched deletes instead.
+-- Requires PostgreSQL 13+ (row triggers on partitioned tables); Supabase runs 15.
+
+BEGIN;
+
+-- Move the existing table aside; its rows are copied into the partitioned table below
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relname = 'sms_notifications' AND c.relkind = 'r'
+  ) THEN
+    ALTER TABLE public.sms_notifications RENAME TO sms_notifications_unpartitioned;
+    ALTER SEQUENCE IF EXISTS public.sms_notifications_id_seq RENAME TO sms_notifications_unpartitioned_id_seq;
+    -- Index names are unique per schema: free them, or the parent's CREATE INDEX IF NOT EXISTS below would be skipped
+    ALTER INDEX IF EXISTS public.idx_sms_notifications_user_id RENAME TO idx_sms_notifications_unpartitioned_user_id;
+    ALTER INDEX IF EXISTS public.idx_sms_notifications_incident_id RENAME TO idx_sms_notifications_unpartitioned_incident_id;
+    ALTER INDEX IF EXISTS public.idx_sms_notifications_status RENAME TO idx_sms_notifications_unpartitioned_status;
+    ALTER INDEX IF EXISTS public.idx_sms_notifications_created_at RENAME TO idx_sms_notifications_unpartitioned_created_at;
+  END IF;
+END $$;
+
+-- The partition key must be part of the primary key
+CREATE TABLE IF NOT EXISTS public.sms_notifications (
+  id BIGSERIAL,
+  user_id UUID REFERENCES public.users(id) ON DELETE CASCADE,
+  phone_number TEXT NOT NULL,
+  message TEXT NOT NULL,
+  incident_id BIGINT REFERENCES public.incidents(id) ON DELETE CASCADE,
+  status TEXT NOT NULL CHECK (status IN ('sent', 'failed', 'pending')),
+  twilio_sid TEXT,
+  error_message TEXT,
+  segments SMALLINT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catches rows outside every monthly partition (e.g. if partitions were not created in time)
+CREATE TABLE IF NOT EXISTS public.sms_notifications_default PARTITION OF public.sms_notifications DEFAULT;
+
+-- Creates partitions from the month of from_date through months_ahead months after the current month.
+-- CREATE/DROP of partitions needs table ownership, so both maintenance functions run as their owner
+-- (SECURITY DEFINER) and only the worker's role may call them (see the grants at the end).
+CREATE OR REPLACE FUNCTION public.ensure_sms_notification_partitions(months_ahead INTEGER DEFAULT 2, from_date TIMESTAMPTZ DEFAULT NOW())
+RETURNS INTEGER AS $$
+DECLARE
+  month_start DATE := date_trunc('month', from_date)::DATE;
+  last_month DATE := (date_trunc('month', NOW()) + make_interval(months => months_ahead))::DATE;
+  partition_name TEXT;
+  created INTEGER := 0;
+BEGIN
+  WHILE month_start <= last_month LOOP
+    partition_name := 'sms_notifications_' || to_char(month_start, 'YYYY_MM');
+    IF to_regclass('public.' || partition_name) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.sms_notifications FOR VALUES FROM (%L) TO (%L)',
+        partition_name, month_start, (month_start + INTERVAL '1 month')::DATE
+      );
+      created := created + 1;
+    END IF;
+    month_start := (month_start + INTERVAL '1 month')::DATE;
+  END LOOP;
+  RETURN created;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Drops every monthly partition that ends on or before cutoff; returns how many were dropped
+CREATE OR REPLACE FUNCTION public.drop_sms_notification_partitions(cutoff TIMESTAMPTZ)
+RETURNS INTEGER AS $$
+DECLARE
+  part RECORD;
+  dropped INTEGER := 0;
+BEGIN
+  FOR part IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    WHERE p.relname = 'sms_notifications'
+      AND c.relname ~ '^sms_notifications_[0-9]{4}_[0-9]{2}$'
+  LOOP
+    IF (to_date(right(part.relname, 7), 'YYYY_MM') + INTERVAL '1 month') <= cutoff THEN
+      EXECUTE format('DROP TABLE public.%I', part.relname);
+      dropped := dropped + 1;
+    END IF;
+  END LOOP;
+  RETURN dropped;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- Partitions for every month that still has rows, plus the next two
+DO $$
+DECLARE
+  oldest TIMESTAMPTZ;
+BEGIN
+  IF to_regclass('public.sms_notifications_unpartitioned') IS NOT NULL THEN
+    SELECT MIN(created_at) INTO oldest FROM public.sms_notifications_unpartitioned;
+  END IF;
+  PERFORM public.ensure_sms_notification_partitions(2, COALESCE(oldest, NOW()));
+END $$;
+
+-- Indexes on the parent are created on every partition
+CREATE INDEX IF NOT EXISTS idx_sms_notifications_user_id ON public.sms_notifications(user_id);
+CREATE INDEX IF NOT EXISTS idx_sms_notifications_incident_id ON public.sms_notifications(incident_id);
+CREATE INDEX IF NOT EXISTS idx_sms_notifications_status ON public.sms_notifications(status);
+CREATE INDEX IF NOT EXISTS idx_sms_notifications_created_at ON public.sms_notifications(created_at);
+
+DROP TRIGGER IF EXISTS update_sms_notifications_updated_at ON public.sms_notifications;
+CREATE TRIGGER update_sms_notifications_updated_at
+    BEFORE UPDATE ON public.sms_notifications
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Copy existing rows, keep ids increasing from where they were, then drop the old table
+DO $$
+BEGIN
+  IF to_regclass('public.sms_notifications_unpartitioned') IS NOT NULL THEN
+    INSERT INTO public.sms_notifications
+      (id, user_id, phone_number, message, incident_id, status, twilio_sid, error_message, segments, created_at, updated_at)
+    SELECT id, user_id, phone_number, message, incident_id, status, twilio_sid, error_message, segments,
+           COALESCE(created_at, NOW()), updated_at
+    FROM public.sms_notifications_unpartitioned;
+    PERFORM setval('public.sms_notifications_id_seq',
+                   GREATEST((SELECT COALESCE(MAX(id), 0) FROM public.sms_notifications), 1));
+    DROP TABLE public.sms_notifications_unpartitioned;
+  END IF;
+END $$;
+
+GRANT ALL ON public.sms_notifications TO authenticated;
+GRANT ALL ON public.sms_notifications TO anon;
+GRANT USAGE ON SEQUENCE public.sms_notifications_id_seq TO authenticated;
+GRANT USAGE ON SEQUENCE public.sms_notifications_id_seq TO anon;
+
+-- Partition maintenance is for the Celery worker (service_role key) only
+REVOKE ALL ON FUNCTION public.ensure_sms_notification_partitions(INTEGER, TIMESTAMPTZ) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.drop_sms_notification_partitions(TIMESTAMPTZ) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ensure_sms_notification_partitions(INTEGER, TIMESTAMPTZ) TO service_role;
+GRANT EXECUTE ON FUNCTION public.drop_sms_notification_partitions(TIMESTAMPTZ) TO service_role;
+
+COMMIT;
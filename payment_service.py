@@ -7,9 +7,8 @@ import io
 import base64
 import time
 from config import Config
-from supabase import create_client, Client
+from utils.supabase_client import supabase_or_none
 import logging
-import json
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +28,7 @@ class PaymentService:
         
         # Initialize Supabase client
         if Config.is_supabase_configured():
-            self.supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+            self.supabase = supabase_or_none()
             logger.info("Supabase client initialized for payment logging")
         else:
             logger.warning("Supabase not configured. Payment logs will not be saved.")
@@ -0,0 +1,57 @@
+from datetime import datetime, timezone
+from typing import Iterator
+
+
+class DuplicateSignatureRepository:
+    """MinHash signatures of incidents and the last computed near-duplicate groups."""
+
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+
+    def max_incident_id(self) -> int:
+        res = self.supabase.table('incident_signatures').select('incident_id').order('incident_id', desc=True).limit(1).execute()
+        return int(res.data[0]['incident_id']) if res and res.data else 0
+
+    def save_signatures(self, rows: list[dict], chunk_size: int = 500):
+        """Store signatures; rows another worker already stored are left alone."""
+        for i in range(0, len(rows), chunk_size):
+            self.supabase.table('incident_signatures').upsert(rows[i:i + chunk_size], on_conflict='incident_id',
+                                                              ignore_duplicates=True).execute()
+
+    def iter_signatures(self, after_id: int = 0, page_size: int = 1000) -> Iterator[dict]:
+        """Yield (incident_id, signature) rows above ``after_id``, paging by incident id."""
+        while True:
+            res = (self.supabase.table('incident_signatures').select('incident_id, signature')
+                   .gt('incident_id', after_id).order('incident_id').limit(page_size).execute())
+            rows = res.data if res and res.data else []
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1]['incident_id']
+
+    def iter_incident_ids(self, page_size: int = 5000) -> Iterator[int]:
+        after_id = 0
+        while True:
+            res = (self.supabase.table('incident_signatures').select('incident_id')
+                   .gt('incident_id', after_id).order('incident_id').limit(page_size).execute())
+            rows = res.data if res and res.data else []
+            for row in rows:
+                yield row['incident_id']
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1]['incident_id']
+
+    def count(self) -> int:
+        resp = self.supabase.table('incident_signatures').select('id', count='exact').limit(1).execute()
+        return getattr(resp, 'count', None) or 0
+
+    def save_groups(self, groups: list[list[dict]]):
+        self.supabase.table('incident_duplicate_groups').upsert({
+            'id': 1,
+            'groups': groups,
+            'computed_at': datetime.now(timezone.utc).isoformat(),
+        }, on_conflict='id').execute()
+
+    def load_groups(self) -> list[list[dict]]:
+        res = self.supabase.table('incident_duplicate_groups').select('groups').eq('id', 1).limit(1).execute()
+        return (res.data[0].get('groups') or []) if res and res.data else []
@@ -0,0 +1,47 @@
+from typing import Optional
+
+
+class IncidentClusterRepository:
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+
+    def get(self, pincode: str, lane: str) -> Optional[dict]:
+        res = self.supabase.table('incident_clusters').select('*').eq('pincode', pincode).eq('lane', lane).limit(1).execute()
+        return res.data[0] if res and res.data else None
+
+    def insert(self, payload: dict) -> Optional[dict]:
+        res = self.supabase.table('incident_clusters').insert(payload).execute()
+        return res.data[0] if res and res.data else None
+
+    def update_if_version(self, cluster_id: int, version: int, payload: dict) -> bool:
+        """Compare-and-set update: only applies when nobody bumped the version meanwhile."""
+        res = self.supabase.table('incident_clusters').update(payload).eq('id', cluster_id).eq('version', version).execute()
+        return bool(res and res.data)
+
+    def replace_pincode(self, pincode: str, clusters: list[dict]):
+        """Make ``clusters`` the only rows of ``pincode``, never leaving it without any in between.
+
+        Rows are upserted on (pincode, lane) and only then are lanes that no
+        longer exist deleted. Versions are raised above the ones replaced, so a
+        concurrent compare-and-set update made against an old row fails and
+        retries instead of overwriting the rebuilt state.
+        """
+        res = self.supabase.table('incident_clusters').select('id, lane, version').eq('pincode', pincode).execute()
+        existing = res.data if res and res.data else []
+        floor = max((row.get('version') or 0 for row in existing), default=0)
+        rows = [dict(c, version=floor + (c.get('version') or 0) + 1) for c in clusters]
+        if rows:
+            self.supabase.table('incident_clusters').upsert(rows, on_conflict='pincode,lane').execute()
+        kept = {c.get('lane') for c in clusters}
+        stale = [row['id'] for row in existing if row.get('lane') not in kept]
+        if stale:
+            self.supabase.table('incident_clusters').delete().in_('id', stale).execute()
+
+    def list_by_lane(self, lane: str) -> list[dict]:
+        res = self.supabase.table('incident_clusters').select('*').eq('lane', lane).order('latest_timestamp', desc=True).execute()
+        return res.data if res and res.data else []
+
+    def count(self) -> int:
+        """Number of cluster rows; raises when the table cannot be read (e.g. not migrated)."""
+        resp = self.supabase.table('incident_clusters').select('id', count='exact').limit(1).execute()
+        return getattr(resp, 'count', None) or 0
@@ -6,20 +6,56 @@ class IncidentRepository:
         self.supabase = supabase_client
 
     def insert_incident(self, payload: dict) -> Optional[int]:
+        row = self.insert_incident_row(payload)
+        return row['id'] if row else None
+
+    def insert_incident_row(self, payload: dict) -> Optional[dict]:
         res = self.supabase.table('incidents').insert(payload).execute()
         if res and res.data:
-            return res.data[0]['id']
+            return res.data[0]
         return None
 
     def get_incident(self, incident_id: int) -> Optional[dict]:
         res = self.supabase.table('incidents').select('*').eq('id', incident_id).limit(1).execute()
         return res.data[0] if res and res.data else None
 
+    def list_by_pincode(self, pincode: Optional[str]) -> list[dict]:
+        query = self.supabase.table('incidents').select('*')
+        query = query.is_('pincode', 'null') if pincode is None else query.eq('pincode', pincode)
+        res = query.order('timestamp', desc=True).execute()
+        return res.data if res and res.data else []
+
+    def list_all(self) -> list[dict]:
+        res = self.supabase.table('incidents').select('*').order('timestamp', desc=True).execute()
+        return res.data if res and res.data else []
+
+    def list_since(self, last_id: int, limit: int = 1000) -> list[dict]:
+        rows = []
+        while True:
+            res = self.supabase.table('incidents').select('id, location, city, pincode, description, timestamp').gt('id', last_id).order('id').limit(limit).execute()
+            page = res.data if res and res.data else []
+            rows.extend(page)
+            if len(page) < limit:
+                return rows
+            last_id = page[-1]['id']
+
+    def list_by_ids(self, ids: list) -> list[dict]:
+        res = self.supabase.table('incidents').select('id, location, pincode, description, timestamp').in_('id', list(ids)).execute()
+        return res.data if res and res.data else []
+
+    def count(self, status: Optional[str] = None) -> int:
+        try:
+            query = self.supabase.table('incidents').select('id', count='exact')
+            if status:
+                query = query.eq('status', status)
+            resp = query.limit(1).execute()
+            return getattr(resp, 'count', None) or 0
+        except Exception:
+            return 0
+
     def update_incident_forwarded(self, incident_id: int, forwarded_at: str) -> bool:
         res = self.supabase.table('incidents').update({
             'status': 'forwarded',
             'forwarded_at': forwarded_at
         }).eq('id', incident_id).execute()
         return bool(res and res.data)
-
-
@@ -0,0 +1,47 @@
+from typing import Optional
+
+
+class NotificationRepository:
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+
+    def insert_inbox(self, rows: list[dict]) -> int:
+        """Write in-app notifications in one multi-row insert."""
+        if not rows:
+            return 0
+        self.supabase.table('notification_inbox').insert(rows).execute()
+        return len(rows)
+
+    def list_inbox(self, user_id: str, unread_only: bool = False, limit: int = 50) -> list[dict]:
+        query = self.supabase.table('notification_inbox').select('id, title, body, severity, incident_id, created_at, read_at').eq('user_id', user_id)
+        if unread_only:
+            query = query.is_('read_at', 'null')
+        res = query.order('created_at', desc=True).limit(limit).execute()
+        return res.data if res and res.data else []
+
+    def mark_read(self, user_id: str, ids: list[int], read_at: str):
+        if ids:
+            self.supabase.table('notification_inbox').update({'read_at': read_at}).eq('user_id', user_id).in_('id', ids).execute()
+
+    def push_subscriptions_for(self, user_ids: list[str]) -> dict[str, list[dict]]:
+        """Web Push subscriptions for many users in one query, keyed by user id."""
+        if not user_ids:
+            return {}
+        res = self.supabase.table('push_subscriptions').select('user_id, endpoint, p256dh, auth').in_('user_id', user_ids).execute()
+        subs = {}
+        for row in (res.data or []) if res else []:
+            subs.setdefault(row['user_id'], []).append(
+                {'endpoint': row['endpoint'], 'keys': {'p256dh': row['p256dh'], 'auth': row['auth']}}
+            )
+        return subs
+
+    def save_push_subscription(self, user_id: str, subscription: dict) -> Optional[dict]:
+        keys = subscription.get('keys') or {}
+        row = {'user_id': user_id, 'endpoint': subscription['endpoint'], 'p256dh': keys.get('p256dh'), 'auth': keys.get('auth')}
+        res = self.supabase.table('push_subscriptions').upsert(row, on_conflict='endpoint').execute()
+        return res.data[0] if res and res.data else None
+
+    def delete_push_subscriptions(self, endpoints: list[str]):
+        """Remove subscriptions the push service reported as gone."""
+        if endpoints:
+            self.supabase.table('push_subscriptions').delete().in_('endpoint', endpoints).execute()
@@ -0,0 +1,30 @@
+from typing import Iterator
+
+
+class ShelterRepository:
+    COLUMNS = "id, name, location, capacity, available, latitude, longitude, shelter_type, phone"
+
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+
+    def iter_located(self, page_size: int = 1000) -> Iterator[dict]:
+        """Yield every shelter with coordinates, paging by id."""
+        last_id = 0
+        while True:
+            resp = (self.supabase.table("shelters").select(self.COLUMNS)
+                    .not_.is_("latitude", "null").not_.is_("longitude", "null")
+                    .gt("id", last_id).order("id").limit(page_size).execute())
+            rows = resp.data if resp and resp.data else []
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def list_unlocated(self) -> list[dict]:
+        resp = self.supabase.table("shelters").select(self.COLUMNS).is_("latitude", "null").execute()
+        return resp.data if resp and resp.data else []
+
+    def upsert_osm(self, rows: list[dict]):
+        """Insert or refresh imported OpenStreetMap shelters keyed by their OSM id."""
+        if rows:
+            self.supabase.table("shelters").upsert(rows, on_conflict="osm_id").execute()
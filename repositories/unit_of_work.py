@@ -0,0 +1,79 @@
+from typing import Optional, Union
+
+from utils.logger import get_logger
+
+
+class UnitOfWorkConflict(Exception):
+    """A guarded write matched no row, e.g. a unit already taken by a concurrent dispatch.
+
+    When the writes went through the database function nothing was applied.
+    """
+
+
+class UnitOfWork:
+    """Collects the writes of one logical operation and applies them in one round trip.
+
+    ``commit()`` sends every queued insert/update to the ``apply_unit_of_work``
+    Postgres function, which runs them in order inside one transaction: one
+    network round trip instead of one per write, and either all of them land or
+    none do. An update with ``expect=True`` that matches no row aborts the whole
+    call with :class:`UnitOfWorkConflict`; combined with ``exclude`` it works as
+    a compare-and-set, so two concurrent dispatches cannot both claim a unit.
+
+    Where the function has not been deployed yet, the writes are applied one by
+    one through the table API in the same order (not atomic, so put guarded
+    writes first).
+    """
+
+    RPC = 'apply_unit_of_work'
+    _rpc_missing = False
+
+    def __init__(self, supabase_client):
+        self.supabase = supabase_client
+        self.ops = []
+
+    def insert(self, table: str, values: Union[dict, list[dict]]) -> int:
+        """Queue an insert of one row or a list of rows; returns its index into the list ``commit()`` returns."""
+        self.ops.append({'op': 'insert', 'table': table, 'values': values})
+        return len(self.ops) - 1
+
+    def update(self, table: str, values: dict, match: dict, exclude: Optional[dict] = None, expect: bool = False) -> int:
+        """Queue an update of the rows equal to ``match`` and not equal to ``exclude``; returns its index."""
+        if not match:
+            raise ValueError("update needs at least one match column")
+        self.ops.append({'op': 'update', 'table': table, 'values': values, 'match': match,
+                         'exclude': exclude or {}, 'expect': expect})
+        return len(self.ops) - 1
+
+    def commit(self) -> list[list[dict]]:
+        """Apply the queued writes; returns the rows each one wrote, in queue order."""
+        ops, self.ops = self.ops, []
+        if not ops:
+            return []
+        if not UnitOfWork._rpc_missing:
+            try:
+                res = self.supabase.rpc(self.RPC, {'ops': ops}).execute()
+                return res.data or [[] for _ in ops]
+            except Exception as e:
+                if 'unit_of_work_conflict' in str(e):
+                    raise UnitOfWorkConflict(str(e)) from e
+                if getattr(e, 'code', None) != 'PGRST202':  # function not found
+                    raise
+                UnitOfWork._rpc_missing = True
+                get_logger().warning(f"{self.RPC} is not deployed; applying writes one by one")
+        return [self._apply(i, op) for i, op in enumerate(ops)]
+
+    def _apply(self, index: int, op: dict) -> list[dict]:
+        table = self.supabase.table(op['table'])
+        if op['op'] == 'insert':
+            res = table.insert(op['values']).execute()
+            return res.data or []
+        query = table.update(op['values'])
+        for column, value in op['match'].items():
+            query = query.eq(column, value)
+        for column, value in op['exclude'].items():
+            query = query.neq(column, value)
+        rows = query.execute().data or []
+        if op['expect'] and not rows:
+            raise UnitOfWorkConflict(f"unit_of_work_conflict: op {index} on {op['table']} matched no rows")
+        return rows
@@ -1,7 +1,10 @@
-from typing import Optional
+from typing import Iterator, Optional
 
 
 class UserRepository:
+    # Columns the notification directory (services/user_directory.py) keeps per user
+    DIRECTORY_COLUMNS = "id, phone, latitude, longitude, name, email, pincode"
+
     def __init__(self, supabase_client):
         self.supabase = supabase_client
 
@@ -24,4 +27,61 @@ class UserRepository:
         resp = self.supabase.table("users").select("id,name,email,role").eq("id", user_id).limit(1).execute()
         return resp.data[0] if resp and resp.data else None
 
+    def iter_phone_users(self, page_size: int = 1000, columns: str = DIRECTORY_COLUMNS) -> Iterator[dict]:
+        """Yield every user with a phone number, paging by id so each page is an index range scan.
+
+        Only one page is held at a time, so callers can stream any number of users.
+        """
+        last_id = None
+        while True:
+            query = self.supabase.table("users").select(columns).not_.is_("phone", "null")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            resp = query.order("id").limit(page_size).execute()
+            rows = resp.data if resp and resp.data else []
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def latest_update(self) -> Optional[str]:
+        """Newest ``updated_at`` of any user, the starting watermark for :meth:`iter_changed_users`."""
+        resp = self.supabase.table("users").select("updated_at").order("updated_at", desc=True, nullsfirst=False).limit(1).execute()
+        return resp.data[0].get("updated_at") if resp and resp.data else None
+
+    def iter_changed_users(self, since: Optional[str], page_size: int = 1000,
+                           columns: str = DIRECTORY_COLUMNS) -> Iterator[dict]:
+        """Yield users updated at or after ``since`` (all users when None), oldest change first.
+
+        Rows with and without a phone are returned, so a removed phone number is
+        seen too. Pages are keyed on (updated_at, id): a bulk update gives many
+        rows the same timestamp, and those are walked by id before moving past it.
+        """
+        ts, after_id, strict = since, None, False
+        while True:
+            query = self.supabase.table("users").select(f"{columns}, updated_at")
+            if after_id is not None:
+                query = query.eq("updated_at", ts).gt("id", after_id)
+            elif ts is not None:
+                query = query.gt("updated_at", ts) if strict else query.gte("updated_at", ts)
+            resp = query.order("updated_at").order("id").limit(page_size).execute()
+            rows = resp.data if resp and resp.data else []
+            yield from rows
+            if after_id is not None:
+                # Still inside one timestamp: continue by id, then strictly after it
+                if len(rows) < page_size:
+                    after_id, strict = None, True
+                else:
+                    after_id = rows[-1]["id"]
+            elif len(rows) < page_size:
+                return
+            else:
+                ts, after_id = rows[-1]["updated_at"], rows[-1]["id"]
 
+    def estimate_phone_users(self) -> int:
+        """Planner estimate of users with a phone number (no full count scan)."""
+        try:
+            resp = self.supabase.table("users").select("id", count="planned").not_.is_("phone", "null").limit(1).execute()
+            return getattr(resp, "count", None) or 0
+        except Exception:
+            return 0
@@ -49,4 +49,33 @@ class WeatherRepository:
             log_exception(e, context=f"weather_insert_minimal [{payload.get('location', 'unknown')}]")
             return None
 
+    def list_recent_extreme(self, limit: int = 10, since: Optional[str] = None) -> list[dict]:
+        query = self.supabase.table('weather_data').select('*').eq('is_extreme', True)
+        if since:
+            query = query.gte('fetched_at', since)
+        result = query.order('fetched_at', desc=True).limit(limit).execute()
+        return result.data if result and result.data else []
 
+    def sent_alert_ids(self, weather_ids: list[int]) -> set[int]:
+        """Ids among ``weather_ids`` that already have an alert marker (one query)."""
+        if not weather_ids:
+            return set()
+        result = self.supabase.table('weather_alerts_sent').select('weather_id').in_('weather_id', weather_ids).execute()
+        return {row['weather_id'] for row in (result.data or [])} if result else set()
+
+    def claim_alerts(self, weather_ids: list[int]) -> set[int]:
+        """Insert markers for ``weather_ids`` in one statement; returns the ids this call inserted.
+
+        Relies on the unique weather_id constraint: rows another run already
+        claimed are skipped, so only one concurrent caller gets each id back.
+        """
+        if not weather_ids:
+            return set()
+        rows = [{'weather_id': weather_id} for weather_id in weather_ids]
+        result = self.supabase.table('weather_alerts_sent').upsert(rows, on_conflict='weather_id', ignore_duplicates=True).execute()
+        return {row['weather_id'] for row in (result.data or [])} if result else set()
+
+    def release_alerts(self, weather_ids: list[int]):
+        """Remove markers for alerts that could not be queued, so the next run retries them."""
+        if weather_ids:
+            self.supabase.table('weather_alerts_sent').delete().in_('weather_id', weather_ids).execute()
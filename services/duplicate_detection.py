@@ -0,0 +1,249 @@
+"""
+Near-duplicate incident report detection using MinHash signatures and an LSH index
+"""
+import base64
+import re
+import threading
+import zlib
+from typing import Hashable, Iterable, Optional
+
+import numpy as np
+
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_STOPWORDS = frozenset({
+    'the', 'and', 'for', 'near', 'with', 'are', 'was', 'has', 'have', 'from',
+    'this', 'that', 'there', 'here', 'very', 'some', 'area', 'road',
+})
+
+
+class MinHashLSH:
+    """Banded MinHash LSH index.
+
+    Documents are sets of string shingles. Each document gets a ``num_perm``
+    MinHash signature split into ``bands`` bands; documents sharing any band
+    bucket become candidates, which are then verified against ``threshold`` on
+    the estimated Jaccard similarity. Adds and queries touch only ``bands``
+    buckets, so cost does not grow with the number of indexed documents.
+    Buckets larger than ``max_bucket`` (boilerplate text every report shares)
+    carry no signal and are skipped when probing, which keeps the per-query
+    cost bounded even on skewed data.
+
+    Groups are kept as explicit member sets per union-find root, so removing
+    a key re-links only its own group and listing groups costs one pass over
+    the groups rather than over every indexed document.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, threshold: float = 0.5, seed: int = 7,
+                 max_bucket: int = 200):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_bucket = max_bucket
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(_MERSENNE_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, int(_MERSENNE_PRIME), size=(num_perm, 1), dtype=np.uint64)
+        self._buckets = [dict() for _ in range(bands)]
+        self._signatures = {}
+        self._parent = {}
+        self._members = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, key):
+        return key in self._signatures
+
+    def signature(self, shingles: Iterable[str]) -> np.ndarray:
+        hashed = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64)
+        if hashed.size == 0:
+            return np.full(self.num_perm, int(_MERSENNE_PRIME), dtype=np.uint64)
+        # (a*x + b) mod p for every permutation at once; a, x < 2**32 so nothing overflows
+        return ((self._a * (hashed & np.uint64(0x7FFFFFFF)) + self._b) % _MERSENNE_PRIME).min(axis=1)
+
+    @staticmethod
+    def encode(sig: np.ndarray) -> str:
+        """Serialise a signature for storage (every value is below 2**31)."""
+        return base64.b64encode(sig.astype('<u4').tobytes()).decode('ascii')
+
+    @staticmethod
+    def decode(text: str) -> np.ndarray:
+        return np.frombuffer(base64.b64decode(text), dtype='<u4').astype(np.uint64)
+
+    def _band_keys(self, sig: np.ndarray):
+        r = self.rows
+        return [sig[i * r:(i + 1) * r].tobytes() for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        return float(np.count_nonzero(sig_a == sig_b)) / sig_a.size
+
+    def _find(self, key):
+        parent = self._parent
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    def _union(self, a, b):
+        ra, rb = self._find(a), self._find(b)
+        if ra != rb:
+            if len(self._members[ra]) < len(self._members[rb]):
+                ra, rb = rb, ra
+            self._parent[rb] = ra
+            self._members[ra] |= self._members.pop(rb)
+
+    def _candidates(self, sig: np.ndarray, exclude=None) -> list:
+        seen = set()
+        matches = []
+        for band, bkey in zip(self._buckets, self._band_keys(sig)):
+            members = band.get(bkey, ())
+            if len(members) > self.max_bucket:
+                continue
+            for other in members:
+                if other == exclude or other in seen:
+                    continue
+                seen.add(other)
+                score = self.similarity(sig, self._signatures[other])
+                if score >= self.threshold:
+                    matches.append((other, score))
+        matches.sort(key=lambda x: x[1], reverse=True)
+        return matches
+
+    def add(self, key: Hashable, shingles: Iterable[str]) -> list:
+        """Index a document and return its verified near-duplicates as (key, similarity)."""
+        return self.add_signature(key, self.signature(shingles))
+
+    def add_signature(self, key: Hashable, sig: np.ndarray) -> list:
+        """Index a precomputed signature (e.g. one loaded through :meth:`decode`)."""
+        with self._lock:
+            if key in self._signatures:
+                self.remove(key)
+            matches = self._candidates(sig, exclude=key)
+            self._signatures[key] = sig
+            self._parent[key] = key
+            self._members[key] = {key}
+            for band, bkey in zip(self._buckets, self._band_keys(sig)):
+                band.setdefault(bkey, set()).add(key)
+            for other, _ in matches:
+                self._union(key, other)
+        return matches
+
+    def query(self, shingles: Iterable[str]) -> list:
+        sig = self.signature(shingles)
+        with self._lock:
+            return self._candidates(sig)
+
+    def remove(self, key: Hashable):
+        with self._lock:
+            sig = self._signatures.pop(key, None)
+            if sig is None:
+                return
+            for band, bkey in zip(self._buckets, self._band_keys(sig)):
+                members = band.get(bkey)
+                if members:
+                    members.discard(key)
+                    if not members:
+                        del band[bkey]
+            # Rebuild the groups around the removed key from its remaining members
+            affected = self._members.pop(self._find(key))
+            affected.discard(key)
+            self._parent.pop(key, None)
+            for k in affected:
+                self._parent[k] = k
+                self._members[k] = {k}
+            for k in affected:
+                for other, _ in self._candidates(self._signatures[k], exclude=k):
+                    self._union(k, other)
+
+    def groups(self, min_size: int = 2) -> list[list]:
+        """Connected components of verified near-duplicate pairs."""
+        with self._lock:
+            comps = [list(m) for m in self._members.values() if len(m) >= min_size]
+        return [sorted(g, key=str) for g in comps]
+
+
+class DuplicateReportIndex:
+    """Incident-aware wrapper around :class:`MinHashLSH`.
+
+    Shingles combine description words with character trigrams of the location
+    and pincode, so reports about the same event still collide when the pincode
+    or place name was mistyped, while same-pincode reports about different
+    events do not.
+    """
+
+    def __init__(self, lsh: Optional[MinHashLSH] = None):
+        self.lsh = lsh or MinHashLSH()
+        self.last_seen_id = 0
+        self._incidents = {}
+
+    @staticmethod
+    def shingles(incident: dict) -> set:
+        desc = (incident.get('description') or '').lower()
+        words = [w for w in _TOKEN_RE.findall(desc) if len(w) > 2 and w not in _STOPWORDS]
+        out = {f"w:{w}" for w in words}
+        out.update(f"b:{a}_{b}" for a, b in zip(words, words[1:]))
+        place = ' '.join(str(incident.get(k) or '') for k in ('location', 'city')).lower()
+        for token in _TOKEN_RE.findall(place) + [str(incident.get('pincode') or '')]:
+            padded = f"#{token}#"
+            out.update(f"l:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return out
+
+    def add(self, incident: dict) -> list:
+        inc_id = incident.get('id')
+        if inc_id is None:
+            return []
+        self._incidents[inc_id] = {k: incident.get(k) for k in ('id', 'location', 'pincode', 'description', 'timestamp')}
+        return self.lsh.add(inc_id, self.shingles(incident))
+
+    def remove(self, incident_id):
+        self._incidents.pop(incident_id, None)
+        self.lsh.remove(incident_id)
+
+    def find_duplicates(self, incident: dict) -> list:
+        return [(k, s) for k, s in self.lsh.query(self.shingles(incident)) if k != incident.get('id')]
+
+    def candidate_groups(self) -> list[list[dict]]:
+        groups = [[self._incidents[k] for k in g if k in self._incidents] for g in self.lsh.groups()]
+        return sorted(groups, key=len, reverse=True)
+
+    def sync(self, incident_repo, signature_repo) -> dict:
+        """Bring the index in line with the shared ``incident_signatures`` table.
+
+        Incidents newer than the last stored signature are MinHashed once and
+        their signatures stored, so other processes load them instead of
+        recomputing. Signatures stored since ``last_seen_id`` are indexed, and
+        keys whose signature rows are gone (the incident was deleted anywhere)
+        are dropped; the full id list is only read when the counts disagree.
+        """
+        new_rows = incident_repo.list_since(signature_repo.max_incident_id())
+        if new_rows:
+            signature_repo.save_signatures([
+                {'incident_id': row['id'], 'signature': MinHashLSH.encode(self.lsh.signature(self.shingles(row)))}
+                for row in new_rows
+            ])
+        added = 0
+        for row in signature_repo.iter_signatures(self.last_seen_id):
+            self.lsh.add_signature(row['incident_id'], MinHashLSH.decode(row['signature']))
+            self.last_seen_id = max(self.last_seen_id, int(row['incident_id']))
+            added += 1
+        removed = 0
+        if signature_repo.count() != len(self.lsh):
+            live = set(signature_repo.iter_incident_ids())
+            for key in [k for k in list(self.lsh._signatures) if k not in live]:
+                self.remove(key)
+                removed += 1
+        return {'signed': len(new_rows), 'added': added, 'removed': removed}
+
+    def top_groups(self, incident_repo, limit: int = 10) -> list[list[dict]]:
+        """The largest groups with each member's incident summary, fetched in one query."""
+        groups = sorted(self.lsh.groups(), key=len, reverse=True)[:limit]
+        ids = [k for g in groups for k in g]
+        details = {row['id']: row for row in incident_repo.list_by_ids(ids)} if ids else {}
+        out = [[details[k] for k in g if k in details] for g in groups]
+        return [g for g in out if len(g) >= 2]
@@ -1,9 +1,9 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import quote
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import requests
 from utils.logger import get_logger, log_exception
+from utils.metrics import InstrumentedHTTPAdapter
 
 
 class EnhancedWeatherService:
@@ -90,7 +90,7 @@ class EnhancedWeatherService:
                 allowed_methods=frozenset(["GET"]) 
             )
             session = requests.Session()
-            adapter = HTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=20)
+            adapter = InstrumentedHTTPAdapter(max_retries=retry, pool_connections=20, pool_maxsize=20)
             session.mount("http://", adapter)
             session.mount("https://", adapter)
             session.headers.update({
@@ -0,0 +1,162 @@
+"""
+Server-side geocoding with a persistent SQLite cache and a rate-limited Nominatim queue
+"""
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Optional
+
+from utils.cache import SingleFlight
+from utils.logger import get_logger
+from utils.metrics import outbound_call
+from utils.rate_limiter import TokenBucketLimiter
+
+
+class GeocoderBusy(RuntimeError):
+    """The Nominatim queue is full; the caller should retry later rather than wait behind it."""
+
+
+class GeocodingService:
+    """Geocodes place names through one shared, cached, rate-limited pipeline.
+
+    Queries are normalized (case, whitespace, punctuation) and looked up in a
+    local SQLite cache first. Misses go through a :class:`SingleFlight`, so
+    identical lookups in flight at the same time share one upstream call, and
+    then onto a worker thread that sends the query as the user typed it. Each
+    request takes a token from a :class:`TokenBucketLimiter` shared through
+    Redis, so all web processes together stay at one request per
+    ``min_interval`` seconds, as Nominatim's usage policy requires. "Not
+    found" answers are cached too, for a shorter time. At most ``max_queue`` lookups
+    wait for the worker (beyond that :class:`GeocoderBusy` is raised at once),
+    and a lookup whose caller has given up is skipped rather than sent.
+    """
+
+    FOUND_TTL = 90 * 24 * 3600
+    NOT_FOUND_TTL = 24 * 3600
+    WAIT_TIMEOUT = 30
+
+    def __init__(self, cache_path: str = 'geocode_cache.db', min_interval: float = 1.0, geocoder=None,
+                 user_agent: str = 'disaster_management', max_queue: int = 30,
+                 limiter: Optional[TokenBucketLimiter] = None):
+        self.cache_path = cache_path
+        self.min_interval = min_interval
+        if limiter is None and min_interval > 0:
+            limiter = TokenBucketLimiter(1 / min_interval, burst=1, prefix='geocode:ratelimit')
+        self.limiter = limiter
+        self.user_agent = user_agent
+        self._geocoder = geocoder
+        self.logger = get_logger()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        with self._db_lock:
+            if cache_path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS geocode_cache ('
+                ' query TEXT PRIMARY KEY, lat REAL, lon REAL, display_name TEXT, expires_at REAL NOT NULL)'
+            )
+            self._db.commit()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        text = re.sub(r'[^\w\s,]', ' ', (query or '').lower())
+        text = re.sub(r'\s*,\s*', ', ', text)
+        return re.sub(r'\s+', ' ', text).strip(' ,')
+
+    def _cache_get(self, key: str):
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT lat, lon, display_name, expires_at FROM geocode_cache WHERE query = ?', (key,)
+            ).fetchone()
+        if not row or row[3] < time.time():
+            return None
+        if row[0] is None:
+            return {'found': False}
+        return {'found': True, 'lat': row[0], 'lon': row[1], 'display_name': row[2]}
+
+    def _cache_put(self, key: str, result: Optional[dict]):
+        ttl = self.FOUND_TTL if result else self.NOT_FOUND_TTL
+        values = (key, result['lat'] if result else None, result['lon'] if result else None,
+                  result.get('display_name') if result else None, time.time() + ttl)
+        with self._db_lock:
+            self._db.execute('INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?, ?)', values)
+            self._db.commit()
+
+    def _nominatim(self):
+        if self._geocoder is None:
+            from geopy.geocoders import Nominatim
+            self._geocoder = Nominatim(user_agent=self.user_agent, timeout=10)
+        return self._geocoder
+
+    def _run_worker(self):
+        while True:
+            query, future = self._queue.get()
+            if future.cancelled():
+                continue  # the caller timed out; do not spend a token on it
+            if self.limiter is not None:
+                self.limiter.acquire('nominatim')
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with outbound_call('nominatim.openstreetmap.org'):
+                    location = self._nominatim().geocode(query, timeout=10)
+                future.set_result(None if not location else {
+                    'lat': float(location.latitude),
+                    'lon': float(location.longitude),
+                    'display_name': getattr(location, 'address', None),
+                })
+            except Exception as err:
+                future.set_exception(err)
+
+    def _submit(self, query: str) -> Future:
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_worker, name='geocode-worker', daemon=True)
+                self._worker.start()
+        future = Future()
+        try:
+            self._queue.put_nowait((query, future))
+        except queue.Full:
+            raise GeocoderBusy(f"geocoding queue is full ({self._queue.maxsize} lookups waiting)") from None
+        return future
+
+    def _lookup(self, key: str, query: str) -> Optional[dict]:
+        future = self._submit(query)
+        try:
+            result = future.result(timeout=self.WAIT_TIMEOUT)
+        except FutureTimeout:
+            future.cancel()
+            raise
+        self._cache_put(key, result)
+        return result
+
+    def geocode(self, query: str) -> Optional[dict]:
+        """Return ``{'lat', 'lon', 'display_name'}`` for a place name, or None when it cannot be found.
+
+        Raises :class:`GeocoderBusy` when too many lookups are already waiting for Nominatim.
+        """
+        key = self.normalize(query)
+        if not key:
+            return None
+        cached = self._cache_get(key)
+        if cached is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if not cached.pop('found'):
+                return None
+            return cached
+        # Cached under the normalized key, but Nominatim gets the query as written (only whitespace tidied)
+        return self._flight.do(key, lambda: self._lookup(key, ' '.join(query.split())), timeout=self.WAIT_TIMEOUT)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
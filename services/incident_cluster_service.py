@@ -0,0 +1,165 @@
+from typing import Optional
+from services.incident_service import IncidentService
+from utils.logger import get_logger
+
+
+class IncidentClusterService:
+    """Maintains one cluster row per (pincode, lane) as incidents are reported.
+
+    The admin dashboard reads these rows directly instead of regrouping every
+    incident and re-tokenizing every description on each page load. Incidents
+    reported without a pincode share the ``NO_PINCODE`` cluster.
+    """
+
+    NO_PINCODE = 'none'
+    SAMPLE_SIZE = 3
+    MAX_TERMS = 200
+    MAX_RETRIES = 3
+    COLUMNS = ('pincode', 'lane', 'report_count', 'max_severity', 'latest_timestamp',
+               'term_freq', 'recent_descriptions', 'representative', 'version')
+
+    def __init__(self, cluster_repo, incident_repo=None):
+        self.cluster_repo = cluster_repo
+        self.incident_repo = incident_repo
+        self.logger = get_logger()
+
+    @classmethod
+    def pincode_for(cls, incident: dict) -> str:
+        pincode = incident.get('pincode')
+        return cls.NO_PINCODE if pincode is None else pincode
+
+    @staticmethod
+    def lane_for(incident: dict) -> str:
+        # Mirrors the dashboard split: anything not forwarded is still awaiting review
+        return 'forwarded' if incident.get('status') == 'forwarded' else 'pending'
+
+    @classmethod
+    def fold(cls, cluster: Optional[dict], incident: dict) -> dict:
+        """Return a new cluster state with ``incident`` folded in."""
+        if cluster:
+            cluster = dict(cluster)
+        else:
+            cluster = {
+                'pincode': cls.pincode_for(incident),
+                'lane': cls.lane_for(incident),
+                'report_count': 0,
+                'max_severity': None,
+                'latest_timestamp': None,
+                'term_freq': {},
+                'recent_descriptions': [],
+                'representative': None,
+                'version': 0,
+            }
+
+        cluster['report_count'] = (cluster.get('report_count') or 0) + 1
+
+        severity = incident.get('severity') or 'low'
+        current = cluster.get('max_severity')
+        if current is None or IncidentService.severity_rank(severity) > IncidentService.severity_rank(current):
+            cluster['max_severity'] = severity
+
+        ts = incident.get('timestamp')
+        latest = cluster.get('latest_timestamp')
+        is_newest = cluster.get('representative') is None or bool(ts and (not latest or ts >= latest))
+        if is_newest:
+            cluster['representative'] = incident
+            cluster['latest_timestamp'] = ts or latest
+
+        desc = IncidentService._clean_description(incident.get('description'))
+        if desc:
+            freq = dict(cluster.get('term_freq') or {})
+            for w, c in IncidentService._term_counts(desc).items():
+                freq[w] = freq.get(w, 0) + c
+            if len(freq) > cls.MAX_TERMS:
+                freq = dict(sorted(freq.items(), key=lambda x: x[1], reverse=True)[:cls.MAX_TERMS])
+            cluster['term_freq'] = freq
+
+            samples = list(cluster.get('recent_descriptions') or [])
+            if is_newest:
+                samples.insert(0, desc)
+            else:
+                samples.append(desc)
+            cluster['recent_descriptions'] = samples[:cls.SAMPLE_SIZE]
+
+        cluster['version'] = (cluster.get('version') or 0) + 1
+        return cluster
+
+    @staticmethod
+    def as_incident(cluster: dict) -> dict:
+        """Shape a cluster row like the consolidated incident dicts the templates expect."""
+        inc = dict(cluster.get('representative') or {})
+        count = cluster.get('report_count') or 1
+        pincode = cluster.get('pincode')
+        inc['pincode'] = None if pincode == IncidentClusterService.NO_PINCODE else pincode
+        inc['report_count'] = count
+        inc['cluster_id'] = cluster.get('id')
+        if count > 1:
+            samples = cluster.get('recent_descriptions') or []
+            if samples:
+                inc['description'] = IncidentService._summarize(cluster.get('term_freq') or {}, samples, count)
+            inc['severity'] = cluster.get('max_severity') or inc.get('severity')
+            if cluster.get('latest_timestamp'):
+                inc['timestamp'] = cluster['latest_timestamp']
+        return inc
+
+    @classmethod
+    def build(cls, incidents: list[dict]) -> list[dict]:
+        """Fold raw incidents (any order) into cluster states, oldest first."""
+        clusters = {}
+        for inc in sorted(incidents, key=lambda x: x.get('timestamp') or ''):
+            key = (cls.pincode_for(inc), cls.lane_for(inc))
+            clusters[key] = cls.fold(clusters.get(key), inc)
+        return list(clusters.values())
+
+    @classmethod
+    def _payload(cls, cluster: dict) -> dict:
+        return {k: cluster.get(k) for k in cls.COLUMNS}
+
+    def record_report(self, incident: dict) -> Optional[dict]:
+        """Fold a freshly inserted incident into its cluster with optimistic concurrency."""
+        pincode = self.pincode_for(incident)
+        lane = self.lane_for(incident)
+        for _ in range(self.MAX_RETRIES):
+            current = self.cluster_repo.get(pincode, lane)
+            updated = self.fold(current, incident)
+            if current is None:
+                try:
+                    row = self.cluster_repo.insert(self._payload(updated))
+                    if row:
+                        return row
+                except Exception:
+                    # Lost the race to create this cluster; retry as an update
+                    continue
+            elif self.cluster_repo.update_if_version(current['id'], current.get('version') or 0, self._payload(updated)):
+                return updated
+        self.logger.warning(f"Cluster update for pincode {pincode} kept conflicting; rebuilding it")
+        self.refresh_pincode(pincode)
+        return None
+
+    def refresh_pincode(self, pincode: Optional[str]):
+        """Recompute the clusters of one pincode (None or NO_PINCODE: the unknown bucket) after an incident changed."""
+        if not self.incident_repo:
+            return
+        if pincode == self.NO_PINCODE:
+            pincode = None
+        incidents = self.incident_repo.list_by_pincode(pincode)
+        key = self.NO_PINCODE if pincode is None else pincode
+        self.cluster_repo.replace_pincode(key, [self._payload(c) for c in self.build(incidents)])
+
+    def rebuild_all(self) -> int:
+        """Backfill clusters for every pincode from the incidents table (tasks.rebuild_incident_clusters)."""
+        if not self.incident_repo:
+            return 0
+        by_pincode = {}
+        for inc in self.incident_repo.list_all():
+            by_pincode.setdefault(self.pincode_for(inc), []).append(inc)
+        for pincode, incidents in by_pincode.items():
+            self.cluster_repo.replace_pincode(pincode, [self._payload(c) for c in self.build(incidents)])
+        self.logger.info(f"Rebuilt incident clusters for {len(by_pincode)} pincodes")
+        return len(by_pincode)
+
+    def has_clusters(self) -> bool:
+        return self.cluster_repo.count() > 0
+
+    def consolidated(self, lane: str) -> list[dict]:
+        return [self.as_incident(c) for c in self.cluster_repo.list_by_lane(lane)]
@@ -1,16 +1,22 @@
 from collections import defaultdict
 import re
 from datetime import datetime
+from utils.logger import log_exception
+
+
+SEVERITY_RANK = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
+_WORD_RE = re.compile(r'\b\w+\b')
 
 
 class IncidentService:
-    def __init__(self, incident_repo, request_repo=None, announcement_service=None, sms_service=None, config=None, session=None):
+    def __init__(self, incident_repo, request_repo=None, announcement_service=None, sms_service=None, config=None, session=None, cluster_service=None):
         self.incident_repo = incident_repo
         self.request_repo = request_repo
         self.announcement_service = announcement_service
         self.sms_service = sms_service
         self.config = config
         self.session = session or {}
+        self.cluster_service = cluster_service
 
     @staticmethod
     def consolidate_by_pincode(incidents: list[dict]) -> list[dict]:
@@ -32,7 +38,7 @@ class IncidentService:
                 if descriptions:
                     main_incident['description'] = IncidentService._unify_description(descriptions)
                 main_incident['report_count'] = len(group)
-                main_incident['severity'] = max([g.get('severity', 'low') for g in group], key=lambda x: {'low':1,'medium':2,'high':3}.get(x,1))
+                main_incident['severity'] = max([g.get('severity', 'low') for g in group], key=IncidentService.severity_rank)
                 timestamps = [g.get('timestamp') for g in group if g.get('timestamp')]
                 if timestamps:
                     main_incident['timestamp'] = max(timestamps)
@@ -41,36 +47,53 @@ class IncidentService:
         return consolidated
 
     @staticmethod
-    def _unify_description(descriptions: list[str]) -> str:
-        if not descriptions:
-            return "Multiple reports of incident in this area"
-        cleaned = []
-        for d in descriptions:
-            if d and d.strip():
-                cleaned.append(re.sub(r'\s+', ' ', d.strip()))
-        if not cleaned:
-            return "Multiple reports of incident in this area"
-        if len(cleaned) == 1:
-            return cleaned[0]
-        all_words = []
-        for d in cleaned:
-            all_words.extend(re.findall(r'\b\w+\b', d.lower()))
-        freq = {}
-        for w in all_words:
+    def severity_rank(severity) -> int:
+        return SEVERITY_RANK.get(severity, 1)
+
+    @staticmethod
+    def _clean_description(text) -> str:
+        if not text or not text.strip():
+            return ''
+        return re.sub(r'\s+', ' ', text.strip())
+
+    @staticmethod
+    def _term_counts(text: str) -> dict:
+        counts = {}
+        for w in _WORD_RE.findall(text.lower()):
             if len(w) > 3:
-                freq[w] = freq.get(w, 0) + 1
+                counts[w] = counts.get(w, 0) + 1
+        return counts
+
+    @staticmethod
+    def _summarize(freq: dict, samples: list[str], total: int) -> str:
+        """Render the multi-report description from term counts and the newest report texts."""
         common = sorted(freq.items(), key=lambda x: x[1], reverse=True)[:5]
         if common:
             key_terms = [w for w, c in common if c > 1]
             base = f"Multiple reports of incident involving: {', '.join(key_terms)}. " if key_terms else "Multiple reports of incident in this area. "
         else:
             base = "Multiple reports of incident in this area. "
-        if len(cleaned) <= 3:
-            base += "Reports include: " + "; ".join(cleaned[:3])
+        if total <= 3:
+            base += "Reports include: " + "; ".join(samples[:3])
         else:
-            base += f"Reports include: {cleaned[0]} and {len(cleaned)-1} other reports"
+            base += f"Reports include: {samples[0]} and {total-1} other reports"
         return base
 
+    @staticmethod
+    def _unify_description(descriptions: list[str]) -> str:
+        if not descriptions:
+            return "Multiple reports of incident in this area"
+        cleaned = [c for c in (IncidentService._clean_description(d) for d in descriptions) if c]
+        if not cleaned:
+            return "Multiple reports of incident in this area"
+        if len(cleaned) == 1:
+            return cleaned[0]
+        freq = {}
+        for d in cleaned:
+            for w, c in IncidentService._term_counts(d).items():
+                freq[w] = freq.get(w, 0) + c
+        return IncidentService._summarize(freq, cleaned, len(cleaned))
+
     def report_incident(self, user_id: str, payload: dict) -> int:
         data = {
             "user_id": user_id,
@@ -82,7 +105,16 @@ class IncidentService:
             "pincode": payload.get("pincode"),
             "description": payload.get("description"),
         }
-        return self.incident_repo.insert_incident(data)
+        row = self.incident_repo.insert_incident_row(data)
+        if not row:
+            return None
+        if self.cluster_service:
+            try:
+                self.cluster_service.record_report(row)
+            except Exception as err:
+                # The incident itself is stored; the cluster is rebuilt on the next refresh
+                log_exception(err, context="incident_cluster_update")
+        return row['id']
 
     def forward_incident(self, admin_id: str, incident_id: int):
         inc = self.incident_repo.get_incident(incident_id)
@@ -91,16 +123,22 @@ class IncidentService:
         if inc.get('status') == 'forwarded':
             return {"already": True}
         self.incident_repo.update_incident_forwarded(incident_id, datetime.now().isoformat())
+        if self.cluster_service:
+            try:
+                self.cluster_service.refresh_pincode(inc.get('pincode'))
+            except Exception as err:
+                log_exception(err, context="incident_cluster_refresh")
         if self.request_repo:
             self.request_repo.insert_request({"admin_id": admin_id, "incident_id": incident_id, "status": "pending"})
         if self.announcement_service:
             self._create_disaster_announcement(admin_id, inc)
         if self.sms_service and self.config and getattr(self.config, 'is_sms_configured') and self.config.is_sms_configured():
             try:
-                nearby = self.sms_service.get_nearby_users(inc.get('pincode'), inc.get('location'), radius_km=5)
-                self.sms_service.send_bulk_sms(nearby, f"Emergency alert near {inc.get('location')} - Severity {inc.get('severity','medium')}. Stay safe.")
-            except Exception:
-                pass
+                # Queued on the SMS priority lane for the incident's severity
+                from tasks import dispatch_incident_alert
+                dispatch_incident_alert(inc, f"Emergency alert near {inc.get('location')} - Severity {inc.get('severity','medium')}. Stay safe.", radius_km=5)
+            except Exception as err:
+                log_exception(err, context="incident_sms_dispatch")
         return {"forwarded": True}
 
     def _create_disaster_announcement(self, admin_id: str, inc: dict):
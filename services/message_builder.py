@@ -0,0 +1,192 @@
+"""
+Alert message templates per channel, with GSM-7 compaction and SMS segment accounting
+"""
+import math
+import re
+import unicodedata
+
+
+# GSM 03.38 default alphabet; any other character forces UCS-2 (70 chars per SMS instead of 160)
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Extension table: allowed, but each takes two septets (escape + char)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+_TRANSLITERATE = {
+    '“': '"', '”': '"', '‘': "'", '’': "'", '–': '-', '—': '-', '…': '...',
+    '•': '-', '°': '', '₹': 'Rs', ' ': ' ', '\t': ' ',
+}
+
+SINGLE_SEGMENT = {'gsm7': 160, 'ucs2': 70}
+# Concatenated messages lose room to the UDH header
+MULTI_SEGMENT = {'gsm7': 153, 'ucs2': 67}
+
+
+def is_gsm7(text: str) -> bool:
+    return all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text)
+
+
+def _units(text: str, encoding: str) -> int:
+    if encoding == 'gsm7':
+        return sum(2 if c in GSM7_EXTENDED else 1 for c in text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+def segment_info(text: str) -> dict:
+    """Encoding, length in encoding units and billable segments of one SMS."""
+    encoding = 'gsm7' if is_gsm7(text) else 'ucs2'
+    units = _units(text, encoding)
+    if units == 0:
+        segments = 0
+    elif units <= SINGLE_SEGMENT[encoding]:
+        segments = 1
+    else:
+        segments = math.ceil(units / MULTI_SEGMENT[encoding])
+    return {'encoding': encoding, 'units': units, 'segments': segments}
+
+
+def _gsm7_char(c: str) -> str:
+    """GSM-7 stand-in for one character: itself, a transliteration, its unaccented base, or '' (dropped)."""
+    if c in GSM7_BASIC or c in GSM7_EXTENDED:
+        return c
+    if c in _TRANSLITERATE:
+        return _TRANSLITERATE[c]
+    base = unicodedata.normalize('NFKD', c)[:1]
+    return base if base in GSM7_BASIC and base.isalnum() else ''
+
+
+def _compact(text: str) -> str:
+    text = text.replace('\r', '')
+    text = re.sub(r'[ \t]{2,}', ' ', text)
+    lines = [line.strip() for line in text.split('\n')]
+    return '\n'.join(line for line in lines if line)
+
+
+def to_gsm7(text: str) -> str:
+    """GSM-7-only version of ``text``: punctuation transliterated, accents stripped, anything else dropped, whitespace compacted."""
+    return _compact(''.join(_gsm7_char(c) for c in text or ''))
+
+
+def sms_text(text: str) -> str:
+    """``text`` made ready for SMS without losing any of its words.
+
+    When only punctuation, accents and emoji have to change, the GSM-7 form
+    is returned (160/153 characters per segment). If a letter or digit has no
+    GSM-7 stand-in (Devanagari, Tamil, ...), the text is kept as written,
+    with whitespace compacted, and goes out as UCS-2 instead.
+    """
+    text = text or ''
+    for c in text:
+        if not _gsm7_char(c) and unicodedata.category(c)[0] in 'LN':
+            return _compact(text)
+    return to_gsm7(text)
+
+
+def fit_segments(text: str, max_segments: int = 1) -> str:
+    """Truncate ``text`` (with '...') so it fits in ``max_segments`` segments of its encoding."""
+    info = segment_info(text)
+    if info['segments'] <= max_segments:
+        return text
+    encoding = info['encoding']
+    capacity = SINGLE_SEGMENT[encoding] if max_segments == 1 else MULTI_SEGMENT[encoding] * max_segments
+    budget = capacity - 3
+    used = 0
+    cut = 0
+    for i, c in enumerate(text):
+        used += _units(c, encoding)
+        if used > budget:
+            break
+        cut = i + 1
+    return text[:cut].rstrip() + '...'
+
+
+# Per-channel templates. 'sms' variants are plain GSM-7 (unless the details need UCS-2) and fitted to SMS_MAX_SEGMENTS;
+# 'default' is used by every other channel (in-app, push, email), where emoji cost nothing.
+TEMPLATES = {
+    'incident': {
+        'title': "Disaster warning: {location}",
+        'sms': "{severity_upper} ALERT: verified incident at {location_info}. {description} "
+               "Stay indoors, avoid the area, follow authorities. -ResQchain",
+        'default': """{severity_emoji} DISASTER WARNING {severity_emoji}
+
+VERIFIED INCIDENT in {location_info}
+
+Severity: {severity_upper}
+Details: {description}
+
+⚠️ SAFETY INSTRUCTIONS:
+• Stay indoors
+• Avoid the area
+• Follow authorities
+• Keep supplies ready
+
+This incident has been VERIFIED and forwarded to government authorities.
+
+Stay safe!
+- ResQchain Emergency System""",
+    },
+    'weather': {
+        'title': "Weather alert: {location}",
+        'sms': "WEATHER ALERT {location}: {weather_alert}. {temperature}C, {condition}. Take precautions. -ResQchain",
+        'default': """🌦️ WEATHER ALERT 🌦️
+
+{weather_alert}
+
+Location: {location}
+Temperature: {temperature}°C
+Condition: {condition}
+
+Please take necessary precautions and stay safe.
+
+- ResQchain Weather System""",
+    },
+}
+
+SMS_MAX_SEGMENTS = {'incident': 2, 'weather': 1}
+
+_SEVERITY_EMOJI = {'low': '⚠️', 'medium': '🚨', 'high': '🚨🚨', 'critical': '🚨🚨🚨'}
+
+
+def render(template: str, channel: str = 'default', **context) -> str:
+    """Render one template for one channel; SMS output is fitted to its segment budget, in GSM-7 where no words are lost."""
+    variants = TEMPLATES[template]
+    text = variants.get(channel, variants['default']).format(**context)
+    if channel == 'sms':
+        text = fit_segments(sms_text(text), SMS_MAX_SEGMENTS.get(template, 1))
+    return text
+
+
+def incident_context(incident: dict) -> dict:
+    severity = (incident.get('severity') or 'medium').lower()
+    location = incident.get('location') or 'Unknown location'
+    pincode = incident.get('pincode')
+    description = incident.get('description') or 'No description available'
+    if len(description) > 80:
+        description = description[:77] + "..."
+    return {
+        'location': location,
+        'location_info': f"{location} (Pincode: {pincode})" if pincode else location,
+        'severity_upper': severity.upper(),
+        'severity_emoji': _SEVERITY_EMOJI.get(severity, '🚨'),
+        'description': description,
+    }
+
+
+def weather_context(weather: dict) -> dict:
+    return {
+        'location': weather.get('location', 'Unknown'),
+        'weather_alert': weather.get('weather_alert') or 'Weather Alert',
+        'temperature': weather.get('temperature', 'N/A'),
+        'condition': weather.get('weather_condition', 'Unknown'),
+    }
+
+
+def build_messages(template: str, context: dict) -> dict:
+    """``{'title', 'body', 'sms'}`` for a notification alert (see notification_engine.make_alert)."""
+    return {
+        'title': TEMPLATES[template]['title'].format(**context),
+        'body': render(template, 'default', **context),
+        'sms': render(template, 'sms', **context),
+    }
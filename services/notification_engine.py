@@ -0,0 +1,354 @@
+"""
+Multi-channel notification fan-out: in-app inbox, Web Push, email and SMS
+"""
+import json
+import smtplib
+from collections import defaultdict
+from email.message import EmailMessage
+from typing import Callable, Iterable, Optional
+
+from config import Config
+from repositories.notification_repo import NotificationRepository
+from utils.dedupe import AlertDeduplicator
+from utils.logger import get_logger
+from utils.phone import normalize_phone
+from utils.presence import active_users
+from utils.rate_limiter import TokenBucketLimiter
+
+
+def make_alert(key: str, title: str, body: str, severity: str = 'medium', incident_id=None,
+               sms: Optional[str] = None, url: Optional[str] = None) -> dict:
+    """An alert as a plain dict, so it can travel through Celery as JSON.
+
+    ``key`` identifies the alert for deduplication; ``sms`` is an optional
+    shorter text for SMS (defaults to title and body).
+    """
+    return {'key': key, 'title': title, 'body': body, 'severity': (severity or 'medium').lower(),
+            'incident_id': incident_id, 'sms': sms, 'url': url}
+
+
+class Channel:
+    """One delivery channel.
+
+    ``cost`` is relative cost per message and ``latency`` the typical seconds
+    until the user sees it; the routing policy compares both. A
+    ``supplementary`` channel is never chosen in their place: it is sent in
+    addition to whatever the policy picks. Each channel has its own Celery
+    ``queue`` (and so its own worker pool) and ``batch_size``.
+    """
+
+    name = ''
+    cost = 0.0
+    latency = 0.0
+    supplementary = False
+    queue = ''
+    batch_size = 500
+
+    def enabled(self) -> bool:
+        return True
+
+    def annotate(self, users: list[dict]):
+        """Batched lookups for a chunk of users (e.g. push subscriptions) before routing."""
+
+    def reaches(self, user: dict) -> bool:
+        raise NotImplementedError
+
+    def payload(self, user: dict) -> dict:
+        """What a queued task needs to carry for this user."""
+        return {'id': user.get('id')}
+
+    def send(self, recipients: list[dict], alert: dict) -> dict:
+        raise NotImplementedError
+
+    @staticmethod
+    def _result(sent: int, failed: list) -> dict:
+        return {'sent': sent, 'failed': len(failed), 'failed_recipients': failed}
+
+
+class InAppChannel(Channel):
+    """Inbox rows (served by /api/notifications) for users active in the web app right now.
+
+    Supplementary: nothing in the web app shows the inbox unprompted, so it
+    is an extra copy on top of push, email or SMS, never a replacement.
+    """
+
+    name = 'inapp'
+    cost = 0.0
+    latency = 2.0
+    supplementary = True
+    queue = 'notify_inapp'
+    batch_size = 1000
+
+    def __init__(self, repo: Optional[NotificationRepository], active_within: int = 300):
+        self.repo = repo
+        self.active_within = active_within
+
+    def enabled(self) -> bool:
+        return self.repo is not None
+
+    def annotate(self, users):
+        present = active_users([u.get('id') for u in users], self.active_within)
+        for user in users:
+            user['_present'] = str(user.get('id')) in present
+
+    def reaches(self, user):
+        return bool(user.get('id') and user.get('_present'))
+
+    def send(self, recipients, alert):
+        rows = [{'user_id': u['id'], 'title': alert['title'], 'body': alert['body'], 'severity': alert['severity'],
+                 'incident_id': alert.get('incident_id'), 'alert_key': alert['key']} for u in recipients]
+        self.repo.insert_inbox(rows)
+        return self._result(len(rows), [])
+
+
+class WebPushChannel(Channel):
+    """Browser push through the user's saved subscriptions (needs VAPID keys and pywebpush)."""
+
+    name = 'push'
+    cost = 0.01
+    latency = 5.0
+    queue = 'notify_push'
+    batch_size = 500
+
+    def __init__(self, repo: Optional[NotificationRepository], limiter: Optional[TokenBucketLimiter] = None):
+        self.repo = repo
+        self.limiter = limiter or TokenBucketLimiter(Config.PUSH_RATE_PER_SECOND, prefix='notify:ratelimit')
+        self.logger = get_logger()
+
+    def enabled(self) -> bool:
+        if self.repo is None or not Config.is_push_configured():
+            return False
+        try:
+            import pywebpush  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def annotate(self, users):
+        subs = self.repo.push_subscriptions_for([u['id'] for u in users if u.get('id')])
+        for user in users:
+            user['_push'] = subs.get(user.get('id'), [])
+
+    def reaches(self, user):
+        return bool(user.get('_push'))
+
+    def payload(self, user):
+        return {'id': user.get('id'), 'push': user['_push']}
+
+    def send(self, recipients, alert):
+        from pywebpush import WebPushException, webpush
+
+        data = json.dumps({'title': alert['title'], 'body': alert['body'][:300], 'url': alert.get('url'),
+                           'severity': alert['severity']})
+        sent, failed, gone = 0, [], []
+        throttled = False
+        for user in recipients:
+            delivered = False
+            for sub in user.get('push') or []:
+                # Past the provider's rate: the rest go back as failed, for deliver_notifications to retry
+                if throttled or not self.limiter.acquire('push', timeout=30):
+                    throttled = True
+                    break
+                try:
+                    webpush(sub, data, vapid_private_key=Config.VAPID_PRIVATE_KEY,
+                            vapid_claims={'sub': Config.VAPID_SUBJECT}, timeout=10)
+                    delivered = True
+                except WebPushException as e:
+                    status = getattr(e.response, 'status_code', None)
+                    if status in (404, 410):
+                        gone.append(sub['endpoint'])
+                    else:
+                        self.logger.warning(f"Web push failed for user {user.get('id')}: {e}")
+            if delivered:
+                sent += 1
+            else:
+                failed.append(user)
+        self.repo.delete_push_subscriptions(gone)
+        return self._result(sent, failed)
+
+
+class EmailChannel(Channel):
+    """Plain-text email over one SMTP connection per batch."""
+
+    name = 'email'
+    cost = 0.1
+    latency = 120.0
+    queue = 'notify_email'
+    batch_size = 200
+
+    def __init__(self, limiter: Optional[TokenBucketLimiter] = None):
+        self.limiter = limiter or TokenBucketLimiter(Config.EMAIL_RATE_PER_SECOND, prefix='notify:ratelimit')
+        self.logger = get_logger()
+
+    def enabled(self) -> bool:
+        return Config.is_email_configured()
+
+    def reaches(self, user):
+        return '@' in (user.get('email') or '')
+
+    def payload(self, user):
+        return {'id': user.get('id'), 'email': user['email']}
+
+    def send(self, recipients, alert):
+        sent, failed = 0, []
+        throttled = False
+        with smtplib.SMTP(Config.SMTP_HOST, Config.SMTP_PORT, timeout=30) as smtp:
+            if Config.SMTP_PORT == 587:
+                smtp.starttls()
+            if Config.SMTP_USER:
+                smtp.login(Config.SMTP_USER, Config.SMTP_PASSWORD)
+            for user in recipients:
+                msg = EmailMessage()
+                msg['From'] = Config.MAIL_FROM
+                msg['To'] = user['email']
+                msg['Subject'] = alert['title']
+                msg.set_content(alert['body'])
+                if throttled or not self.limiter.acquire('email', timeout=30):
+                    throttled = True
+                    failed.append(user)
+                    continue
+                try:
+                    smtp.send_message(msg)
+                    sent += 1
+                except smtplib.SMTPException as e:
+                    self.logger.warning(f"Email to {user['email']} failed: {e}")
+                    failed.append(user)
+        return self._result(sent, failed)
+
+
+class SMSChannel(Channel):
+    """SMS through SMSService; the most expensive channel, used when nothing cheaper is fast enough."""
+
+    name = 'sms'
+    cost = 1.0
+    latency = 15.0
+    queue = 'sms_bulk'
+    batch_size = 500
+
+    def __init__(self, sms_service):
+        self.sms_service = sms_service
+
+    def enabled(self) -> bool:
+        return self.sms_service.sms_enabled
+
+    def reaches(self, user):
+        return normalize_phone(user.get('phone')) is not None
+
+    def payload(self, user):
+        return {'id': user.get('id'), 'phone': user['phone']}
+
+    @staticmethod
+    def render(alert: dict) -> str:
+        return alert.get('sms') or f"{alert['title']}\n{alert['body']}"
+
+    def send(self, recipients, alert):
+        return self.sms_service.send_batch(recipients, self.render(alert), incident_id=alert.get('incident_id'),
+                                           alert_key=alert['key'])
+
+
+# Seconds within which an alert of each severity should reach the user
+LATENCY_TARGETS = {'critical': 30, 'high': 60, 'medium': 300, 'low': 1800}
+
+
+class RoutingPolicy:
+    """Picks, per user, the cheapest reachable channel that meets the alert's latency target.
+
+    If no reachable channel is fast enough the fastest one is used. Severities
+    in ``redundant`` get the two cheapest qualifying channels, so a critical
+    alert does not rest on a single delivery path. Supplementary channels
+    (the in-app inbox) take no part in the choice and are added to it.
+    """
+
+    def __init__(self, latency_targets: Optional[dict] = None, redundant: tuple = ('critical',)):
+        self.latency_targets = latency_targets or LATENCY_TARGETS
+        self.redundant = redundant
+
+    def choose(self, user: dict, channels: list[Channel], severity: str) -> list[Channel]:
+        reachable = [c for c in channels if c.reaches(user) and not c.supplementary]
+        extra = [c for c in channels if c.supplementary and c.reaches(user)]
+        if not reachable:
+            return extra
+        target = self.latency_targets.get(severity, self.latency_targets['medium'])
+        fast_enough = sorted((c for c in reachable if c.latency <= target), key=lambda c: (c.cost, c.latency))
+        if not fast_enough:
+            return [min(reachable, key=lambda c: c.latency)] + extra
+        return (fast_enough[:2] if severity in self.redundant else fast_enough[:1]) + extra
+
+
+class NotificationEngine:
+    """Routes an alert's recipients across channels and hands each channel its batches.
+
+    Recipients are processed in chunks of ``chunk_size`` (any iterable works,
+    e.g. a paged cursor): each chunk gets the channels' batched lookups, is
+    routed by the policy, and is passed to ``enqueue(channel, batch, alert)``
+    in the channel's batch size. Workers then call :meth:`deliver`. Without an
+    ``enqueue`` function batches are delivered inline.
+    """
+
+    def __init__(self, channels: list[Channel], policy: Optional[RoutingPolicy] = None,
+                 enqueue: Optional[Callable] = None, chunk_size: int = 1000):
+        self.channels = [c for c in channels if c.enabled()]
+        self.by_name = {c.name: c for c in channels}
+        self.policy = policy or RoutingPolicy()
+        self.enqueue = enqueue
+        self.chunk_size = chunk_size
+        self.deduper = AlertDeduplicator(prefix='notify:dedupe')
+        self.logger = get_logger()
+
+    def route(self, users: list[dict], alert: dict) -> dict[str, list[dict]]:
+        """Channel name -> recipient payloads for one chunk of users."""
+        usable = []
+        for channel in self.channels:
+            try:
+                channel.annotate(users)
+                usable.append(channel)
+            except Exception as e:
+                self.logger.warning(f"{channel.name} lookup failed, skipping channel for this chunk: {e}")
+        routed = defaultdict(list)
+        for user in users:
+            for channel in self.policy.choose(user, usable, alert['severity']):
+                routed[channel.name].append(channel.payload(user))
+        return routed
+
+    def fan_out(self, recipients: Iterable[dict], alert: dict) -> dict[str, int]:
+        """Route and queue an alert for every recipient; returns recipients queued per channel."""
+        counts = defaultdict(int)
+        chunk = []
+        for user in recipients:
+            chunk.append(dict(user))
+            if len(chunk) >= self.chunk_size:
+                self._dispatch(chunk, alert, counts)
+                chunk = []
+        if chunk:
+            self._dispatch(chunk, alert, counts)
+        return dict(counts)
+
+    def _dispatch(self, chunk, alert, counts):
+        for name, payloads in self.route(chunk, alert).items():
+            channel = self.by_name[name]
+            for start in range(0, len(payloads), channel.batch_size):
+                batch = payloads[start:start + channel.batch_size]
+                if self.enqueue:
+                    self.enqueue(channel, batch, alert)
+                else:
+                    self.deliver(name, batch, alert)
+                counts[name] += len(batch)
+
+    def deliver(self, channel_name: str, recipients: list[dict], alert: dict, dedupe: bool = True) -> dict:
+        """Send one batch on one channel, skipping users this alert already reached on it."""
+        channel = self.by_name[channel_name]
+        skipped = 0
+        if dedupe and channel_name != 'sms':  # SMS dedupes per phone inside SMSService
+            fresh = self.deduper.claim(f"{channel_name}:{alert['key']}", [str(u.get('id')) for u in recipients])
+            skipped = fresh.count(False)
+            recipients = [u for u, ok in zip(recipients, fresh) if ok]
+        result = channel.send(recipients, alert) if recipients else Channel._result(0, [])
+        result['skipped'] = result.get('skipped', 0) + skipped
+        return result
+
+
+def build_engine(supabase_client, sms_service, enqueue: Optional[Callable] = None) -> NotificationEngine:
+    """Engine with every channel; channels that are not configured are left out of routing."""
+    repo = NotificationRepository(supabase_client) if supabase_client else None
+    return NotificationEngine([InAppChannel(repo), WebPushChannel(repo), EmailChannel(), SMSChannel(sms_service)],
+                              enqueue=enqueue)
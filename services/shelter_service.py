@@ -0,0 +1,247 @@
+"""
+Shelter lookups against OpenStreetMap (Overpass) with a geohash tile cache
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from utils.cache import SingleFlight, TTLCache
+from utils.metrics import outbound_call
+from utils.geo import GridIndex, geohash_bbox, geohash_cover, geohash_encode, haversine_km, to_float
+from utils.logger import get_logger
+
+
+# Tag -> (priority, type); lower priority wins when a place carries several shelter tags
+SHELTER_TYPES = {
+    ('amenity', 'shelter'): (0, "Emergency Shelter"),
+    ('building', 'school'): (1, "School"),
+    ('building', 'college'): (2, "College"),
+    ('amenity', 'place_of_worship'): (3, "Place of Worship"),
+    ('building', 'church'): (4, "Church"),
+    ('building', 'temple'): (4, "Temple"),
+    ('building', 'mosque'): (4, "Mosque"),
+    ('amenity', 'community_centre'): (5, "Community Center"),
+    ('amenity', 'auditorium'): (6, "Auditorium"),
+    ('tourism', 'museum'): (7, "Museum"),
+    ('leisure', 'park'): (8, "Park"),
+    ('leisure', 'sports_centre'): (9, "Sports Center"),
+    ('amenity', 'theatre'): (10, "Theater"),
+    ('amenity', 'conference_centre'): (11, "Conference Center"),
+}
+_CLASS_KEYS = ('amenity', 'building', 'tourism', 'leisure')
+_FALLBACK_TYPE = (99, "Public Facility")
+
+SHELTER_CAPACITY = {
+    "School": "Large (500+ people)",
+    "College": "Large (500+ people)",
+    "Church": "Medium (100-500 people)",
+    "Temple": "Medium (100-500 people)",
+    "Mosque": "Medium (100-500 people)",
+    "Park": "Very Large (1000+ people)",
+    "Museum": "Medium (200-500 people)",
+    "Auditorium": "Large (300-800 people)",
+    "Theater": "Large (300-800 people)",
+    "Conference Center": "Large (200-1000 people)",
+    "Sports Center": "Very Large (500+ people)",
+}
+
+_PLACEHOLDER_NAMES = frozenset({"", "Unnamed", "Unknown"})
+
+
+def classify_shelter(tags: dict) -> str:
+    """Human-readable shelter type from OSM tags."""
+    return min((SHELTER_TYPES.get((k, tags.get(k)), _FALLBACK_TYPE) for k in _CLASS_KEYS), key=lambda t: t[0])[1]
+
+
+def estimate_capacity(shelter_type: str) -> str:
+    """Rough capacity hint for OSM places that carry no capacity of their own."""
+    return SHELTER_CAPACITY.get(shelter_type, "Contact for details")
+
+
+def rank_nearest(lat: float, lon: float, elements: list[dict], k: int = 50, radius_km: float = 10) -> list[tuple[dict, float]]:
+    """Named shelter elements within ``radius_km``, nearest ``k`` first, with distances in km.
+
+    Distances are computed for all candidates in one vectorized call and only
+    the k nearest are selected (``argpartition``) and sorted.
+    """
+    named = [el for el in elements if el['tags'].get('name') not in _PLACEHOLDER_NAMES and el['tags'].get('name')]
+    if not named:
+        return []
+    coords = np.array([(el['lat'], el['lon']) for el in named], dtype=np.float64)
+    dist = haversine_km(lat, lon, coords[:, 0], coords[:, 1])
+    inside = np.flatnonzero(dist <= radius_km)
+    if inside.size > k:
+        inside = inside[np.argpartition(dist[inside], k - 1)[:k]]
+    inside = inside[np.argsort(dist[inside], kind='stable')]
+    return [(named[i], float(dist[i])) for i in inside.tolist()]
+
+
+class ShelterService:
+    """Serves shelter candidates from cached geohash tiles.
+
+    A search is answered from the precision-5 tiles (~5 km cells) covering its
+    radius. Tiles already cached are used as-is; the missing ones are fetched
+    together with a single bounding-box Overpass query and cached for
+    ``tile_ttl`` seconds. Concurrent searches that miss the same tile wait for
+    the request already in flight instead of issuing their own.
+    """
+
+    TILE_PRECISION = 5
+    TILE_TTL = 24 * 3600
+    WAIT_TIMEOUT = 40
+    # Public gathering places usable as shelters: schools, colleges, auditoriums, museums, parks
+    TAGS = (
+        ('amenity', 'shelter'), ('building', 'school'), ('building', 'college'),
+        ('amenity', 'community_centre'), ('amenity', 'place_of_worship'), ('building', 'church'),
+        ('building', 'temple'), ('building', 'mosque'), ('amenity', 'auditorium'),
+        ('tourism', 'museum'), ('leisure', 'park'), ('leisure', 'sports_centre'),
+        ('amenity', 'theatre'), ('amenity', 'conference_centre'),
+    )
+    KEPT_TAGS = ('name', 'amenity', 'building', 'tourism', 'leisure', 'phone', 'contact:phone')
+
+    def __init__(self, overpass=None, cache: Optional[TTLCache] = None, flight: Optional[SingleFlight] = None,
+                 tile_ttl: int = TILE_TTL):
+        self.overpass = overpass
+        self.cache = cache or TTLCache(ttl=tile_ttl, max_entries=20000)
+        self.flight = flight or SingleFlight()
+        self.logger = get_logger()
+
+    @classmethod
+    def build_query(cls, bbox: tuple[float, float, float, float]) -> str:
+        south, west, north, east = bbox
+        clauses = '\n'.join(f'  {kind}["{k}"="{v}"];' for kind in ('node', 'way') for k, v in cls.TAGS)
+        return (
+            f"[out:json][timeout:25][bbox:{south:.6f},{west:.6f},{north:.6f},{east:.6f}];\n"
+            f"(\n{clauses}\n);\n"
+            "out center;"
+        )
+
+    @classmethod
+    def _element(cls, el, lat, lon) -> Optional[dict]:
+        if lat is None or lon is None:
+            return None
+        tags = {k: el.tags[k] for k in cls.KEPT_TAGS if k in el.tags}
+        # Classified once when the tile is fetched, not on every search served from the cache
+        return {'osm_id': el.id, 'lat': float(lat), 'lon': float(lon), 'tags': tags, 'type': classify_shelter(tags)}
+
+    def _query_overpass(self, tiles: list[str]) -> dict[str, list[dict]]:
+        boxes = [geohash_bbox(t) for t in tiles]
+        bbox = (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+        api = self.overpass
+        if api is None:
+            import overpy
+            api = overpy.Overpass()
+        with outbound_call('overpass-api.de'):
+            result = api.query(self.build_query(bbox))
+
+        by_tile = {t: [] for t in tiles}
+        elements = [self._element(n, n.lat, n.lon) for n in result.nodes]
+        elements += [self._element(w, getattr(w, 'center_lat', None), getattr(w, 'center_lon', None)) for w in result.ways]
+        for el in elements:
+            if el is None:
+                continue
+            tile = geohash_encode(el['lat'], el['lon'], self.TILE_PRECISION)
+            # The union bbox can include tiles another request owns; those are dropped here
+            if tile in by_tile:
+                by_tile[tile].append(el)
+        return by_tile
+
+    def candidates(self, lat: float, lon: float, radius_km: float = 10) -> list[dict]:
+        """Shelter elements in every tile covering ``radius_km`` around the point (unfiltered by distance)."""
+        tiles = geohash_cover(lat, lon, radius_km, self.TILE_PRECISION)
+        found = {}
+        missing = []
+        for tile in tiles:
+            cached = self.cache.get(tile)
+            if cached is None:
+                missing.append(tile)
+            else:
+                found[tile] = cached
+
+        if missing:
+            owned, waiting = self.flight.claim(missing)
+            if owned:
+                try:
+                    fetched = self._query_overpass(owned)
+                except Exception as err:
+                    for tile in owned:
+                        self.flight.fail(tile, err)
+                    raise
+                for tile, elements in fetched.items():
+                    self.cache.set(tile, elements)
+                    self.flight.resolve(tile, elements)
+                found.update(fetched)
+                self.logger.info(f"Fetched {len(owned)} shelter tiles from Overpass ({len(tiles) - len(missing)} cached)")
+            for tile, call in waiting.items():
+                found[tile] = self.flight.wait(call, self.WAIT_TIMEOUT)
+
+        return [el for tile in tiles for el in found.get(tile, ())]
+
+
+class ShelterCatalog:
+    """In-memory nearest-shelter index over the ``shelters`` table.
+
+    Built from every shelter with coordinates (bulk-imported OSM places and
+    manually added ones), then answers k-nearest queries from a
+    :class:`GridIndex` without touching the database or Overpass. ``start()``
+    builds it on a background thread of the calling process and rebuilds it
+    every ``refresh_seconds`` so new imports show up; each build is swapped in
+    whole, so queries never wait for one and see an empty catalog only until
+    the first build lands.
+    """
+
+    def __init__(self, refresh_seconds: int = 6 * 3600, retry_seconds: int = 60):
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self._rows = []
+        self._index = GridIndex([], [])
+        self._built_at = None
+        # pid owning the refresher thread; a forked child never sees its own pid here
+        self._refresher_pid = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def build(self, shelter_repo):
+        started = time.time()
+        rows, lats, lons = [], [], []
+        for row in shelter_repo.iter_located():
+            lat, lon = to_float(row.get('latitude')), to_float(row.get('longitude'))
+            if lat is None or lon is None:
+                continue
+            rows.append(row)
+            lats.append(lat)
+            lons.append(lon)
+        index = GridIndex(np.array(lats), np.array(lons))
+        with self._lock:
+            self._rows, self._index, self._built_at = rows, index, time.time()
+        self.logger.info(f"Shelter catalog indexed {len(rows)} shelters in {time.time() - started:.2f}s")
+
+    def start(self, shelter_repo) -> bool:
+        """Start this process's refresher thread; False when one is already running here."""
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return False
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_forever, args=(shelter_repo,), name='shelter-catalog', daemon=True).start()
+        return True
+
+    def _refresh_forever(self, shelter_repo):
+        while True:
+            try:
+                self.build(shelter_repo)
+                delay = self.refresh_seconds
+            except Exception as err:
+                self.logger.error(f"Shelter catalog build failed, keeping the previous index: {err}")
+                delay = self.retry_seconds
+            time.sleep(delay)
+
+    def nearest(self, lat: float, lon: float, k: int = 50, radius_km: float = 10) -> list[tuple[dict, float]]:
+        rows, index = self._rows, self._index
+        ids, dist = index.nearest(lat, lon, k=k, max_km=radius_km)
+        return [(rows[i], float(d)) for i, d in zip(ids.tolist(), dist.tolist())]
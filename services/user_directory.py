@@ -0,0 +1,269 @@
+"""
+In-memory directory of phone-bearing users with a grid spatial index
+"""
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from utils.geo import haversine_km, to_float
+from utils.logger import get_logger
+
+
+class UserDirectory:
+    """Phone-bearing users kept in memory for notification targeting.
+
+    Coordinates live in flat NumPy arrays indexed by slot; a dict of grid cells
+    (``cell_deg`` degrees square) maps to the slots inside each cell. A radius
+    query only visits the cells overlapping the search box and computes exact
+    haversine distances for those candidates in one vectorized call, so its cost
+    depends on local density rather than on the total number of users. An
+    inverted index from pincode to user ids answers same-pincode targeting with
+    a single dict lookup; it is maintained by the same ``_put`` / ``_drop`` as
+    the grid, so a pincode change reaches it through :meth:`refresh` like a move.
+
+    Signups and profile edits happen in the web process while alerts are
+    targeted in the worker, so the directory follows the database rather than
+    in-process calls: :meth:`refresh`, run before each query, applies only the
+    users whose ``updated_at`` (kept by a trigger) moved past the watermark,
+    re-reading ``overlap_seconds`` back for transactions that committed late.
+    The full keyset-paged load runs on the thread started by :meth:`start` at
+    worker boot and again every ``refresh_seconds`` to drop deleted users, so
+    it never runs on the alert path unless nothing started it.
+    """
+
+    FIELDS = ('id', 'phone', 'latitude', 'longitude', 'name', 'email', 'pincode')
+
+    def __init__(self, cell_deg: float = 0.1, refresh_seconds: int = 900, overlap_seconds: int = 60,
+                 retry_seconds: int = 60):
+        self.cell_deg = cell_deg
+        self.refresh_seconds = refresh_seconds
+        self.overlap_seconds = overlap_seconds
+        self.retry_seconds = retry_seconds
+        self.logger = get_logger()
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        self._watermark = None
+        self._generation = 0
+        self._refresher_pid = None
+        self._reset()
+
+    def _reset(self):
+        self._slots = {}
+        self._users = []
+        self._free = []
+        self._lat = np.full(1024, np.nan)
+        self._lon = np.full(1024, np.nan)
+        self._cells = {}
+        self._unlocated = set()
+        self._by_pincode = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def _cell(self, lat: float, lon: float):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _grow(self, needed: int):
+        size = self._lat.size
+        if needed <= size:
+            return
+        while size < needed:
+            size *= 2
+        self._lat = np.concatenate([self._lat, np.full(size - self._lat.size, np.nan)])
+        self._lon = np.concatenate([self._lon, np.full(size - self._lon.size, np.nan)])
+
+    def _unindex(self, slot: int):
+        user = self._users[slot]
+        pincode = user.get('pincode') if user else None
+        if pincode:
+            ids = self._by_pincode.get(pincode)
+            if ids is not None:
+                ids.discard(user.get('id'))
+                if not ids:
+                    del self._by_pincode[pincode]
+        lat, lon = self._lat[slot], self._lon[slot]
+        if np.isnan(lat):
+            self._unlocated.discard(slot)
+            return
+        cell = self._cell(lat, lon)
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(slot)
+            if not members:
+                del self._cells[cell]
+
+    def _put(self, user: dict):
+        user_id = user.get('id')
+        slot = self._slots.get(user_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._users)
+                self._users.append(None)
+                self._grow(slot + 1)
+            self._slots[user_id] = slot
+        else:
+            self._unindex(slot)
+
+        self._users[slot] = user
+        if user.get('pincode'):
+            self._by_pincode.setdefault(user['pincode'], set()).add(user_id)
+        lat, lon = to_float(user.get('latitude')), to_float(user.get('longitude'))
+        if lat is None or lon is None:
+            self._lat[slot] = self._lon[slot] = np.nan
+            self._unlocated.add(slot)
+        else:
+            self._lat[slot], self._lon[slot] = lat, lon
+            self._cells.setdefault(self._cell(lat, lon), set()).add(slot)
+
+    def _drop(self, user_id):
+        slot = self._slots.pop(user_id, None)
+        if slot is None:
+            return
+        self._unindex(slot)
+        self._users[slot] = None
+        self._lat[slot] = self._lon[slot] = np.nan
+        self._free.append(slot)
+
+    def load(self, user_repo):
+        """Replace the directory contents with every phone-bearing user from the database."""
+        started = time.time()
+        # Read before the scan: rows changed while it runs are replayed by the next refresh
+        watermark = user_repo.latest_update()
+        fresh = UserDirectory(self.cell_deg, self.refresh_seconds)
+        for user in user_repo.iter_phone_users():
+            fresh._put({k: user.get(k) for k in self.FIELDS})
+        with self._lock:
+            self._slots, self._users, self._free = fresh._slots, fresh._users, fresh._free
+            self._lat, self._lon = fresh._lat, fresh._lon
+            self._cells, self._unlocated = fresh._cells, fresh._unlocated
+            self._by_pincode = fresh._by_pincode
+            self._watermark = watermark
+            self._generation += 1
+            self._loaded_at = time.time()
+        self.logger.info(f"User directory loaded {len(self._slots)} users in {time.time() - started:.2f}s")
+
+    def refresh(self, user_repo) -> int:
+        """Apply the users changed since the watermark and return how many rows were read.
+
+        Loads the directory first when this process has none yet, waiting for a
+        load already running on the :meth:`start` thread instead of repeating it.
+        """
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    self.load(user_repo)
+            return 0
+        with self._lock:
+            watermark, generation = self._watermark, self._generation
+        since = None
+        if watermark:
+            since = (datetime.fromisoformat(watermark) - timedelta(seconds=self.overlap_seconds)).isoformat()
+        latest, changed = watermark, 0
+        for user in user_repo.iter_changed_users(since):
+            self.upsert(user)
+            if user.get('updated_at') and (latest is None or user['updated_at'] > latest):
+                latest = user['updated_at']
+            changed += 1
+        with self._lock:
+            # A reload swapped in meanwhile may predate these rows: keep its watermark so they are replayed
+            if self._generation == generation:
+                self._watermark = latest
+        return changed
+
+    def start(self, user_repo) -> bool:
+        """Start this process's loader thread; False when one is already running here."""
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return False
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._reload_forever, args=(user_repo,), name='user-directory', daemon=True).start()
+        return True
+
+    def _reload_forever(self, user_repo):
+        while True:
+            try:
+                with self._load_lock:
+                    # A first alert may have loaded the directory before this thread got the lock
+                    if self._loaded_at is None or time.time() - self._loaded_at >= self.refresh_seconds:
+                        self.load(user_repo)
+                delay = self.refresh_seconds - (time.time() - self._loaded_at)
+            except Exception as err:
+                self.logger.error(f"User directory load failed, keeping the previous one: {err}")
+                delay = self.retry_seconds
+            time.sleep(max(delay, 1))
+
+    def upsert(self, profile: dict):
+        """Merge a (possibly partial) profile, e.g. a changed row read by :meth:`refresh`.
+
+        Users are only tracked while they have a phone number. Before the first
+        load there is nothing to keep in sync, since the load will read the row.
+        """
+        if not self.loaded or not profile.get('id'):
+            return
+        with self._lock:
+            slot = self._slots.get(profile['id'])
+            merged = dict(self._users[slot]) if slot is not None else {k: None for k in self.FIELDS}
+            merged.update({k: v for k, v in profile.items() if k in self.FIELDS})
+            if merged.get('phone'):
+                self._put(merged)
+            else:
+                self._drop(profile['id'])
+
+    def remove(self, user_id):
+        with self._lock:
+            self._drop(user_id)
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> list[tuple[dict, float]]:
+        """Located users within ``radius_km`` of the point, nearest first, with distances."""
+        dlat = radius_km / 111.0
+        dlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        lo_i, lo_j = self._cell(lat - dlat, lon - dlon)
+        hi_i, hi_j = self._cell(lat + dlat, lon + dlon)
+        with self._lock:
+            candidates = []
+            for i in range(lo_i, hi_i + 1):
+                for j in range(lo_j, hi_j + 1):
+                    members = self._cells.get((i, j))
+                    if members:
+                        candidates.extend(members)
+            if not candidates:
+                return []
+            slots = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            dist = haversine_km(lat, lon, self._lat[slots], self._lon[slots])
+            inside = dist <= radius_km
+            slots, dist = slots[inside], dist[inside]
+            order = np.argsort(dist, kind='stable')
+            return [(self._users[s], float(d)) for s, d in zip(slots[order], dist[order])]
+
+    def unlocated(self) -> list[dict]:
+        with self._lock:
+            return [self._users[s] for s in self._unlocated]
+
+    def in_pincode(self, pincode: str) -> list[dict]:
+        """Phone-bearing users registered under ``pincode``, via the inverted index."""
+        with self._lock:
+            ids = self._by_pincode.get(pincode, ())
+            return [self._users[self._slots[user_id]] for user_id in ids]
+
+    def pincode_count(self, pincode: str) -> int:
+        with self._lock:
+            return len(self._by_pincode.get(pincode, ()))
+
+    def all_users(self) -> list[dict]:
+        with self._lock:
+            return [u for u in self._users if u is not None]
+
+
+# Process-wide directory used by the SMS service (started at worker boot by tasks.py)
+user_directory = UserDirectory()
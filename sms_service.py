@@ -4,9 +4,17 @@ SMS Notification Service using Free SMS APIs
 import os
 import requests
 import json
+import hashlib
 import time
 from config import Config
-from supabase import create_client, Client
+from utils.supabase_client import supabase_or_none
+from repositories.user_repo import UserRepository
+from services.message_builder import incident_context, render, segment_info
+from utils.buffered_writer import BufferedInsertWriter
+from utils.dedupe import AlertDeduplicator
+from utils.phone import normalize_phone
+from utils.metrics import InstrumentedHTTPAdapter
+from utils.rate_limiter import TokenBucketLimiter
 import logging
 
 # Setup logging
@@ -14,13 +22,32 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SMSService:
+    TEXTBELT_URL = "https://textbelt.com/text"
+    RATE_LIMIT_WAIT = 30
     def __init__(self):
         self.supabase = None
         self.sms_enabled = False
         
+        # One pooled HTTP session for all provider calls, so batches reuse TLS connections
+        self.http = requests.Session()
+        self.http.mount("https://", InstrumentedHTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.http.mount("http://", InstrumentedHTTPAdapter(pool_connections=4, pool_maxsize=16))
+        
+        # Cluster-wide send rate per provider, so workers pace themselves instead of hitting throttling
+        self.rate_limiter = TokenBucketLimiter(Config.SMS_RATE_PER_SECOND, Config.SMS_RATE_BURST, prefix='sms:ratelimit')
+        
+        # Billable segments of every message accepted by the provider (see services.message_builder)
+        self.segments_sent = 0
+        
+        # Drops repeat deliveries of the same alert to the same phone
+        self.deduper = AlertDeduplicator()
+        
+        # Log rows are buffered per process and written as multi-row inserts off the send path
+        self.log_writer = BufferedInsertWriter(lambda: self.supabase, 'sms_notifications', max_batch=500, flush_interval=2.0)
+        
         # Initialize Supabase client
         if Config.is_supabase_configured():
-            self.supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+            self.supabase = supabase_or_none()
             self.sms_enabled = True
             logger.info("Supabase client initialized for SMS logging")
         else:
@@ -32,7 +59,13 @@ class SMSService:
             logger.info("SMS service initialized with free API")
         else:
             logger.info("SMS service initialized (no API key - will use mock sending)")
-    
+
+    @property
+    def user_directory(self):
+        # Imported on first use so importing this module (web app, worker boot) does not load numpy
+        from services.user_directory import user_directory
+        return user_directory
+
     def send_incident_notification(self, incident_data, nearby_users):
         """
         Send SMS notifications to nearby users about an incident
@@ -48,54 +81,10 @@ class SMSService:
         # Create incident message
         message = self._create_incident_message(incident_data)
         
-        success_count = 0
-        failed_count = 0
-        
-        for user in nearby_users:
-            phone_number = user.get('phone')
-            if not phone_number:
-                logger.warning(f"User {user.get('id')} has no phone number")
-                continue
-            
-            try:
-                # Send SMS using free API or mock
-                sms_id = self._send_sms(phone_number, message)
-                
-                # Log SMS
-                self._log_sms_notification(
-                    user_id=user.get('id'),
-                    phone_number=phone_number,
-                    message=message,
-                    incident_id=incident_data.get('id'),
-                    status='sent' if sms_id else 'failed',
-                    twilio_sid=sms_id,
-                    error_message=None if sms_id else "SMS sending failed"
-                )
-                
-                if sms_id:
-                    success_count += 1
-                    logger.info(f"SMS sent to {phone_number}: {sms_id}")
-                else:
-                    failed_count += 1
-                    logger.error(f"Failed to send SMS to {phone_number}")
-                
-            except Exception as e:
-                logger.error(f"Failed to send SMS to {phone_number}: {str(e)}")
-                
-                # Log failed SMS
-                self._log_sms_notification(
-                    user_id=user.get('id'),
-                    phone_number=phone_number,
-                    message=message,
-                    incident_id=incident_data.get('id'),
-                    status='failed',
-                    error_message=str(e)
-                )
-                
-                failed_count += 1
+        result = self.send_batch(nearby_users, message, incident_id=incident_data.get('id'))
         
-        logger.info(f"SMS notifications sent: {success_count} successful, {failed_count} failed")
-        return success_count > 0
+        logger.info(f"SMS notifications sent: {result['sent']} successful, {result['failed']} failed, {result['skipped']} duplicates skipped")
+        return result['sent'] > 0
     
     def _send_sms(self, phone_number, message):
         """
@@ -118,14 +107,17 @@ class SMSService:
         """
         try:
             # Using TextBelt (free tier: 1 SMS per day)
-            url = "https://textbelt.com/text"
+            if not self.rate_limiter.acquire('textbelt', timeout=self.RATE_LIMIT_WAIT):
+                logger.error(f"TextBelt rate limit wait exceeded {self.RATE_LIMIT_WAIT}s, not sending to {phone_number}")
+                return None
+            
             data = {
                 'phone': phone_number,
                 'message': message,
                 'key': Config.SMS_API_KEY
             }
             
-            response = requests.post(url, data=data, timeout=10)
+            response = self.http.post(self.TEXTBELT_URL, data=data, timeout=10)
             result = response.json()
             
             if result.get('success'):
@@ -148,75 +140,126 @@ class SMSService:
     def _create_incident_message(self, incident_data):
         """
         Create a concise SMS message for incident notification
-        """
-        location = incident_data.get('location', 'Unknown location')
-        pincode = incident_data.get('pincode', '')
-        severity = incident_data.get('severity', 'medium')
-        description = incident_data.get('description', 'No description available')
         
-        # Truncate description if too long
-        if len(description) > 80:
-            description = description[:77] + "..."
+        Rendered GSM-7 only (no emoji), so it is billed at 160/153 characters per
+        segment instead of 70/67, and capped at two segments.
+        """
+        return render('incident', 'sms', **incident_context(incident_data))
+    
+    @staticmethod
+    def alert_key(incident_id, message):
+        """
+        Identity of an alert for deduplication: the incident (if any) plus the exact text
+        """
+        return f"{incident_id or 'broadcast'}:{hashlib.sha1(message.encode('utf-8')).hexdigest()[:16]}"
+    
+    def unique_recipients(self, recipients):
+        """
+        Normalize phones to E.164 and keep one recipient per number (users can share a phone)
+        """
+        unique = {}
+        for user in recipients:
+            phone = normalize_phone(user.get('phone'))
+            if phone and phone not in unique:
+                unique[phone] = dict(user, phone=phone)
+        return list(unique.values())
+    
+    def send_batch(self, recipients, message, incident_id=None, alert_key=None, dedupe=True, bloom=False):
+        """
+        Send one message to a batch of recipients and log the outcomes with multi-row inserts
         
-        # Create location info
-        location_info = location
-        if pincode:
-            location_info += f" (Pincode: {pincode})"
+        TextBelt has no bulk endpoint, so messages go out one by one over the shared
+        session; the saving is in one task, one connection pool and one log write per batch.
+        Recipients are normalized and, unless ``dedupe`` is off (retries of this same
+        delivery), claimed per (alert, phone) so repeats within the window are skipped.
+        Each phone is claimed right before its own send, so a worker that dies mid-batch
+        leaves the recipients it never reached unclaimed for the redelivered task.
+        Returns counts plus the recipients that failed, so callers can retry just those.
+        """
+        recipients = self.unique_recipients(recipients)
+        segments = segment_info(message)
+        if segments['encoding'] != 'gsm7':
+            logger.warning(f"SMS uses UCS-2 encoding: {segments['segments']} segments per message")
+        key = alert_key or self.alert_key(incident_id, message)
+        skipped = 0
         
-        # Create severity emoji
-        severity_emoji = {
-            'low': '⚠️',
-            'medium': '🚨',
-            'high': '🚨🚨',
-            'critical': '🚨🚨🚨'
-        }.get(severity.lower(), '🚨')
+        log_rows = []
+        failed = []
+        sent = 0
         
-        message = f"""{severity_emoji} DISASTER WARNING {severity_emoji}
-
-VERIFIED INCIDENT in {location_info}
-
-Severity: {severity.upper()}
-Details: {description}
-
-⚠️ SAFETY INSTRUCTIONS:
-• Stay indoors
-• Avoid the area
-• Follow authorities
-• Keep supplies ready
-
-This incident has been VERIFIED and forwarded to government authorities.
-
-Stay safe!
-- ResQchain Emergency System"""
+        for user in recipients:
+            phone_number = user['phone']
+            if dedupe and not self.deduper.claim(key, [phone_number], bloom=bloom)[0]:
+                skipped += 1
+                continue
+            
+            error = None
+            try:
+                sms_id = self._send_sms(phone_number, message)
+            except Exception as e:
+                sms_id, error = None, str(e)
+            
+            if sms_id:
+                sent += 1
+            else:
+                failed.append(user)
+            log_rows.append(self._sms_log_row(
+                user_id=user.get('id'),
+                phone_number=phone_number,
+                message=message,
+                incident_id=incident_id,
+                status='sent' if sms_id else 'failed',
+                twilio_sid=sms_id,
+                error_message=None if sms_id else (error or "SMS sending failed"),
+                segments=segments['segments']
+            ))
         
-        return message
+        self.segments_sent += sent * segments['segments']
+        self._log_sms_notifications(log_rows)
+        logger.info(f"SMS batch sent: {sent} successful, {len(failed)} failed, {skipped} duplicates skipped")
+        return {'sent': sent, 'failed': len(failed), 'skipped': skipped, 'failed_recipients': failed}
+    
+    @staticmethod
+    def _sms_log_row(user_id, phone_number, message, incident_id, status, twilio_sid=None, error_message=None, segments=None):
+        return {
+            'user_id': user_id,
+            'phone_number': phone_number,
+            'message': message,
+            'incident_id': incident_id,
+            'status': status,
+            'twilio_sid': twilio_sid,
+            'error_message': error_message,
+            'segments': segments if segments is not None else segment_info(message)['segments']
+        }
+    
+    def _log_sms_notifications(self, rows):
+        """
+        Queue many SMS notification logs for the buffered writer
+        """
+        if not self.supabase or not rows:
+            return
+        self.log_writer.add_many(rows)
     
     def _log_sms_notification(self, user_id, phone_number, message, incident_id, status, twilio_sid=None, error_message=None):
         """
-        Log SMS notification to database
+        Queue an SMS notification log; the buffered writer inserts it with others shortly after
         """
         if not self.supabase:
             return
-        
+        self.log_writer.add(self._sms_log_row(user_id, phone_number, message, incident_id, status, twilio_sid, error_message))
+    
+    def flush_logs(self):
+        """
+        Write any buffered SMS logs now (worker shutdown, tests)
+        """
         try:
-            log_data = {
-                'user_id': user_id,
-                'phone_number': phone_number,
-                'message': message,
-                'incident_id': incident_id,
-                'status': status,
-                'twilio_sid': twilio_sid,
-                'error_message': error_message
-            }
-            
-            result = self.supabase.table('sms_notifications').insert(log_data).execute()
-            if result and result.data:
-                logger.info(f"SMS notification logged: {result.data[0]['id']}")
-            else:
-                logger.error("Failed to log SMS notification")
-                
+            return self.log_writer.flush()
         except Exception as e:
-            logger.error(f"Error logging SMS notification: {str(e)}")
+            logger.error(f"Error flushing SMS notification logs: {str(e)}")
+            return 0
+    
+    def log_queue_depth(self):
+        return self.log_writer.depth()
     
     def get_nearby_users(self, incident_lat, incident_lon, incident_pincode=None, radius_km=10):
         """
@@ -226,65 +269,64 @@ Stay safe!
             logger.warning("Supabase not configured, returning empty user list")
             return []
         
+        from utils.geo import to_float
+
         try:
-            # Get all users with phone numbers
-            result = self.supabase.table('users').select('id, phone, latitude, longitude, name, email, pincode').not_.is_('phone', 'null').execute()
+            # Served from the in-memory spatial index after applying the users changed since the last query
+            self.user_directory.refresh(UserRepository(self.supabase))
             
-            if not result or not result.data:
+            if not len(self.user_directory):
                 logger.info("No users with phone numbers found in database")
                 return []
             
-            nearby_users = []
-            pincode_users = []
-            
-            for user in result.data:
-                user_lat = user.get('latitude')
-                user_lon = user.get('longitude')
-                user_pincode = user.get('pincode')
-                
-                # First priority: Same pincode users
-                if incident_pincode and user_pincode and incident_pincode == user_pincode:
-                    pincode_users.append(user)
-                    logger.info(f"User {user.get('name', user.get('id'))} is in same pincode {incident_pincode}")
-                    continue
-                
-                # Second priority: Users within radius
-                if user_lat and user_lon and incident_lat and incident_lon:
-                    # Calculate distance
-                    distance = self._calculate_distance(incident_lat, incident_lon, user_lat, user_lon)
-                    
-                    if distance <= radius_km:
-                        nearby_users.append(user)
-                        logger.info(f"User {user.get('name', user.get('id'))} is {distance:.2f}km away from incident")
-                else:
-                    # If user doesn't have location, include them anyway (they might want notifications)
-                    logger.info(f"User {user.get('name', user.get('id'))} has no location data, including in notifications")
-                    nearby_users.append(user)
+            # First priority: Same pincode users
+            pincode_users = self.user_directory.in_pincode(incident_pincode) if incident_pincode else []
             
-            # Combine pincode users (highest priority) with nearby users
-            all_users = pincode_users + nearby_users
+            # Second priority: Users within radius
+            incident_lat, incident_lon = to_float(incident_lat), to_float(incident_lon)
+            if incident_lat is not None and incident_lon is not None:
+                nearby_users = [user for user, _ in self.user_directory.within_radius(incident_lat, incident_lon, radius_km)]
+                # If user doesn't have location, include them anyway (they might want notifications)
+                nearby_users.extend(self.user_directory.unlocated())
+            else:
+                # Without incident coordinates there is no radius to apply
+                nearby_users = self.user_directory.all_users()
             
-            # Remove duplicates based on user ID
+            # Combine pincode users (highest priority) with nearby users, removing duplicates
             unique_users = []
             seen_ids = set()
-            for user in all_users:
+            for user in pincode_users + nearby_users:
                 if user.get('id') not in seen_ids:
                     unique_users.append(user)
                     seen_ids.add(user.get('id'))
             
-            logger.info(f"Found {len(unique_users)} users for SMS notifications ({len(pincode_users)} same pincode, {len(nearby_users)} nearby)")
+            logger.info(f"Found {len(unique_users)} users for SMS notifications ({len(pincode_users)} same pincode, {len(unique_users) - len(pincode_users)} nearby)")
             return unique_users
             
         except Exception as e:
             logger.error(f"Error getting nearby users: {str(e)}")
             return []
     
+    def get_pincode_users(self, pincode):
+        """
+        Get users registered under a pincode (incidents without coordinates)
+        """
+        if not self.supabase or not pincode:
+            return []
+        try:
+            # Same refresh as get_nearby_users: pincode changes written by the web process are applied first
+            self.user_directory.refresh(UserRepository(self.supabase))
+            return self.user_directory.in_pincode(pincode)
+        except Exception as e:
+            logger.error(f"Error getting pincode users: {str(e)}")
+            return []
+    
     def _calculate_distance(self, lat1, lon1, lat2, lon2):
         """
         Calculate distance between two points in kilometers
         """
-        from geopy.distance import geodesic
-        return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+        from utils.geo import haversine_km
+        return float(haversine_km(lat1, lon1, [lat2], [lon2])[0])
 
 # Global SMS service instance
 sms_service = SMSService()
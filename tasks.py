@@ -2,17 +2,166 @@
 Celery Tasks for Async Processing
 """
 from celery_config import celery
+from celery.signals import task_postrun, task_prerun, worker_process_init, worker_process_shutdown, worker_shutdown
 from sms_service import sms_service
+from repositories.user_repo import UserRepository
+from repositories.weather_repo import WeatherRepository
+from services.message_builder import SMS_MAX_SEGMENTS, build_messages, fit_segments, incident_context, sms_text, weather_context
+from services.notification_engine import build_engine, make_alert
+from utils.batched_delete import delete_in_batches
+from utils.metrics import celery_task_duration, flush as flush_metrics, sms_lane_latency
+from utils.phone import normalize_phone
 from config import Config
-from supabase import create_client, Client
+from utils.supabase_client import supabase_or_none
 import logging
+import time
+from datetime import datetime, timedelta, timezone
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Supabase client
-supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY) if Config.is_supabase_configured() else None
+# Shared Supabase client, created per worker process on first use
+supabase = supabase_or_none()
+
+@worker_process_init.connect
+def start_user_directory(**kwargs):
+    """
+    Load the notification user directory in the background as each worker process boots
+    
+    The full load takes seconds at a million users; started here, the first alert only waits for
+    whatever is left of it instead of paying for all of it.
+    """
+    if sms_service.supabase:
+        sms_service.user_directory.start(UserRepository(sms_service.supabase))
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_sms_logs(**kwargs):
+    """
+    Write buffered sms_notifications rows and metrics before a worker process exits
+    """
+    written = sms_service.flush_logs()
+    logger.info(f"Flushed {written} buffered SMS logs on worker shutdown")
+    # Prefork children exit without running atexit hooks
+    flush_metrics()
+
+# Start times of the tasks running in this worker process, by task id
+_task_started = {}
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+@task_postrun.connect
+def observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    """
+    Record each task's run time by name and final state (SUCCESS, FAILURE, RETRY) for /metrics
+    """
+    started = _task_started.pop(task_id, None)
+    if started is not None and task is not None:
+        celery_task_duration.observe((task.name, state or 'UNKNOWN'), time.perf_counter() - started)
+
+# Recipients per send_sms_batch task: one broker message and one multi-row log insert each
+SMS_BATCH_SIZE = 500
+
+# Blasts at least this large dedupe through a Redis Bloom filter instead of one key per recipient
+DEDUPE_BLOOM_THRESHOLD = 10000
+
+# Priority lanes (Celery queues) for SMS sends, see celery_config.task_routes
+SMS_LANES = {'critical': 'sms_critical', 'high': 'sms_high'}
+BULK_LANE = 'sms_bulk'
+
+def sms_lane(severity, default=BULK_LANE):
+    """
+    Queue for an alert of the given severity; anything below high goes to ``default``
+    """
+    return SMS_LANES.get(str(severity or '').lower(), default)
+
+def _dispatch_sms_batches(recipients, message, incident_id=None, alert_key=None, bloom=False, lane=BULK_LANE):
+    """
+    Queue send_sms_batch tasks over chunks of recipients; returns the number of recipients queued
+    
+    ``recipients`` may be any iterable (e.g. a paged cursor); only the current batch
+    is held in memory and each batch is queued as soon as it fills. Phones are
+    normalized to E.164 and repeated within a batch are dropped; repeats across
+    batches are caught by the alert's dedupe claims in send_sms_batch.
+    """
+    alert_key = alert_key or sms_service.alert_key(incident_id, message)
+    batch = []
+    seen = set()
+    queued = 0
+    for user in recipients:
+        phone = normalize_phone(user.get('phone'))
+        if not phone or phone in seen:
+            continue
+        seen.add(phone)
+        batch.append({'id': user.get('id'), 'phone': phone})
+        if len(batch) >= SMS_BATCH_SIZE:
+            _queue_sms_batch(incident_id, batch, message, alert_key, bloom, lane)
+            queued += len(batch)
+            batch = []
+            seen.clear()
+    if batch:
+        _queue_sms_batch(incident_id, batch, message, alert_key, bloom, lane)
+        queued += len(batch)
+    return queued
+
+def _queue_sms_batch(incident_id, batch, message, alert_key, bloom, lane):
+    send_sms_batch.apply_async(args=(incident_id, batch, message, alert_key, bloom),
+                               kwargs={'lane': lane, 'enqueued_at': time.time()}, queue=lane)
+
+_notification_engine = None
+
+def notification_engine():
+    """
+    Per-process NotificationEngine whose batches go to each channel's own queue
+    """
+    global _notification_engine
+    if _notification_engine is None:
+        _notification_engine = build_engine(supabase, sms_service, enqueue=_enqueue_notification)
+    return _notification_engine
+
+def _enqueue_notification(channel, batch, alert):
+    if channel.name == 'sms':
+        # SMS keeps its severity lanes; incident alerts never go on the bulk lane
+        lane = sms_lane(alert['severity'], default='sms_high' if alert.get('incident_id') else BULK_LANE)
+        _dispatch_sms_batches(batch, channel.render(alert), alert.get('incident_id'), alert_key=alert['key'],
+                              bloom=alert.get('bloom', False), lane=lane)
+    else:
+        deliver_notifications.apply_async(args=(channel.name, batch, alert), queue=channel.queue)
+
+def notify_users(recipients, alert):
+    """
+    Fan an alert out to recipients over the cheapest channel that meets its latency target;
+    returns the number of recipients queued
+    """
+    counts = notification_engine().fan_out(recipients, alert)
+    logger.info(f"Alert {alert['key']} queued per channel: {counts}")
+    return sum(counts.values())
+
+def dispatch_incident_alert(incident_data, message=None, radius_km=10):
+    """
+    Notify the users near an incident; returns the number queued
+    
+    SMS for incidents is never sent on the bulk lane. Without coordinates only
+    users in the incident's pincode are notified.
+    """
+    lat, lon, pincode = incident_data.get('latitude'), incident_data.get('longitude'), incident_data.get('pincode')
+    if lat is not None and lon is not None:
+        recipients = sms_service.get_nearby_users(lat, lon, pincode, radius_km=radius_km)
+    else:
+        recipients = sms_service.get_pincode_users(pincode)
+    if not recipients:
+        return 0
+    if message:
+        messages = {'title': f"Disaster warning: {incident_data.get('location') or 'near you'}", 'body': message,
+                    'sms': fit_segments(sms_text(message), SMS_MAX_SEGMENTS['incident'])}
+    else:
+        messages = build_messages('incident', incident_context(incident_data))
+    alert = make_alert(sms_service.alert_key(incident_data.get('id'), messages['sms']), messages['title'], messages['body'],
+                       severity=incident_data.get('severity') or 'high', incident_id=incident_data.get('id'), sms=messages['sms'])
+    return notify_users(recipients, alert)
 
 @celery.task(bind=True, max_retries=3)
 def send_sms_notification(self, incident_id, user_phone, message):
@@ -20,16 +169,23 @@ def send_sms_notification(self, incident_id, user_phone, message):
     Send SMS notification to a single user
     """
     try:
-        if not sms_service.client:
+        if not sms_service.sms_enabled:
             logger.error("SMS service not configured")
             return False
         
+        # Skip if this alert already reached this phone (first attempt only; retries are ours)
+        phone = normalize_phone(user_phone)
+        if not phone:
+            logger.error(f"Invalid phone number: {user_phone}")
+            return False
+        if self.request.retries == 0 and not sms_service.deduper.claim(sms_service.alert_key(incident_id, message), [phone])[0]:
+            logger.info(f"Duplicate alert to {phone} skipped")
+            return False
+        
         # Send SMS
-        response = sms_service.client.messages.create(
-            body=message,
-            from_=Config.TWILIO_PHONE_NUMBER,
-            to=user_phone
-        )
+        sms_id = sms_service._send_sms(phone, message)
+        if not sms_id:
+            raise RuntimeError("SMS provider did not accept the message")
         
         # Log SMS
         sms_service._log_sms_notification(
@@ -38,10 +194,10 @@ def send_sms_notification(self, incident_id, user_phone, message):
             message=message,
             incident_id=incident_id,
             status='sent',
-            twilio_sid=response.sid
+            twilio_sid=sms_id
         )
         
-        logger.info(f"SMS sent to {user_phone}: {response.sid}")
+        logger.info(f"SMS sent to {user_phone}: {sms_id}")
         return True
         
     except Exception as exc:
@@ -60,47 +216,68 @@ def send_sms_notification(self, incident_id, user_phone, message):
         # Retry with exponential backoff
         raise self.retry(exc=exc, countdown=60 * (2 ** self.request.retries))
 
+@celery.task(bind=True, max_retries=3)
+def send_sms_batch(self, incident_id, recipients, message, alert_key=None, bloom=False, lane=BULK_LANE, enqueued_at=None):
+    """
+    Send one message to a batch of recipients ({'id', 'phone'} dicts)
+    
+    Recipients are claimed against the alert's dedupe window on the first attempt,
+    so a re-enqueued batch does not message anyone twice. Retries carry only the
+    failed recipients, which this task already claimed, and skip the check.
+    """
+    if enqueued_at and self.request.retries == 0:
+        sms_lane_latency.observe(lane, time.time() - enqueued_at)
+    
+    if not sms_service.sms_enabled:
+        logger.error("SMS service not configured")
+        return False
+    
+    result = sms_service.send_batch(recipients, message, incident_id=incident_id, alert_key=alert_key,
+                                    dedupe=self.request.retries == 0, bloom=bloom)
+    
+    # Retry only the recipients that failed, with exponential backoff
+    failed = result.pop('failed_recipients')
+    if failed and self.request.retries < self.max_retries:
+        logger.warning(f"Retrying {len(failed)} failed SMS in batch for incident {incident_id}")
+        raise self.retry(args=(incident_id, failed, message, alert_key, bloom), countdown=60 * (2 ** self.request.retries))
+    
+    return result
+
+@celery.task(bind=True, max_retries=3)
+def deliver_notifications(self, channel_name, recipients, alert):
+    """
+    Deliver one batch of an alert on a non-SMS channel (inapp, push, email)
+    """
+    result = notification_engine().deliver(channel_name, recipients, alert, dedupe=self.request.retries == 0)
+    
+    # Retry only the recipients that failed, with exponential backoff
+    failed = result.pop('failed_recipients')
+    if failed and self.request.retries < self.max_retries:
+        raise self.retry(args=(channel_name, failed, alert), countdown=60 * (2 ** self.request.retries))
+    
+    return result
+
 @celery.task(bind=True)
 def process_incident_notification(self, incident_data):
     """
     Process incident notification by sending SMS to nearby users
     """
     try:
-        if not sms_service.client or not supabase:
+        if not sms_service.sms_enabled or not supabase:
             logger.error("SMS service or Supabase not configured")
             return False
         
-        # Get incident location
-        incident_lat = incident_data.get('latitude')
-        incident_lon = incident_data.get('longitude')
-        
-        if not incident_lat or not incident_lon:
+        if not incident_data.get('latitude') or not incident_data.get('longitude'):
             logger.error("Incident location not available")
             return False
         
-        # Get nearby users
-        nearby_users = sms_service.get_nearby_users(incident_lat, incident_lon)
+        # Send SMS to all nearby users in batches, on the lane for the incident's severity
+        success_count = dispatch_incident_alert(incident_data)
         
-        if not nearby_users:
+        if not success_count:
             logger.info("No nearby users found for incident notification")
             return True
         
-        # Create incident message
-        message = sms_service._create_incident_message(incident_data)
-        
-        # Send SMS to all nearby users
-        success_count = 0
-        for user in nearby_users:
-            phone = user.get('phone')
-            if phone:
-                # Queue individual SMS tasks
-                send_sms_notification.delay(
-                    incident_data.get('id'),
-                    phone,
-                    message
-                )
-                success_count += 1
-        
         logger.info(f"Queued {success_count} SMS notifications for incident {incident_data.get('id')}")
         return True
         
@@ -114,49 +291,37 @@ def send_weather_alert(self, weather_data):
     Send weather alert notifications
     """
     try:
-        if not sms_service.client or not supabase:
-            logger.error("SMS service or Supabase not configured")
+        if not supabase:
+            logger.error("Supabase not configured")
             return False
         
-        # Get all users with phone numbers
-        result = supabase.table('users').select('id, phone').not_.is_('phone', 'null').execute()
+        # Weather alert messages: full text for in-app/push/email, a one-segment GSM-7 text for SMS
+        messages = build_messages('weather', weather_context(weather_data))
         
-        if not result or not result.data:
+        # Stream users with phone numbers page by page into per-channel batches (no incident ID for weather alerts).
+        # If this task is retried part-way, batches already queued are skipped by the alert's dedupe claims.
+        users = UserRepository(supabase)
+        alert = make_alert(f"weather:{weather_data['id']}" if weather_data.get('id') else sms_service.alert_key(None, messages['sms']),
+                           messages['title'], messages['body'], severity=weather_data.get('severity') or 'medium',
+                           sms=messages['sms'])
+        alert['bloom'] = users.estimate_phone_users() >= DEDUPE_BLOOM_THRESHOLD
+        success_count = notify_users(users.iter_phone_users(columns='id, phone, email'), alert)
+        
+        if not success_count:
             logger.info("No users with phone numbers found for weather alert")
             return True
         
-        # Create weather alert message
-        message = f"""🌦️ WEATHER ALERT 🌦️
-
-{weather_data.get('weather_alert', 'Weather Alert')}
-
-Location: {weather_data.get('location', 'Unknown')}
-Temperature: {weather_data.get('temperature', 'N/A')}°C
-Condition: {weather_data.get('weather_condition', 'Unknown')}
-
-Please take necessary precautions and stay safe.
-
-- ResQchain Weather System"""
-        
-        # Send SMS to all users
-        success_count = 0
-        for user in result.data:
-            phone = user.get('phone')
-            if phone:
-                send_sms_notification.delay(
-                    None,  # No incident ID for weather alerts
-                    phone,
-                    message
-                )
-                success_count += 1
-        
-        logger.info(f"Queued {success_count} weather alert SMS notifications")
+        logger.info(f"Queued {success_count} weather alert notifications")
         return True
         
     except Exception as exc:
         logger.error(f"Weather alert processing failed: {str(exc)}")
         raise self.retry(exc=exc, countdown=60)
 
+# Only readings this recent are alerted on; must stay well inside ALERT_MARKER_RETENTION_DAYS
+# so a reading is never re-alerted after its marker is cleaned up
+WEATHER_ALERT_LOOKBACK_HOURS = 24
+
 @celery.task
 def check_weather_alerts():
     """
@@ -167,30 +332,40 @@ def check_weather_alerts():
             logger.error("Supabase not configured")
             return False
         
-        # Get recent extreme weather data
-        result = supabase.table('weather_data').select('*').eq('is_extreme', True).order('created_at', desc=True).limit(10).execute()
-        
-        if result and result.data:
-            for weather_data in result.data:
-                # Check if alert was already sent
-                alert_sent = supabase.table('weather_alerts_sent').select('id').eq('weather_id', weather_data['id']).execute()
-                
-                if not alert_sent.data:
-                    # Send weather alert
-                    send_weather_alert.delay(weather_data)
-                    
-                    # Mark as sent
-                    supabase.table('weather_alerts_sent').insert({
-                        'weather_id': weather_data['id'],
-                        'sent_at': 'now()'
-                    }).execute()
+        # Recent extreme weather rows, minus those already alerted (one lookup for the whole set)
+        weather_repo = WeatherRepository(supabase)
+        recent = weather_repo.list_recent_extreme(limit=10, since=(datetime.now(timezone.utc) - timedelta(hours=WEATHER_ALERT_LOOKBACK_HOURS)).isoformat())
+        sent = weather_repo.sent_alert_ids([w['id'] for w in recent])
+        pending = [w for w in recent if w['id'] not in sent]
+        
+        # Claim before sending: the unique marker means a concurrent run claims each row at most once
+        claimed = weather_repo.claim_alerts([w['id'] for w in pending])
         
+        failed = []
+        for weather_data in pending:
+            if weather_data['id'] not in claimed:
+                continue
+            try:
+                send_weather_alert.delay(weather_data)
+            except Exception as exc:
+                logger.error(f"Could not queue weather alert {weather_data['id']}: {exc}")
+                failed.append(weather_data['id'])
+        weather_repo.release_alerts(failed)
+        
+        if claimed:
+            logger.info(f"Queued {len(claimed) - len(failed)} weather alerts")
         return True
         
     except Exception as exc:
         logger.error(f"Weather alert check failed: {str(exc)}")
         return False
 
+SMS_LOG_RETENTION_DAYS = 30
+ALERT_MARKER_RETENTION_DAYS = 7
+# Rows per delete statement, and statements per run (the rest waits for the next run)
+CLEANUP_BATCH_SIZE = 1000
+CLEANUP_MAX_BATCHES = 500
+
 @celery.task
 def cleanup_old_notifications():
     """
@@ -201,11 +376,31 @@ def cleanup_old_notifications():
             logger.error("Supabase not configured")
             return False
         
-        # Delete SMS notifications older than 30 days
-        supabase.table('sms_notifications').delete().lt('created_at', 'now() - interval \'30 days\'').execute()
+        now = datetime.now(timezone.utc)
+        sms_cutoff = (now - timedelta(days=SMS_LOG_RETENTION_DAYS)).isoformat()
+        marker_cutoff = (now - timedelta(days=ALERT_MARKER_RETENTION_DAYS)).isoformat()
         
-        # Delete weather alerts sent older than 7 days
-        supabase.table('weather_alerts_sent').delete().lt('sent_at', 'now() - interval \'7 days\'').execute()
+        # Where sms_notifications is partitioned by month (partition_sms_notifications.sql),
+        # whole expired months are dropped and next months' partitions created ahead of time
+        # Creating next months' partitions matters more than dropping old ones: rows for a month
+        # without a partition land in the default partition, which then blocks creating it
+        for fn, params in (('drop_sms_notification_partitions', {'cutoff': sms_cutoff}),
+                           ('ensure_sms_notification_partitions', {'months_ahead': 2})):
+            try:
+                result = supabase.rpc(fn, params).execute()
+                logger.info(f"{fn}: {result.data or 0} partitions")
+            except Exception as exc:
+                if getattr(exc, 'code', None) == 'PGRST202':  # not partitioned (function not deployed)
+                    logger.info(f"{fn} unavailable, using batched deletes: {exc}")
+                else:
+                    logger.error(f"{fn} failed: {exc}")
+        
+        # Whatever remains (unpartitioned table, the current month, the default partition) goes in bounded batches
+        sms_deleted = delete_in_batches(supabase, 'sms_notifications', 'created_at', sms_cutoff,
+                                        batch_size=CLEANUP_BATCH_SIZE, max_batches=CLEANUP_MAX_BATCHES)
+        markers_deleted = delete_in_batches(supabase, 'weather_alerts_sent', 'sent_at', marker_cutoff,
+                                            batch_size=CLEANUP_BATCH_SIZE, max_batches=CLEANUP_MAX_BATCHES)
+        logger.info(f"Deleted {sms_deleted} SMS logs and {markers_deleted} weather alert markers")
         
         logger.info("Old notifications cleaned up successfully")
         return True
@@ -214,21 +409,61 @@ def cleanup_old_notifications():
         logger.error(f"Cleanup failed: {str(exc)}")
         return False
 
+@celery.task
+def rebuild_incident_clusters():
+    """
+    Backfill incident_clusters from the incidents table (queued by the admin dashboard when it is empty)
+    
+    Run it by hand after migrating with: celery -A celery_config call tasks.rebuild_incident_clusters
+    """
+    if not supabase:
+        logger.error("Supabase not configured")
+        return 0
+    from repositories.incident_cluster_repo import IncidentClusterRepository
+    from repositories.incident_repo import IncidentRepository
+    from services.incident_cluster_service import IncidentClusterService
+    
+    return IncidentClusterService(IncidentClusterRepository(supabase), IncidentRepository(supabase)).rebuild_all()
+
+# Near-duplicate index of this worker process, kept in step with incident_signatures
+_duplicate_index = None
+
+@celery.task
+def refresh_duplicate_groups():
+    """
+    Sign new incidents, sync this worker's near-duplicate index and store the top groups for the admin dashboard
+    
+    The first run in a process loads the stored signatures; MinHashing happens once per incident, in whichever
+    worker sees it first.
+    """
+    global _duplicate_index
+    if not supabase:
+        logger.error("Supabase not configured")
+        return 0
+    from repositories.duplicate_repo import DuplicateSignatureRepository
+    from repositories.incident_repo import IncidentRepository
+    from services.duplicate_detection import DuplicateReportIndex
+    
+    if _duplicate_index is None:
+        _duplicate_index = DuplicateReportIndex()
+    inc_repo, sig_repo = IncidentRepository(supabase), DuplicateSignatureRepository(supabase)
+    stats = _duplicate_index.sync(inc_repo, sig_repo)
+    groups = _duplicate_index.top_groups(inc_repo)
+    sig_repo.save_groups(groups)
+    logger.info(f"Duplicate index synced {stats}, {len(groups)} groups stored")
+    return len(groups)
+
 @celery.task
 def send_bulk_sms(phone_numbers, message, incident_id=None):
     """
     Send bulk SMS to multiple phone numbers
     """
     try:
-        if not sms_service.client:
+        if not sms_service.sms_enabled:
             logger.error("SMS service not configured")
             return False
         
-        success_count = 0
-        for phone in phone_numbers:
-            if phone:
-                send_sms_notification.delay(incident_id, phone, message)
-                success_count += 1
+        success_count = _dispatch_sms_batches([{'id': None, 'phone': phone} for phone in phone_numbers], message, incident_id)
         
         logger.info(f"Queued {success_count} bulk SMS messages")
         return True
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Keep test runs from writing app.log into the working tree
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "disaster-management-tests.log"))
@@ -126,3 +126,1207 @@ def test_delete_announcement(client, monkeypatch):
     # ✅ Check redirect happened
     assert response.status_code in (301, 302)
     assert "/admin_dashboard" in response.headers["Location"]
+
+
+# ---- INCIDENT CLUSTER TESTS ----
+def test_incident_clusters_match_raw_consolidation():
+    from services.incident_cluster_service import IncidentClusterService
+
+    incidents = [
+        {"id": 1, "pincode": "560001", "description": "Flood water rising near school", "severity": "medium", "timestamp": "2024-01-01T10:00:00"},
+        {"id": 2, "pincode": "560001", "description": "Flood near school gate", "severity": "high", "timestamp": "2024-01-01T11:00:00"},
+        {"id": 3, "pincode": "400001", "description": "Building fire", "severity": "low", "timestamp": "2024-01-01T09:00:00"},
+    ]
+    clusters = IncidentClusterService.build(incidents)
+    by_pin = {c["pincode"]: IncidentClusterService.as_incident(c) for c in clusters}
+    raw = {r["pincode"]: r for r in consolidate_incidents_by_pincode([dict(i) for i in sorted(incidents, key=lambda x: x["timestamp"], reverse=True)])}
+
+    assert by_pin["560001"]["report_count"] == 2
+    assert by_pin["560001"]["id"] == 2
+    assert by_pin["560001"]["severity"] == "high"
+    assert by_pin["560001"]["description"] == raw["560001"]["description"]
+    assert by_pin["400001"]["description"] == "Building fire"
+
+
+def test_incident_cluster_fold_is_incremental():
+    from services.incident_cluster_service import IncidentClusterService
+
+    cluster = None
+    for i in range(5):
+        cluster = IncidentClusterService.fold(cluster, {"id": i, "pincode": "1", "description": f"smoke report {i}", "timestamp": f"2024-01-0{i + 1}"})
+    assert cluster["report_count"] == 5
+    assert cluster["term_freq"]["smoke"] == 5
+    assert cluster["recent_descriptions"][0] == "smoke report 4"
+    assert "4 other reports" in IncidentClusterService.as_incident(cluster)["description"]
+
+
+def test_incident_cluster_refresh_upserts_and_buckets_missing_pincodes():
+    from repositories.incident_cluster_repo import IncidentClusterRepository
+    from repositories.incident_repo import IncidentRepository
+    from services.incident_cluster_service import IncidentClusterService
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase()
+    sb.seed("users", [{"id": "u", "email": "u@x.in"}])
+    sb.seed("incidents", [
+        {"user_id": "u", "pincode": "411001", "description": "flood", "status": "pending"},
+        {"user_id": "u", "pincode": None, "description": "landslide on ghat road", "status": "pending"},
+    ])
+    service = IncidentClusterService(IncidentClusterRepository(sb), IncidentRepository(sb))
+    assert service.rebuild_all() == 2
+    by_pin = {c["pincode"]: c for c in sb.rows("incident_clusters")}
+    assert set(by_pin) == {"411001", IncidentClusterService.NO_PINCODE}
+    assert {i["pincode"] for i in service.consolidated("pending")} == {"411001", None}
+
+    # A stale forwarded cluster is removed only after the pending one is upserted, with a higher version
+    sb.seed("incident_clusters", [{"pincode": "411001", "lane": "forwarded", "report_count": 1, "version": 7}])
+    old_version = by_pin["411001"]["version"]
+    service.refresh_pincode("411001")
+    rows = [c for c in sb.rows("incident_clusters") if c["pincode"] == "411001"]
+    assert [c["lane"] for c in rows] == ["pending"] and rows[0]["id"] == by_pin["411001"]["id"]
+    assert rows[0]["version"] > max(old_version, 7)
+
+    service.refresh_pincode(None)
+    assert len(sb.rows("incident_clusters")) == 2
+
+
+# ---- DUPLICATE DETECTION TESTS ----
+def test_duplicate_index_groups_typo_pincode_reports():
+    from services.duplicate_detection import DuplicateReportIndex
+
+    index = DuplicateReportIndex()
+    index.add({"id": 1, "location": "Shivaji Nagar", "pincode": "411005", "description": "Flood water entering houses near Shivaji market, people stuck on rooftops"})
+    index.add({"id": 2, "location": "Kothrud", "pincode": "411005", "description": "Transformer fire behind the bus depot, thick smoke"})
+    matches = index.add({"id": 3, "location": "Shivaji Nagar", "pincode": "411050", "description": "Flood water entering houses near Shivaji market, people stuck on rooftops please help"})
+
+    assert [m[0] for m in matches] == [1]
+    groups = index.candidate_groups()
+    assert [sorted(i["id"] for i in g) for g in groups] == [[1, 3]]
+
+    index.remove(1)
+    assert index.candidate_groups() == []
+
+
+
+def test_duplicate_groups_synced_through_signature_table():
+    from repositories.duplicate_repo import DuplicateSignatureRepository
+    from repositories.incident_repo import IncidentRepository
+    from services.duplicate_detection import DuplicateReportIndex
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase()
+    inc_repo, sig_repo = IncidentRepository(sb), DuplicateSignatureRepository(sb)
+    flood = "Flood water entering houses near Shivaji market, people stuck on rooftops"
+    for loc, pin, desc in (("Shivaji Nagar", "411005", flood), ("Kothrud", "411005", "Transformer fire behind the bus depot"),
+                           ("Shivaji Nagar", "411050", flood + " please help")):
+        inc_repo.insert_incident({"location": loc, "pincode": pin, "description": desc})
+
+    writer = DuplicateReportIndex()
+    assert writer.sync(inc_repo, sig_repo)["signed"] == 3
+    sig_repo.save_groups(writer.top_groups(inc_repo))
+    assert [[i["pincode"] for i in g] for g in sig_repo.load_groups()] == [["411005", "411050"]]
+
+    # Another process loads the stored signatures instead of MinHashing again
+    reader = DuplicateReportIndex()
+    assert reader.sync(inc_repo, sig_repo) == {"signed": 0, "added": 3, "removed": 0}
+
+    # A deleted incident takes its signature row with it (ON DELETE CASCADE)
+    first = sig_repo.max_incident_id() - 2
+    sb.table("incident_signatures").delete().eq("incident_id", first).execute()
+    assert reader.sync(inc_repo, sig_repo)["removed"] == 1
+    assert reader.top_groups(inc_repo) == []
+
+# ---- USER DIRECTORY TESTS ----
+def test_user_directory_radius_query_and_incremental_upsert():
+    from services.user_directory import UserDirectory
+
+    class FakeUserRepo:
+        def latest_update(self):
+            return None
+
+        def iter_phone_users(self):
+            return iter([
+                {"id": "a", "phone": "1", "latitude": 18.5204, "longitude": 73.8567, "pincode": "411001"},
+                {"id": "b", "phone": "2", "latitude": 18.5300, "longitude": 73.8500, "pincode": "411005"},
+                {"id": "c", "phone": "3", "latitude": 19.0760, "longitude": 72.8777, "pincode": "400001"},
+                {"id": "d", "phone": "4", "latitude": None, "longitude": None, "pincode": "411001"},
+            ])
+
+    directory = UserDirectory()
+    directory.load(FakeUserRepo())
+    assert [u["id"] for u, _ in directory.within_radius(18.5204, 73.8567, 5)] == ["a", "b"]
+    assert [u["id"] for u in directory.unlocated()] == ["d"]
+
+    # Partial profile update moves "c" next to the incident; dropping the phone removes "b"
+    directory.upsert({"id": "c", "latitude": 18.5210, "longitude": 73.8570})
+    directory.upsert({"id": "b", "phone": None})
+    assert [u["id"] for u, _ in directory.within_radius(18.5204, 73.8567, 5)] == ["a", "c"]
+    assert directory.in_pincode("400001")[0]["phone"] == "3"
+
+
+def test_user_directory_pincode_index_follows_profile_upserts():
+    from services.user_directory import UserDirectory
+
+    class FakeUserRepo:
+        def latest_update(self):
+            return None
+
+        def iter_phone_users(self):
+            return iter([{"id": f"u{i}", "phone": str(i), "pincode": "411001"} for i in range(5)])
+
+    directory = UserDirectory()
+    directory.load(FakeUserRepo())
+    directory.upsert({"id": "u1", "pincode": "411038"})
+    directory.upsert({"id": "new", "name": "Signup", "phone": "9", "pincode": "411038"})
+    directory.upsert({"id": "nophone", "pincode": "411038"})
+
+    assert directory.pincode_count("411001") == 4
+    assert sorted(u["id"] for u in directory.in_pincode("411038")) == ["new", "u1"]
+    assert directory.in_pincode("999999") == []
+
+
+def test_user_directory_refresh_applies_writes_from_another_process():
+    from repositories.user_repo import UserRepository
+    from services.user_directory import UserDirectory
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase()
+    sb.seed("users", [
+        {"id": "a", "name": "A", "email": "a@x.in", "phone": "1", "latitude": 18.5204, "longitude": 73.8567},
+        {"id": "b", "name": "B", "email": "b@x.in", "phone": "2", "latitude": 19.0760, "longitude": 72.8777},
+    ])
+    repo = UserRepository(sb)
+    worker = UserDirectory(overlap_seconds=0)
+    assert worker.refresh(repo) == 0 and len(worker) == 2
+
+    # Written through the table only, as the web process does: signup, move, phone removed
+    repo.upsert_user_profile({"id": "c", "name": "C", "email": "c@x.in", "phone": "3", "latitude": 18.5210, "longitude": 73.8570})
+    sb.table("users").update({"latitude": 18.5300, "longitude": 73.8500}).eq("id", "b").execute()
+    sb.table("users").update({"phone": None}).eq("id", "a").execute()
+
+    assert worker.refresh(repo) == 3
+    assert [u["id"] for u, _ in worker.within_radius(18.5204, 73.8567, 5)] == ["c", "b"]
+    assert worker.refresh(repo) <= 1  # only rows at the watermark itself are read again
+
+
+def test_pincode_users_follow_profile_edits_made_elsewhere(monkeypatch):
+    import services.user_directory
+    from repositories.user_repo import UserRepository
+    from services.user_directory import UserDirectory
+    from sms_service import sms_service
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase()
+    sb.seed("users", [{"id": f"u{i}", "name": "U", "email": f"u{i}@x.in", "phone": str(i), "pincode": "411001"} for i in range(3)])
+    monkeypatch.setattr(sms_service, "supabase", sb)
+    monkeypatch.setattr(services.user_directory, "user_directory", UserDirectory(overlap_seconds=0))
+    assert len(sms_service.get_pincode_users("411001")) == 3
+
+    # Web process: one user moves, one signs up; the worker sees both on its next query
+    sb.table("users").update({"pincode": "411038"}).eq("id", "u1").execute()
+    UserRepository(sb).upsert_user_profile({"id": "new", "name": "N", "email": "n@x.in", "phone": "9", "pincode": "411038"})
+
+    assert sorted(u["id"] for u in sms_service.get_pincode_users("411038")) == ["new", "u1"]
+    assert sms_service.user_directory.pincode_count("411001") == 2
+
+
+# ---- SHELTER TILE CACHE TESTS ----
+def test_shelter_tiles_are_cached_and_concurrent_misses_coalesced():
+    import threading
+    import time
+    from types import SimpleNamespace
+    from services.shelter_service import ShelterService
+
+    class FakeOverpass:
+        def __init__(self):
+            self.calls = 0
+
+        def query(self, q):
+            self.calls += 1
+            time.sleep(0.05)
+            node = SimpleNamespace(id=1, lat=18.5204, lon=73.8567, tags={"name": "City School", "building": "school"})
+            return SimpleNamespace(nodes=[node], ways=[])
+
+    api = FakeOverpass()
+    service = ShelterService(overpass=api)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.candidates(18.52, 73.85))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert api.calls == 1
+    assert all([c["tags"]["name"] for c in r] == ["City School"] for r in results)
+    service.candidates(18.521, 73.851)
+    assert api.calls == 1
+
+
+def test_shelter_catalog_nearest_from_imported_rows():
+    from services.shelter_service import ShelterCatalog
+
+    class FakeShelterRepo:
+        def iter_located(self):
+            return iter([
+                {"id": 1, "name": "Relief Camp", "latitude": "18.5210", "longitude": "73.8570"},
+                {"id": 2, "name": "Model School", "latitude": 18.5600, "longitude": 73.8100},
+                {"id": 3, "name": "Mumbai Hall", "latitude": 19.0760, "longitude": 72.8777},
+            ])
+
+    catalog = ShelterCatalog()
+    assert catalog.nearest(18.5204, 73.8567) == []
+    catalog.build(FakeShelterRepo())
+    hits = catalog.nearest(18.5204, 73.8567, k=5, radius_km=10)
+    assert [row["name"] for row, _ in hits] == ["Relief Camp", "Model School"]
+    assert hits[0][1] < 0.2
+
+    # A failed rebuild keeps serving the previous index
+    class FailingRepo:
+        def iter_located(self):
+            raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        catalog.build(FailingRepo())
+    assert len(catalog) == 3
+
+
+def test_shelter_catalog_builds_in_the_background_once_per_process(monkeypatch):
+    import os
+    import threading
+    from services.shelter_service import ShelterCatalog
+
+    started = []
+    monkeypatch.setattr(threading.Thread, "start", lambda self: started.append(self.name))
+    catalog = ShelterCatalog()
+    assert catalog.start(object()) is True
+    assert catalog.start(object()) is False
+    # A refresher inherited over fork is not running in the child, which starts its own
+    catalog._refresher_pid = os.getpid() + 1
+    assert catalog.start(object()) is True
+    assert started == ["shelter-catalog", "shelter-catalog"]
+
+
+# ---- GEOCODING TESTS ----
+def test_geocoding_service_caches_and_coalesces(tmp_path):
+    import threading
+    import time
+    from types import SimpleNamespace
+    from services.geocoding_service import GeocodingService
+
+    class FakeNominatim:
+        def __init__(self):
+            self.calls = []
+
+        def geocode(self, query, timeout=None):
+            self.calls.append(query)
+            time.sleep(0.05)
+            if "nowhere" in query:
+                return None
+            return SimpleNamespace(latitude=18.5204, longitude=73.8567, address="Pune, Maharashtra, India")
+
+    fake = FakeNominatim()
+    service = GeocodingService(str(tmp_path / "geo.db"), min_interval=0, geocoder=fake)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.geocode("  Pune,  Maharashtra "))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Cached by the normalized key, but Nominatim sees what the user typed
+    assert fake.calls == ["Pune, Maharashtra"]
+    assert all(r["lat"] == 18.5204 for r in results)
+    assert service.geocode("nowhere land") is None
+    assert service.geocode("NOWHERE land!") is None
+
+    # A fresh instance reads the persisted cache instead of calling upstream
+    again = GeocodingService(str(tmp_path / "geo.db"), min_interval=0, geocoder=fake)
+    assert again.geocode("pune, maharashtra")["lon"] == 73.8567
+    assert len(fake.calls) == 2
+
+
+def test_api_geocode_requires_sign_in_and_query(client):
+    assert client.get("/api/geocode?q=Pune").status_code == 401
+    with client.session_transaction() as sess:
+        sess.update({"user": "u@x.in", "user_id": "u", "user_role": "user"})
+    response = client.get("/api/geocode")
+    assert response.status_code == 400
+
+
+def test_geocoding_queue_is_bounded_and_skips_abandoned_lookups():
+    import threading
+    from services.geocoding_service import GeocoderBusy, GeocodingService
+
+    calls = []
+    geocoder = type("FakeNominatim", (), {"geocode": lambda self, q, timeout=None: calls.append(q)})()
+    service = GeocodingService(":memory:", min_interval=0, geocoder=geocoder, max_queue=2)
+    service._worker = type("Busy", (), {"is_alive": lambda self: True})()  # hold the queue
+    service._submit("a").cancel()
+    kept = service._submit("b")
+    with pytest.raises(GeocoderBusy):
+        service._submit("c")
+
+    threading.Thread(target=service._run_worker, daemon=True).start()
+    assert kept.result(timeout=2) is None
+    assert calls == ["b"]
+
+
+def test_geocoding_paces_through_the_shared_limiter_and_reports_busy(client, monkeypatch):
+    import app as app_module
+    from services.geocoding_service import GeocoderBusy, GeocodingService
+
+    taken = []
+    limiter = type("Limiter", (), {"acquire": lambda self, key: taken.append(key) or True})()
+    geocoder = type("FakeNominatim", (), {"geocode": lambda self, q, timeout=None: None})()
+    service = GeocodingService(":memory:", geocoder=geocoder, limiter=limiter)
+    assert service.geocode("Nowhere") is None and taken == ["nominatim"]
+    assert GeocodingService(":memory:").limiter.prefix == "geocode:ratelimit"
+
+    def busy(query):
+        raise GeocoderBusy("full")
+
+    monkeypatch.setitem(app_module.APP_STATE, "geocoder", type("Busy", (), {"geocode": staticmethod(busy)})())
+    with client.session_transaction() as sess:
+        sess.update({"user": "u@x.in", "user_id": "u", "user_role": "user"})
+    response = client.get("/api/geocode?q=Pune")
+    assert response.status_code == 503 and response.get_json()["busy"] and response.headers["Retry-After"] == "5"
+
+
+def test_shelter_ranking_uses_lookup_table_and_top_k():
+    from services.shelter_service import classify_shelter, estimate_capacity, rank_nearest
+
+    assert classify_shelter({"amenity": "place_of_worship", "building": "school"}) == "School"
+    assert classify_shelter({"building": "temple"}) == "Temple"
+    assert classify_shelter({"amenity": "cafe"}) == "Public Facility"
+    assert estimate_capacity("Temple") == "Medium (100-500 people)"
+
+    elements = [{"lat": 18.52 + i * 0.01, "lon": 73.85, "tags": {"name": f"Place {i}"}} for i in range(20)]
+    elements.append({"lat": 18.52, "lon": 73.85, "tags": {"name": "Unnamed"}})
+    ranked = rank_nearest(18.52, 73.85, elements, k=3, radius_km=10)
+    assert [el["tags"]["name"] for el, _ in ranked] == ["Place 0", "Place 1", "Place 2"]
+    assert ranked[0][1] == 0.0 and ranked[1][1] < ranked[2][1]
+
+
+# ---- SMS BATCH TESTS ----
+def test_sms_send_batch_logs_with_one_insert(monkeypatch):
+    from sms_service import SMSService
+
+    inserts = []
+
+    class FakeTable:
+        def insert(self, rows):
+            inserts.append(rows)
+            return self
+
+        def execute(self):
+            return None
+
+    monkeypatch.setattr("utils.dedupe.get_redis", lambda: None)
+    service = SMSService()
+    service.supabase = type("FakeSupabase", (), {"table": lambda self, name: FakeTable()})()
+    monkeypatch.setattr(service, "_send_sms", lambda phone, message: None if phone == "+919000000002" else f"mock_{phone}")
+
+    result = service.send_batch([{"id": "a", "phone": "9000000001"}, {"id": "b", "phone": "+91 90000 00002"}, {"id": "c", "phone": None}], "hello", incident_id=7)
+    assert service.log_queue_depth() == 2
+    service.flush_logs()
+
+    assert result["sent"] == 1 and result["failed"] == 1
+    assert [u["id"] for u in result["failed_recipients"]] == ["b"]
+    assert len(inserts) == 1 and [r["status"] for r in inserts[0]] == ["sent", "failed"]
+
+
+def test_buffered_writer_flushes_by_size_and_requeues_when_database_is_down():
+    import time
+    from utils.buffered_writer import BufferedInsertWriter
+
+    calls = []
+    state = {"fail": True}
+
+    class FakeTable:
+        def insert(self, rows):
+            self.rows = rows
+            return self
+
+        def execute(self):
+            if state["fail"]:
+                state["fail"] = False
+                raise RuntimeError("db down")
+            calls.append(len(self.rows))
+
+    client = type("FakeSupabase", (), {"table": lambda self, name: FakeTable()})()
+    writer = BufferedInsertWriter(lambda: client, "sms_notifications", max_batch=3, flush_interval=60)
+    writer.add_many([{"n": 0}, {"n": 1}])
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert writer.depth() == 2
+
+    # Reaching max_batch wakes the background flusher, which drains everything pending
+    writer.add_many([{"n": i} for i in range(2, 7)])
+    deadline = time.time() + 2
+    while writer.flushed < 7 and time.time() < deadline:
+        time.sleep(0.01)
+    assert calls == [3, 3, 1] and writer.flushed == 7
+
+
+def test_buffered_writer_isolates_rejected_rows():
+    from utils.buffered_writer import BufferedInsertWriter
+    from utils.inmemory_supabase import InMemoryAPIError
+
+    written = []
+
+    class FakeTable:
+        def insert(self, rows):
+            self.rows = rows
+            return self
+
+        def execute(self):
+            # Foreign key violation, as for a log row whose incident was just deleted
+            if any(row.get("incident_id") == "deleted" for row in self.rows):
+                raise InMemoryAPIError("insert violates foreign key constraint", code="23503")
+            written.extend(row["n"] for row in self.rows)
+
+    client = type("FakeSupabase", (), {"table": lambda self, name: FakeTable()})()
+    writer = BufferedInsertWriter(lambda: client, "sms_notifications", max_batch=8, flush_interval=60, max_row_attempts=2)
+    rows = [{"n": i} for i in range(8)]
+    rows[5]["incident_id"] = "deleted"
+    writer.add_many(rows)
+
+    # The neighbours of the bad row are written; it waits at the back of the buffer
+    assert writer.flush() == 7 and writer.depth() == 1
+    writer.add({"n": 8})
+    assert writer.flush() == 1
+    assert sorted(written) == [0, 1, 2, 3, 4, 6, 7, 8]
+    assert writer.depth() == 0 and writer.dropped == 1
+
+    # A schema error (column missing after a bad deploy) is no row's fault: one attempt, nothing dropped
+    attempts = []
+
+    class SchemaMismatchTable(FakeTable):
+        def execute(self):
+            attempts.append(len(self.rows))
+            raise InMemoryAPIError("Could not find the 'segments' column", code="PGRST204")
+
+    client = type("FakeSupabase", (), {"table": lambda self, name: SchemaMismatchTable()})()
+    writer.add_many([{"n": i} for i in range(4)])
+    with pytest.raises(InMemoryAPIError):
+        writer.flush()
+    assert attempts == [4] and writer.depth() == 4 and writer.dropped == 1
+    client = None  # no client: the next flush discards the rows instead of retrying at exit
+    writer.flush()
+
+
+def test_sms_send_batch_normalizes_and_skips_repeat_alerts(monkeypatch):
+    from sms_service import SMSService
+    from utils.phone import normalize_phone
+
+    assert normalize_phone("098765 43210") == normalize_phone("0091-9876543210") == "+919876543210"
+    assert normalize_phone("12") is None
+    assert normalize_phone("4155550123", default_country_code="1") == "+14155550123"
+
+    monkeypatch.setattr("utils.dedupe.get_redis", lambda: None)
+    service = SMSService()
+    service.supabase = None
+    sent = []
+    monkeypatch.setattr(service, "_send_sms", lambda phone, message: sent.append(phone) or "mock")
+
+    users = [{"id": "a", "phone": "9876543210"}, {"id": "b", "phone": "+91 98765 43210"}, {"id": "c", "phone": "9123456789"}]
+    first = service.send_batch(users, "flood warning", incident_id=3)
+    again = service.send_batch(users, "flood warning", incident_id=3)
+    retry = service.send_batch(users[:1], "flood warning", incident_id=3, dedupe=False)
+
+    assert first["sent"] == 2 and again["sent"] == 0 and again["skipped"] == 2
+    assert retry["sent"] == 1
+    assert sent == ["+919876543210", "+919123456789", "+919876543210"]
+    assert service.send_batch(users[:1], "all clear", incident_id=3)["sent"] == 1
+
+    # A worker killed mid-batch has claimed only the phones it reached; the redelivery sends the rest
+    def dies_on_second(phone, message):
+        if phone == "+919123456789":
+            raise SystemExit("worker lost")
+        return sent.append(phone) or "mock"
+
+    monkeypatch.setattr(service, "_send_sms", dies_on_second)
+    users = [{"id": "d", "phone": "9000000004"}, {"id": "e", "phone": "9123456789"}, {"id": "f", "phone": "9000000006"}]
+    with pytest.raises(SystemExit):
+        service.send_batch(users, "landslide", incident_id=4)
+    monkeypatch.setattr(service, "_send_sms", lambda phone, message: sent.append(phone) or "mock")
+    redelivered = service.send_batch(users, "landslide", incident_id=4)
+    assert redelivered["skipped"] == 2 and sent[-1] == "+919000000006"
+
+
+def test_weather_recipients_stream_by_page_into_batches(monkeypatch):
+    import tasks
+    from repositories.user_repo import UserRepository
+
+    users = [{"id": f"{i:04d}", "phone": str(9000000000 + i)} for i in range(25)]
+    pages = []
+
+    class FakeQuery:
+        def __init__(self):
+            self.after = None
+
+        def select(self, columns, **kwargs):
+            return self
+
+        @property
+        def not_(self):
+            return self
+
+        def is_(self, column, value):
+            return self
+
+        def gt(self, column, value):
+            self.after = value
+            return self
+
+        def order(self, column):
+            return self
+
+        def limit(self, n):
+            self.n = n
+            return self
+
+        def execute(self):
+            rows = [u for u in users if self.after is None or u["id"] > self.after][:self.n]
+            pages.append(len(rows))
+            return type("Resp", (), {"data": rows})()
+
+    repo = UserRepository(type("FakeSupabase", (), {"table": lambda self, name: FakeQuery()})())
+    queued = []
+    monkeypatch.setattr(tasks, "SMS_BATCH_SIZE", 10)
+    monkeypatch.setattr(tasks.send_sms_batch, "apply_async", lambda args, kwargs, queue: queued.append((len(pages), len(args[1]))))
+
+    assert tasks._dispatch_sms_batches(repo.iter_phone_users(page_size=10, columns="id, phone"), "storm") == 25
+    # The first batch is queued after one page is read, not after the whole scan
+    assert queued == [(1, 10), (2, 10), (3, 5)]
+    assert pages == [10, 10, 5]
+
+
+def test_incident_sms_uses_severity_lane(monkeypatch):
+    import tasks
+    import utils.metrics as metrics
+
+    assert tasks.sms_lane("CRITICAL") == "sms_critical"
+    # Shared workers drain their queues in -Q order, not round-robin
+    assert tasks.celery.conf.broker_transport_options["queue_order_strategy"] == "priority"
+    assert tasks.sms_lane("medium") == tasks.BULK_LANE
+    assert tasks.sms_lane(None, default="sms_high") == "sms_high"
+
+    queued = []
+    monkeypatch.setattr(tasks.sms_service, "sms_enabled", True)
+    monkeypatch.setattr(tasks, "_notification_engine", None)
+    monkeypatch.setattr(tasks.send_sms_batch, "apply_async", lambda args, kwargs, queue: queued.append((queue, kwargs["lane"])))
+    monkeypatch.setattr(tasks.sms_service, "get_nearby_users", lambda lat, lon, pincode, radius_km: [{"id": "a", "phone": "9000000001"}])
+    assert tasks.dispatch_incident_alert({"id": 1, "latitude": 19.0, "longitude": 72.8, "severity": "critical"}, "evacuate") == 1
+    assert tasks.dispatch_incident_alert({"id": 2, "latitude": 19.0, "longitude": 72.8, "severity": "low"}, "heads up") == 1
+    assert queued == [("sms_critical", "sms_critical"), ("sms_high", "sms_high")]
+
+    monkeypatch.setattr(metrics, "get_redis", lambda: None)
+    histogram = metrics.LatencyHistogram("test_lane_wait", buckets=(1, 60))
+    histogram.observe("sms_critical", 0.2)
+    histogram.observe("sms_bulk", 30)
+    histogram.observe("sms_bulk", 600)
+    snap = histogram.snapshot()
+    assert snap["sms_critical"]["buckets"] == [(1, 1), (60, 1), (float("inf"), 1)]
+    assert snap["sms_bulk"]["buckets"] == [(1, 0), (60, 1), (float("inf"), 2)] and snap["sms_bulk"]["count"] == 2
+
+
+def test_cleanup_creates_partitions_even_when_dropping_fails(monkeypatch):
+    import tasks
+    from utils.inmemory_supabase import InMemoryAPIError, InMemorySupabase
+
+    sb = InMemorySupabase()
+    ensured = []
+
+    def drop(client, params):
+        raise InMemoryAPIError("must be owner of table sms_notifications_2026_01", code="42501")
+
+    sb.register_function("drop_sms_notification_partitions", drop)
+    sb.register_function("ensure_sms_notification_partitions", lambda client, params: ensured.append(params) or 1)
+    monkeypatch.setattr(tasks, "supabase", sb)
+    assert tasks.cleanup_old_notifications() is True
+    assert ensured == [{"months_ahead": 2}]
+
+
+def test_check_weather_alerts_claims_before_queueing(monkeypatch):
+    import tasks
+
+    calls = []
+
+    class FakeWeatherRepo:
+        def __init__(self, client):
+            pass
+
+        def list_recent_extreme(self, limit, since=None):
+            return [{"id": 1}, {"id": 2}, {"id": 3}, {"id": 4}]
+
+        def sent_alert_ids(self, ids):
+            calls.append(("sent", ids))
+            return {1}
+
+        def claim_alerts(self, ids):
+            calls.append(("claim", ids))
+            return {2, 4}  # 3 was claimed by a concurrent run
+
+        def release_alerts(self, ids):
+            calls.append(("release", ids))
+
+    def delay(weather_data):
+        if weather_data["id"] == 4:
+            raise ConnectionError("broker down")
+        calls.append(("queued", weather_data["id"]))
+
+    monkeypatch.setattr(tasks, "supabase", object())
+    monkeypatch.setattr(tasks, "WeatherRepository", FakeWeatherRepo)
+    monkeypatch.setattr(tasks.send_weather_alert, "delay", delay)
+
+    assert tasks.check_weather_alerts() is True
+    assert calls == [("sent", [1, 2, 3, 4]), ("claim", [2, 3, 4]), ("queued", 2), ("release", [4])]
+
+
+def test_delete_in_batches_stops_at_cutoff_and_caps_batches():
+    from utils.batched_delete import delete_in_batches
+
+    rows = [{"id": i, "created_at": f"2024-01-{i:02d}"} for i in range(1, 26)]
+    deletes = []
+
+    class FakeQuery:
+        def select(self, column):
+            return self
+
+        def lt(self, column, value):
+            self.cutoff = value
+            return self
+
+        def order(self, column):
+            return self
+
+        def limit(self, n):
+            self.n = n
+            return self
+
+        def delete(self):
+            self.deleting = True
+            return self
+
+        def gte(self, column, value):
+            self.low = value
+            return self
+
+        def lte(self, column, value):
+            self.high = value
+            return self
+
+        def execute(self):
+            if getattr(self, "deleting", False):
+                gone = [r for r in rows if self.low <= r["id"] <= self.high and r["created_at"] < self.cutoff]
+                deletes.append(len(gone))
+                rows[:] = [r for r in rows if r not in gone]
+                return type("Resp", (), {"data": gone})()
+            return type("Resp", (), {"data": [r for r in rows if r["created_at"] < self.cutoff][:self.n]})()
+
+    client = type("FakeSupabase", (), {"table": lambda self, name: FakeQuery()})()
+    assert delete_in_batches(client, "sms_notifications", "created_at", "2024-01-21", batch_size=8, max_batches=2, pause=0) == 16
+    assert delete_in_batches(client, "sms_notifications", "created_at", "2024-01-21", batch_size=8, pause=0) == 4
+    assert deletes == [8, 8, 4] and [r["id"] for r in rows] == list(range(21, 26))
+
+
+def test_message_builder_keeps_sms_in_gsm7_and_few_segments():
+    from services.message_builder import build_messages, incident_context, segment_info, sms_text, to_gsm7, weather_context
+
+    assert segment_info("a" * 160)["segments"] == 1 and segment_info("a" * 161)["segments"] == 2
+    assert segment_info("{" * 80)["units"] == 160
+    assert segment_info("Alert 🚨")["encoding"] == "ucs2"
+    assert to_gsm7("Rain – 30°C • “stay safe” 🌦️") == 'Rain - 30C - "stay safe"'
+
+    incident = build_messages("incident", incident_context({
+        "location": "Andheri East", "pincode": "400069", "severity": "critical", "description": "x" * 200}))
+    weather = build_messages("weather", weather_context({"location": "Chennai", "weather_alert": "Heavy rain", "temperature": 27}))
+    assert segment_info(incident["body"])["segments"] >= 4
+    assert segment_info(incident["sms"])["encoding"] == "gsm7" and segment_info(incident["sms"])["segments"] <= 2
+    assert segment_info(weather["sms"])["segments"] == 1 and "🌦️" in weather["body"]
+
+    # Words with no GSM-7 form are kept and sent as UCS-2 rather than deleted
+    assert sms_text("São Tomé flood – stay safe 🚨") == "Sao Tomé flood - stay safe"
+    assert sms_text("बाढ़ Flood near  मंदिर road") == "बाढ़ Flood near मंदिर road"
+    hindi = build_messages("incident", incident_context({"location": "शिवाजी नगर", "pincode": "411005", "description": "नदी में बाढ़"}))
+    assert "शिवाजी नगर" in hindi["sms"] and "नदी में बाढ़" in hindi["sms"]
+    assert segment_info(hindi["sms"])["encoding"] == "ucs2" and segment_info(hindi["sms"])["segments"] <= 2
+
+
+# ---- UNIT OF WORK TESTS ----
+def test_unit_of_work_single_rpc_and_sequential_fallback(monkeypatch):
+    from repositories.unit_of_work import UnitOfWork, UnitOfWorkConflict
+
+    calls = []
+    units = {1: "Busy"}
+
+    class MissingFunction(Exception):
+        code = "PGRST202"
+
+    class FakeQuery:
+        def __init__(self, table):
+            self.table, self.filters, self.excludes = table, {}, {}
+
+        def insert(self, values):
+            self.values = values
+            return self
+
+        def update(self, values):
+            self.values = values
+            return self
+
+        def eq(self, column, value):
+            self.filters[column] = value
+            return self
+
+        def neq(self, column, value):
+            self.excludes[column] = value
+            return self
+
+        def execute(self):
+            calls.append(self.table)
+            if self.table == "emergency_units":
+                uid = self.filters["id"]
+                if units.get(uid) == self.excludes.get("status"):
+                    return type("Resp", (), {"data": []})()
+                units[uid] = self.values["status"]
+            return type("Resp", (), {"data": [dict(self.values, **self.filters)]})()
+
+    class FakeSupabase:
+        rpc_deployed = True
+
+        def rpc(self, name, params):
+            calls.append(name)
+            if not self.rpc_deployed:
+                raise MissingFunction("Could not find the function")
+            return type("Resp", (), {"execute": lambda s: type("Resp", (), {"data": [[{"id": 7}], []]})()})()
+
+        def table(self, name):
+            return FakeQuery(name)
+
+    monkeypatch.setattr(UnitOfWork, "_rpc_missing", False)
+    client = FakeSupabase()
+    uow = UnitOfWork(client)
+    ins = uow.insert("emergency_assignments", {"request_id": 1})
+    uow.update("requests", {"status": "assigned"}, {"id": 1})
+    assert uow.commit()[ins] == [{"id": 7}] and calls == ["apply_unit_of_work"]
+
+    client.rpc_deployed = False
+    calls.clear()
+    uow.update("emergency_units", {"status": "Busy"}, {"id": 2}, exclude={"status": "Busy"}, expect=True)
+    uow.insert("emergency_assignments", {"request_id": 1})
+    assert [len(rows) for rows in uow.commit()] == [1, 1]
+    assert calls == ["apply_unit_of_work", "emergency_units", "emergency_assignments"]
+
+    uow.update("emergency_units", {"status": "Busy"}, {"id": 1}, exclude={"status": "Busy"}, expect=True)
+    uow.insert("emergency_assignments", {"request_id": 1})
+    with pytest.raises(UnitOfWorkConflict):
+        uow.commit()
+    assert calls[-1] == "emergency_units"
+
+
+# ---- IN-MEMORY BACKEND TESTS ----
+def test_inmemory_supabase_embeds_filters_and_counts_round_trips():
+    import time
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase(latency=0.01)
+    sb.seed("users", [{"id": "u1", "name": "Admin", "email": "a@x.in", "role": "admin"}])
+    sb.seed("incidents", [{"user_id": "u1", "location": "Pune", "pincode": "411001", "description": "flood"},
+                          {"user_id": "u1", "location": "Agra", "pincode": "282001", "description": "fire", "status": "resolved"}])
+    sb.seed("requests", [{"admin_id": "u1", "incident_id": 1}, {"admin_id": "u1", "incident_id": 2}])
+
+    start = time.perf_counter()
+    res = sb.table("requests").select("id, incidents(location, pincode)", count="exact").eq("id", "2").execute()
+    assert time.perf_counter() - start >= 0.01
+    assert res.data == [{"id": 2, "incidents": {"location": "Agra", "pincode": "282001"}}] and res.count == 1
+
+    pending = sb.table("incidents").select("id, requests(status)").neq("status", "resolved").order("id", desc=True).execute()
+    assert pending.data == [{"id": 1, "requests": [{"status": "pending"}]}]
+    assert sb.table("users").select("id").not_.is_("email", "null").ilike("name", "adm%").execute().data == [{"id": "u1"}]
+    assert sb.round_trips == 3 and sb.calls[("select", "requests")] == 1
+
+
+def test_assign_emergency_team_is_one_write_round_trip(client, monkeypatch):
+    import app as app_module
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase()
+    sb.seed("users", [{"id": "gov", "email": "g@x.in", "role": "government"}, {"id": "head", "email": "h@x.in"}])
+    sb.seed("incidents", [{"user_id": "gov", "location": "Pune", "pincode": "411001", "description": "flood"}])
+    sb.seed("requests", [{"admin_id": "gov", "incident_id": 1}])
+    sb.seed("emergency_units", [{"head_id": "head", "unit_name": "Alpha", "unit_category": "Rescue"}])
+    monkeypatch.setattr(app_module, "supabase", sb)
+    with client.session_transaction() as sess:
+        sess.update({"user": "g@x.in", "user_id": "gov", "user_role": "government"})
+
+    client.post("/assign_emergency_team", data={"request_id": "1", "unit_id": "1"})
+    # unit lookup, request lookup, every dispatch write in one apply_unit_of_work call, then the best-effort notification
+    assert sb.round_trips == 4 and sb.calls[("rpc", "apply_unit_of_work")] == 1
+    assert sb.rows("emergency_units")[0]["status"] == "Busy"
+    assert sb.rows("requests")[0]["status"] == "assigned"
+    assert len(sb.rows("emergency_assignments")) == 1 and len(sb.rows("emergency_notifications")) == 1
+
+
+# ---- SUPABASE CLIENT TESTS ----
+def test_supabase_client_is_lazy_and_recreated_after_fork(monkeypatch):
+    import utils.supabase_client as sb
+    from config import Config
+
+    monkeypatch.setattr(Config, "SUPABASE_URL", "")
+    assert sb.supabase_or_none() is None and sb.get_supabase() is None
+
+    created = []
+    monkeypatch.setattr(Config, "SUPABASE_URL", "https://example.supabase.co")
+    monkeypatch.setattr(Config, "SUPABASE_KEY", "key")
+    monkeypatch.setattr(sb, "_client", None)
+    monkeypatch.setattr(sb, "_create_client", lambda: created.append(1) or type("Client", (), {"table": lambda self, name: name})())
+
+    proxy = sb.supabase_or_none()
+    assert created == []
+    assert proxy.table("users") == "users" and sb.get_supabase() is sb.get_supabase()
+    assert len(created) == 1
+
+    # A client inherited from a parent process is never reused
+    monkeypatch.setattr(sb, "_client_pid", -1)
+    sb.get_supabase()
+    assert len(created) == 2 and sb.pool_stats()["clients_created"] >= 2
+
+
+def test_auth_gets_its_own_client_per_call(monkeypatch):
+    import supabase
+    import utils.supabase_client as sb
+    from config import Config
+
+    monkeypatch.setattr(Config, "SUPABASE_URL", "https://example.supabase.co")
+    monkeypatch.setattr(Config, "SUPABASE_KEY", "key")
+    made = []
+    monkeypatch.setattr(supabase, "create_client", lambda url, key, options=None: made.append(options) or object())
+    monkeypatch.setattr(sb, "get_supabase", lambda: pytest.fail("auth must not use the shared client"))
+
+    first, second = sb.get_auth_client(), sb.get_auth_client()
+    assert first is not second and len(made) == 2
+    assert not made[0].persist_session and not made[0].auto_refresh_token
+    # Separate clients, one pooled transport per process
+    assert made[0].httpx_client is not made[1].httpx_client
+    assert made[0].httpx_client._transport is made[1].httpx_client._transport
+
+
+# ---- NOTIFICATION ENGINE TESTS ----
+def test_notification_engine_routes_to_cheapest_channel_meeting_target(monkeypatch):
+    from services.notification_engine import Channel, NotificationEngine, make_alert
+
+    monkeypatch.setattr("utils.dedupe.get_redis", lambda: None)
+
+    class FakeChannel(Channel):
+        def __init__(self, name, cost, latency, field, batch_size=2):
+            self.name, self.cost, self.latency, self.field, self.batch_size = name, cost, latency, field, batch_size
+            self.sent = []
+
+        def reaches(self, user):
+            return bool(user.get(self.field))
+
+        def send(self, recipients, alert):
+            self.sent.extend(u["id"] for u in recipients)
+            return self._result(len(recipients), [])
+
+    push = FakeChannel("push", 0.01, 5, "push")
+    email = FakeChannel("email", 0.1, 120, "email")
+    sms = FakeChannel("sms", 1.0, 15, "phone")
+    queued = []
+    engine = NotificationEngine([push, email, sms], enqueue=lambda channel, batch, alert: queued.append((channel.name, len(batch))))
+
+    users = [
+        {"id": "a", "push": True, "email": "a@x.in", "phone": "9000000001"},
+        {"id": "b", "email": "b@x.in", "phone": "9000000002"},
+        {"id": "c", "email": "c@x.in"},
+        {"id": "d"},
+    ]
+    routed = engine.route([dict(u) for u in users], make_alert("k1", "Flood", "Move to higher ground", severity="high"))
+    # Email is cheaper than SMS but too slow for a high alert, unless it is all the user has
+    assert {name: [u["id"] for u in batch] for name, batch in routed.items()} == {"push": ["a"], "sms": ["b"], "email": ["c"]}
+
+    low = make_alert("k2", "Heat advisory", "Stay hydrated", severity="low")
+    assert engine.fan_out(iter(users), low) == {"push": 1, "email": 2}
+    assert queued == [("push", 1), ("email", 2)]
+
+    engine.enqueue = None
+    engine.fan_out(iter(users), low)
+    engine.fan_out(iter(users), low)
+    assert push.sent == ["a"] and email.sent == ["b", "c"]
+
+
+def test_inapp_inbox_never_replaces_sms_or_push(monkeypatch):
+    from services.notification_engine import InAppChannel, RoutingPolicy, SMSChannel
+    import utils.presence as presence
+
+    monkeypatch.setattr(presence, "get_redis", lambda: None)
+    monkeypatch.setattr(presence, "_local", presence.TTLCache(ttl=3600, max_entries=2))
+    for uid in ("a", "b", "c"):
+        presence.mark_active(uid)
+    # The fallback presence map is bounded: the oldest user has been evicted
+    assert presence.active_users(["a", "b", "c"]) == {"b", "c"}
+
+    inapp = InAppChannel(repo=object())
+    sms = SMSChannel(type("SMS", (), {"sms_enabled": True})())
+    users = [{"id": "b", "phone": "9000000002"}, {"id": "c"}]
+    inapp.annotate(users)
+    policy = RoutingPolicy()
+    # An active user still gets the SMS, with the inbox copy on top; in-app alone only when nothing else reaches them
+    assert [c.name for c in policy.choose(users[0], [inapp, sms], "high")] == ["sms", "inapp"]
+    assert [c.name for c in policy.choose(users[1], [inapp, sms], "high")] == ["inapp"]
+
+
+def test_notification_api_requires_signin(client):
+    assert client.get("/api/notifications").status_code == 401
+    assert client.post("/api/push/subscribe", json={}).status_code == 401
+
+
+def test_push_and_email_channels_do_not_send_without_a_rate_token(monkeypatch):
+    import sys
+    import types
+    from services import notification_engine
+    from services.notification_engine import EmailChannel, WebPushChannel, make_alert
+
+    deny = type("DenyingLimiter", (), {"acquire": lambda self, key, timeout=None: False})()
+    sends = []
+    fake_webpush = types.SimpleNamespace(WebPushException=Exception, webpush=lambda *a, **k: sends.append("push"))
+    monkeypatch.setitem(sys.modules, "pywebpush", fake_webpush)
+
+    class FakeSMTP:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def starttls(self):
+            pass
+
+        def login(self, user, password):
+            pass
+
+        def send_message(self, msg):
+            sends.append("email")
+
+    monkeypatch.setattr(notification_engine.smtplib, "SMTP", FakeSMTP)
+    alert = make_alert("flood", "Flood warning", "Move to higher ground", "high")
+    repo = type("Repo", (), {"delete_push_subscriptions": lambda self, endpoints: None})()
+
+    pushed = WebPushChannel(repo, limiter=deny).send([{"id": "a", "push": [{"endpoint": "e"}]}, {"id": "b", "push": [{"endpoint": "f"}]}], alert)
+    emailed = EmailChannel(limiter=deny).send([{"id": "a", "email": "a@x.in"}], alert)
+    assert sends == []
+    assert [u["id"] for u in pushed["failed_recipients"]] == ["a", "b"] and pushed["sent"] == 0
+    assert [u["id"] for u in emailed["failed_recipients"]] == ["a"] and emailed["sent"] == 0
+
+
+# ---- RATE LIMITER TESTS ----
+def test_token_bucket_falls_back_to_local_bucket(monkeypatch):
+    import utils.rate_limiter as rate_limiter
+
+    monkeypatch.setattr(rate_limiter, "get_redis", lambda: None)
+    limiter = rate_limiter.TokenBucketLimiter(rate=50, burst=2)
+
+    assert limiter.try_acquire("textbelt") == 0
+    assert limiter.try_acquire("textbelt") == 0
+    wait = limiter.try_acquire("textbelt")
+    assert 0 < wait <= 0.02
+    assert limiter.try_acquire("other-provider") == 0
+    assert limiter.acquire("textbelt", timeout=1) is True
+
+
+# ---- STARTUP TESTS ----
+def test_app_import_defers_route_specific_dependencies():
+    import subprocess
+    import sys
+
+    probe = ("import sys, app; "
+             "print('loaded:', [m for m in ('numpy', 'qrcode', 'overpy', 'celery', 'tasks') if m in sys.modules])")
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+    assert "loaded: []" in out.stdout
+
+
+# ---- LOAD TEST TESTS ----
+def test_load_test_compare_flags_p95_and_backend_call_regressions(capsys):
+    from benchmarks.load_test import compare
+
+    route = {"p95_ms": 100.0, "p99_ms": 150.0, "backend_calls_mean": 4.0, "throughput_rps": 20.0}
+    baseline = {"routes": {"GET /emergency_dashboard": route, "GET /dashboard": route}}
+    current = {"routes": {"GET /emergency_dashboard": dict(route, backend_calls_mean=48.0),
+                          "GET /dashboard": dict(route, p95_ms=105.0)}}
+    assert compare(baseline, current, threshold=0.10) == ["GET /emergency_dashboard backend_calls_mean 4 -> 48"]
+    assert "GET /dashboard" in capsys.readouterr().out
+
+
+# ---- REQUEST BUDGET TESTS ----
+def test_request_budget_headers_and_over_budget_logging(caplog):
+    from flask import Flask
+    from utils import request_budget
+
+    flask_app = Flask(__name__)
+    request_budget.init_app(flask_app, max_calls=3, max_ms=1000, repeat_threshold=3)
+
+    @flask_app.route("/n-plus-one")
+    def n_plus_one():
+        for _ in range(4):
+            request_budget.record("select", "emergency_updates", 0.002)
+        return "ok"
+
+    assert request_budget.describe_rest_call("GET", "/rest/v1/incidents") == ("select", "incidents")
+    assert request_budget.describe_rest_call("POST", "/rest/v1/users", "resolution=merge-duplicates") == ("upsert", "users")
+    assert request_budget.describe_rest_call("POST", "/rest/v1/rpc/apply_unit_of_work") == ("rpc", "apply_unit_of_work")
+
+    with caplog.at_level("WARNING", logger="app"):
+        resp = flask_app.test_client().get("/n-plus-one")
+    assert resp.headers["X-Backend-Calls"] == "4"
+    assert resp.headers["Server-Timing"].startswith("supabase;dur=8.0")
+    assert "Backend budget exceeded on GET /n-plus-one: 4 calls" in caplog.text
+    assert "Possible N+1 on GET /n-plus-one: select emergency_updates issued 4 times" in caplog.text
+    assert request_budget.current() is None
+
+
+def test_assert_constant_calls_flags_growing_query_count():
+    from utils import request_budget
+
+    def n_plus_one(n):
+        for _ in range(n):
+            request_budget.record("select", "emergency_updates", 0.0)
+
+    with pytest.raises(AssertionError, match="select emergency_updates: 2 -> 20"):
+        request_budget.assert_constant_calls(n_plus_one)
+    request_budget.assert_constant_calls(lambda n: request_budget.record("select", "emergency_updates", 0.0))
+
+
+def _seed_dispatch_data(sb, n):
+    sb.seed("users", [{"id": "gov", "email": "g@x.in", "role": "government"},
+                      {"id": "head", "email": "h@x.in", "role": "emergency"}])
+    sb.seed("incidents", [{"user_id": "gov", "location": "Pune", "pincode": "411001", "description": "flood"}])
+    sb.seed("requests", [{"admin_id": "gov", "incident_id": 1}])
+    sb.seed("emergency_units", [{"head_id": "head", "unit_name": f"Unit {i}", "unit_category": "Rescue"} for i in range(n)])
+    sb.seed("emergency_assignments", [{"request_id": 1, "team_lead_id": "head", "team_name": f"Unit {i}",
+                                       "status": "Completed" if i % 2 else "Assigned"} for i in range(n)])
+    sb.seed("emergency_updates", [{"assignment_id": i % n + 1, "team_lead_id": "head", "rescued_count": 2}
+                                  for i in range(3 * n)])
+
+
+def test_assignment_updates_are_paged_past_the_row_cap(monkeypatch):
+    import app as app_module
+    from utils.inmemory_supabase import InMemorySupabase
+
+    sb = InMemorySupabase()
+    _seed_dispatch_data(sb, 3)
+    monkeypatch.setattr(app_module, "supabase", sb)
+    sb.reset_stats()
+    updates = list(app_module.iter_assignment_updates([1, 2, 3], page_size=4))
+    assert len(updates) == 9 and sum(u["rescued_count"] for u in updates) == 18
+    assert sb.calls[("select", "emergency_updates")] == 3
+
+
+def test_emergency_dashboard_and_assign_more_teams_query_count_is_flat(client, monkeypatch):
+    import app as app_module
+    from utils import request_budget
+    from utils.inmemory_supabase import InMemorySupabase
+
+    def serve(role, request):
+        def run(n):
+            sb = InMemorySupabase()
+            _seed_dispatch_data(sb, n)
+            monkeypatch.setattr(app_module, "supabase", sb)
+            with client.session_transaction() as sess:
+                sess.update({"user": f"{role}@x.in", "user_id": "head" if role == "emergency" else "gov", "user_role": role})
+            assert request(n).status_code in (200, 302)
+            return sb
+        return run
+
+    ledgers = request_budget.assert_constant_calls(serve("emergency", lambda n: client.get("/emergency_dashboard")))
+    assert ledgers[20].total_calls == 4
+
+    more_teams = serve("government", lambda n: client.post("/assign_more_teams", data={
+        "assignment_id": "1", "unit_ids": [str(i) for i in range(1, n + 1)]}))
+    ledgers = request_budget.assert_constant_calls(more_teams)
+    assert ledgers[20].calls[("rpc", "apply_unit_of_work")] == 1
+    sb = more_teams(3)
+    notifications = sb.rows("emergency_notifications")
+    assert len(sb.rows("emergency_assignments")) == 6 and len(notifications) == 3
+    assert all(n["gov_id"] == "gov" and "message" not in n for n in notifications)
+
+
+# ---- METRICS TESTS ----
+def test_metrics_endpoint_exposes_requests_tasks_outbound_and_caches(client, monkeypatch):
+    import app as app_module
+    from celery_config import celery
+    from config import Config
+    from utils import metrics
+    from utils.cache import TTLCache
+
+    monkeypatch.setattr(metrics, "get_redis", lambda: None)
+    monkeypatch.setattr(Config, "METRICS_ALLOWED_IPS", ["127.0.0.1"])
+    client.get("/")
+    metrics.celery_task_duration.observe(("tasks.send_sms_batch", "SUCCESS"), 0.4)
+    with pytest.raises(ConnectionError):
+        with metrics.outbound_call("textbelt.com"):
+            raise ConnectionError("reset")
+    cache = TTLCache(ttl=60)
+    cache.set("tile", [])
+    cache.get("tile"), cache.get("other")
+    monkeypatch.setitem(app_module.APP_STATE, "shelter_service", type("Shelters", (), {"cache": cache})())
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{method="GET",route="/",status="2xx"}' in body
+    assert 'celery_task_duration_seconds_bucket{task="tasks.send_sms_batch",state="SUCCESS",le="0.5"}' in body
+    assert 'outbound_request_duration_seconds_count{host="textbelt.com"}' in body
+    assert 'outbound_request_errors_total{host="textbelt.com"}' in body
+    assert 'cache_hit_ratio{cache="shelter_tiles"} 0.5' in body
+    assert "# TYPE celery_queue_depth gauge" in body
+
+    # Every routed queue is watched
+    assert {route["queue"] for route in celery.conf.task_routes.values()} <= set(metrics.CELERY_QUEUES)
+
+    # Closed by default: only a listed address, the bearer token or an explicit opt-out opens it
+    monkeypatch.setattr(Config, "METRICS_ALLOWED_IPS", [])
+    assert client.get("/metrics").status_code == 401
+    monkeypatch.setattr(Config, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
+    monkeypatch.setattr(Config, "METRICS_TOKEN", "")
+    monkeypatch.setattr(Config, "METRICS_PUBLIC", True)
+    assert client.get("/metrics").status_code == 200
+
+
+def test_metrics_are_recorded_in_process_and_flushed_to_redis_in_one_pipeline(monkeypatch):
+    from utils import metrics
+
+    class FakePipeline:
+        def __init__(self, log):
+            self.log = log
+
+        def __getattr__(self, command):
+            return lambda *args: self.log.append((command,) + args)
+
+        def execute(self):
+            self.log.append(("execute",))
+
+    log = []
+    redis = type("FakeRedis", (), {"pipeline": lambda self, transaction=True: FakePipeline(log)})()
+    histogram = metrics.LatencyHistogram("test_flush_latency", buckets=(1,), labelnames=("host",))
+    counter = metrics.LabelledCounter("test_flush_errors", labelnames=("host",))
+    monkeypatch.setattr(metrics, "_registry", [histogram, counter])
+
+    # Recording never touches Redis
+    monkeypatch.setattr(metrics, "get_redis", lambda: (_ for _ in ()).throw(AssertionError("Redis on the hot path")))
+    histogram.observe("textbelt.com", 0.2)
+    histogram.observe("textbelt.com", 0.3)
+    counter.inc("textbelt.com")
+
+    monkeypatch.setattr(metrics, "get_redis", lambda: redis)
+    metrics.flush()
+    assert log.count(("execute",)) == 1
+    assert ("hincrby", "metrics:test_flush_latency:textbelt.com", "count", 2) in log
+    assert ("hincrbyfloat", "metrics:test_flush_errors", "textbelt.com", 1) in log
+    log.clear()
+    metrics.flush()
+    assert log == []
@@ -1,14 +1,11 @@
 """
 UPI Payment Service for Direct Money Transfer
 """
-import qrcode
 import io
 import base64
-import time
 from config import Config
-from supabase import create_client, Client
+from utils.supabase_client import supabase_or_none
 import logging
-import json
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -21,7 +18,7 @@ class UPIPaymentService:
         
         # Initialize Supabase client
         if Config.is_supabase_configured():
-            self.supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+            self.supabase = supabase_or_none()
             logger.info("Supabase client initialized for UPI payment logging")
         else:
             logger.warning("Supabase not configured. UPI payment logs will not be saved.")
@@ -34,7 +31,8 @@ class UPIPaymentService:
             # Create UPI payment URL
             upi_url = self._create_upi_url(amount, purpose)
             
-            # Generate QR code
+            # Generate QR code (qrcode/PIL are imported here, only when a QR is actually made)
+            import qrcode
             qr = qrcode.QRCode(
                 version=1,
                 error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -0,0 +1,36 @@
+import time
+from typing import Optional
+
+from utils.logger import get_logger
+
+
+def delete_in_batches(client, table: str, column: str, cutoff: str, batch_size: int = 1000,
+                      max_batches: Optional[int] = None, pause: float = 0.05, key: str = 'id') -> int:
+    """Delete rows with ``column < cutoff`` a bounded batch at a time; returns the number deleted.
+
+    Each round selects up to ``batch_size`` keys (oldest first, via the index
+    on ``column``) and deletes the expired rows between the smallest and
+    largest of them, so every statement is short and only locks the rows it
+    removes; concurrent inserts are never blocked behind one huge delete. The
+    delete names a key range rather than every key, keeping the URL a fixed
+    size however large the batch. ``pause`` seconds between rounds leave room for
+    other writers, and ``max_batches`` caps one run (the rest is picked up by
+    the next). Progress is logged as it goes.
+    """
+    logger = get_logger()
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        resp = client.table(table).select(key).lt(column, cutoff).order(column).limit(batch_size).execute()
+        keys = [row[key] for row in (resp.data or [])] if resp else []
+        if not keys:
+            break
+        removed = client.table(table).delete().lt(column, cutoff).gte(key, min(keys)).lte(key, max(keys)).execute()
+        deleted += len(removed.data) if removed and removed.data is not None else len(keys)
+        batches += 1
+        logger.info(f"{table} cleanup: deleted {deleted} rows older than {cutoff} ({batches} batches)")
+        if len(keys) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
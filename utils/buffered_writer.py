@@ -0,0 +1,174 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+from utils.logger import get_logger
+
+
+class BufferedInsertWriter:
+    """Accumulates rows in memory and writes them to one table as multi-row inserts.
+
+    A background thread flushes whenever ``max_batch`` rows are pending or
+    ``flush_interval`` seconds have passed since the last flush. When the
+    insert fails for the batch as a whole (unreachable database, timeout, or a
+    schema problem such as a missing column or table), its rows are put back
+    for the next attempt, retried with exponential backoff up to
+    ``max_backoff`` seconds, and held up to ``max_pending``; beyond that the
+    oldest rows are dropped (and counted) rather than letting memory grow.
+    When the database rejects rows for their data (SQLSTATE class 22, data
+    exception, or 23, e.g. a foreign key violation), the batch is split in
+    halves until the offending rows are isolated; the rest is written, and each rejected row goes to the
+    back of the buffer and is dropped (logged as dead) after
+    ``max_row_attempts`` rejections, so one bad row never blocks the others.
+    Pending rows are flushed at interpreter exit, and callers can
+    :meth:`flush` explicitly (e.g. on Celery worker shutdown).
+    """
+
+    def __init__(self, client_getter, table: str, max_batch: int = 500, flush_interval: float = 2.0,
+                 max_pending: int = 50000, max_row_attempts: int = 3, max_backoff: float = 60.0):
+        self.client_getter = client_getter
+        self.table = table
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_row_attempts = max_row_attempts
+        self.max_backoff = max_backoff
+        self.logger = get_logger()
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self._rows = deque()
+        # id(row) -> times the database rejected it, for rows waiting in the buffer
+        self._rejections = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self._flush_at_exit)
+
+    def depth(self) -> int:
+        """Rows waiting to be written."""
+        return len(self._rows)
+
+    def _ensure_thread(self):
+        # Forked workers (Celery prefork) inherit the object but not the thread
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f"{self.table}-writer", daemon=True)
+            self._thread.start()
+
+    def add(self, row: dict):
+        self.add_many([row])
+
+    def add_many(self, rows: list):
+        if not rows:
+            return
+        with self._cond:
+            self._rows.extend(rows)
+            overflow = len(self._rows) - self.max_pending
+            for _ in range(max(overflow, 0)):
+                self._rejections.pop(id(self._rows.popleft()), None)
+                self.dropped += 1
+            self._ensure_thread()
+            if len(self._rows) >= self.max_batch:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._rows) < self.max_batch:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                backoff = min(self.flush_interval * 2 ** (self.failures - 1), self.max_backoff)
+                self.logger.error(f"{self.table} writer flush failed ({self.failures} in a row), "
+                                  f"retrying in {backoff:.0f}s: {e}")
+                time.sleep(backoff)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error(f"{self.table} writer lost {self.depth()} rows at exit: {e}")
+
+    def flush(self) -> int:
+        """Write everything pending now; returns the number of rows written."""
+        written = 0
+        client = self.client_getter()
+        if client is None:
+            # Nowhere to write (e.g. Supabase not configured); drop rather than accumulate
+            with self._cond:
+                self.dropped += len(self._rows)
+                self._rows.clear()
+                self._rejections.clear()
+            return 0
+        rejected = []
+        with self._flush_lock:
+            try:
+                while True:
+                    with self._cond:
+                        if not self._rows:
+                            return written
+                        batch = [self._rows.popleft() for _ in range(min(self.max_batch, len(self._rows)))]
+                    try:
+                        count, bad = self._insert(client, batch)
+                    except _Unwritten as e:
+                        with self._cond:
+                            self._rows.extendleft(reversed(e.rows))
+                        raise e.__cause__
+                    written += count
+                    self.flushed += count
+                    rejected += bad
+            finally:
+                self._requeue_rejected(rejected)
+
+    def _insert(self, client, batch: list) -> tuple[int, list]:
+        """Insert ``batch``, bisecting on rejection; returns (rows written, [(rejected row, error)])."""
+        try:
+            client.table(self.table).insert(batch).execute()
+        except Exception as e:
+            if not _is_row_error(e):
+                # Unreachable, timed out or a schema/deploy error: no row is at fault, keep them all
+                raise _Unwritten(batch) from e
+            if len(batch) == 1:
+                return 0, [(batch[0], e)]
+            mid = len(batch) // 2
+            try:
+                first, bad = self._insert(client, batch[:mid])
+            except _Unwritten as unwritten:
+                raise _Unwritten(unwritten.rows + batch[mid:]) from unwritten.__cause__
+            second, more_bad = self._insert(client, batch[mid:])
+            return first + second, bad + more_bad
+        for row in batch:
+            self._rejections.pop(id(row), None)
+        return len(batch), []
+
+    def _requeue_rejected(self, rejected: list):
+        with self._cond:
+            for row, err in rejected:
+                attempts = self._rejections.pop(id(row), 0) + 1
+                if attempts >= self.max_row_attempts:
+                    self.dropped += 1
+                    self.logger.error(f"{self.table} writer dropped a row rejected {attempts} times: {err}; row={row}")
+                else:
+                    self._rejections[id(row)] = attempts
+                    self._rows.append(row)
+
+
+def _is_row_error(err: Exception) -> bool:
+    """Whether the database rejected the data itself: SQLSTATE 22xxx (data exception) or 23xxx (constraint)."""
+    code = str(getattr(err, 'code', None) or '')
+    return len(code) == 5 and code[:2] in ('22', '23')
+
+
+class _Unwritten(Exception):
+    """Rows not written because the insert failed for the whole batch (the cause is chained)."""
+
+    def __init__(self, rows: list):
+        super().__init__(f"{len(rows)} rows not written")
+        self.rows = rows
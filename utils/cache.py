@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < time.monotonic():
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class _Call:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent loads of the same key into one upstream call.
+
+    ``do(key, fn)`` runs ``fn`` once for all callers arriving while it is in
+    flight. ``claim``/``resolve``/``fail``/``wait`` expose the same mechanism for
+    callers that batch several keys into a single upstream request.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys) -> tuple[list, dict]:
+        """Split ``keys`` into those this caller now owns and the calls already in flight.
+
+        Owned keys must be settled with :meth:`resolve` or :meth:`fail`; in-flight
+        ones are returned as ``{key: call}`` to pass to :meth:`wait`.
+        """
+        owned, waiting = [], {}
+        with self._lock:
+            for key in keys:
+                call = self._calls.get(key)
+                if call is not None:
+                    waiting[key] = call
+                else:
+                    self._calls[key] = _Call()
+                    owned.append(key)
+        return owned, waiting
+
+    def resolve(self, key, value):
+        with self._lock:
+            call = self._calls.pop(key, None)
+        if call:
+            call.value = value
+            call.event.set()
+
+    def fail(self, key, error: Exception):
+        with self._lock:
+            call = self._calls.pop(key, None)
+        if call:
+            call.error = error
+            call.event.set()
+
+    @staticmethod
+    def wait(call, timeout: float = None):
+        """Block until another caller settles ``call``; re-raises its error."""
+        if not call.event.wait(timeout):
+            raise TimeoutError("Timed out waiting for an in-flight load")
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def do(self, key, fn, timeout: float = None):
+        owned, waiting = self.claim([key])
+        if not owned:
+            return self.wait(waiting[key], timeout)
+        try:
+            value = fn()
+        except Exception as err:
+            self.fail(key, err)
+            raise
+        self.resolve(key, value)
+        return value
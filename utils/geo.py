@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Great-circle distance in km from one point to arrays of points."""
+    lat1 = math.radians(lat)
+    lon1 = math.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def to_float(value):
+    """Coerce a DECIMAL/str/None coordinate to float, or None when missing or invalid."""
+    if value is None or value == '':
+        return None
+    try:
+        f = float(value)
+    except (TypeError, ValueError):
+        return None
+    return f if math.isfinite(f) else None
+
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_GEOHASH_INDEX = {c: i for i, c in enumerate(_GEOHASH_BASE32)}
+
+
+def _geohash_steps(precision: int):
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits), lat_bits, lon_bits
+
+
+def geohash_encode(lat: float, lon: float, precision: int = 5) -> str:
+    """Standard base32 geohash of a point."""
+    dlat, dlon, lat_bits, lon_bits = _geohash_steps(precision)
+    i = min(int((lat + 90.0) / dlat), (1 << lat_bits) - 1)
+    j = min(int((lon + 180.0) / dlon), (1 << lon_bits) - 1)
+    return _geohash_from_indices(i, j, precision)
+
+
+def _geohash_from_indices(i: int, j: int, precision: int) -> str:
+    bits = precision * 5
+    value = 0
+    lat_bit = bits // 2 - 1
+    lon_bit = (bits + 1) // 2 - 1
+    # Geohash interleaves bits starting with longitude
+    for n in range(bits):
+        if n % 2 == 0:
+            value = (value << 1) | ((j >> lon_bit) & 1)
+            lon_bit -= 1
+        else:
+            value = (value << 1) | ((i >> lat_bit) & 1)
+            lat_bit -= 1
+    return ''.join(_GEOHASH_BASE32[(value >> (5 * k)) & 31] for k in range(precision - 1, -1, -1))
+
+
+def geohash_bbox(geohash: str) -> tuple[float, float, float, float]:
+    """(south, west, north, east) bounds of a geohash cell."""
+    precision = len(geohash)
+    value = 0
+    for c in geohash:
+        value = (value << 5) | _GEOHASH_INDEX[c]
+    i = j = 0
+    for n in range(precision * 5):
+        bit = (value >> (precision * 5 - 1 - n)) & 1
+        if n % 2 == 0:
+            j = (j << 1) | bit
+        else:
+            i = (i << 1) | bit
+    dlat, dlon, _, _ = _geohash_steps(precision)
+    south, west = i * dlat - 90.0, j * dlon - 180.0
+    return south, west, south + dlat, west + dlon
+
+
+def geohash_cover(lat: float, lon: float, radius_km: float, precision: int = 5) -> list[str]:
+    """Geohash cells overlapping the bounding box of a circle around the point."""
+    dlat, dlon, lat_bits, lon_bits = _geohash_steps(precision)
+    rlat = radius_km / 111.0
+    rlon = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+    i0 = max(int((lat - rlat + 90.0) / dlat), 0)
+    i1 = min(int((lat + rlat + 90.0) / dlat), (1 << lat_bits) - 1)
+    j0 = int(math.floor((lon - rlon + 180.0) / dlon))
+    j1 = int(math.floor((lon + rlon + 180.0) / dlon))
+    cells = []
+    for i in range(i0, i1 + 1):
+        for j in range(j0, j1 + 1):
+            cells.append(_geohash_from_indices(i, j % (1 << lon_bits), precision))
+    return cells
+
+
+class GridIndex:
+    """Static nearest-neighbour index over points, bucketed into ``cell_deg`` grid cells.
+
+    Points are sorted by cell once at build time so each cell is a contiguous
+    slice of the coordinate arrays. k-nearest queries scan rings of cells
+    outward from the query point and stop as soon as the next ring cannot hold
+    anything closer than the current k-th result.
+    """
+
+    def __init__(self, lats, lons, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        ci = np.floor(lats / cell_deg).astype(np.int64)
+        cj = np.floor(lons / cell_deg).astype(np.int64)
+        order = np.lexsort((cj, ci))
+        self.ids = order
+        self.lats, self.lons = lats[order], lons[order]
+        ci, cj = ci[order], cj[order]
+        self._cells = {}
+        if order.size:
+            change = np.flatnonzero((np.diff(ci) != 0) | (np.diff(cj) != 0)) + 1
+            starts = np.concatenate([[0], change])
+            ends = np.concatenate([change, [order.size]])
+            for s, e in zip(starts.tolist(), ends.tolist()):
+                self._cells[(int(ci[s]), int(cj[s]))] = (s, e)
+
+    def __len__(self):
+        return int(self.ids.size)
+
+    def _ring(self, i0: int, j0: int, r: int):
+        if r == 0:
+            yield i0, j0
+            return
+        for j in range(j0 - r, j0 + r + 1):
+            yield i0 - r, j
+            yield i0 + r, j
+        for i in range(i0 - r + 1, i0 + r):
+            yield i, j0 - r
+            yield i, j0 + r
+
+    def nearest(self, lat: float, lon: float, k: int = 10, max_km: float = None) -> tuple[np.ndarray, np.ndarray]:
+        """Indices (into the build arrays) and distances of the k nearest points, nearest first."""
+        if not self._cells:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        i0, j0 = math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+        # A ring r cells out is at least this far away, in km
+        lat_step = 111.0 * self.cell_deg
+        lon_step = 111.0 * self.cell_deg * max(math.cos(math.radians(min(abs(lat) + self.cell_deg * 2, 89.9))), 0.01)
+        min_step = min(lat_step, lon_step)
+        max_rings = int(max_km / min_step) + 2 if max_km else 180 * int(1 / self.cell_deg)
+        slices = []
+        found = 0
+        best_k = np.inf
+        for r in range(max_rings + 1):
+            if (r - 1) * min_step > best_k:
+                break
+            for cell in self._ring(i0, j0, r):
+                span = self._cells.get(cell)
+                if span:
+                    slices.append(np.arange(*span))
+                    found += span[1] - span[0]
+            if found >= k and slices:
+                pos = np.concatenate(slices)
+                dist = haversine_km(lat, lon, self.lats[pos], self.lons[pos])
+                best_k = np.partition(dist, k - 1)[k - 1]
+            if found >= len(self):
+                break
+        if not slices:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        pos = np.concatenate(slices)
+        dist = haversine_km(lat, lon, self.lats[pos], self.lons[pos])
+        if max_km is not None:
+            keep = dist <= max_km
+            pos, dist = pos[keep], dist[keep]
+        if pos.size > k:
+            top = np.argpartition(dist, k - 1)[:k]
+            pos, dist = pos[top], dist[top]
+        order = np.argsort(dist, kind='stable')
+        return self.ids[pos[order]], dist[order]
@@ -0,0 +1,595 @@
+"""
+In-memory stand-in for the Supabase client, for offline tests and benchmarks
+
+Implements the subset of the PostgREST query chain this codebase uses:
+``table().select(columns, count=...)`` with embedded resources
+(``"*, requests(incident_id, incidents(*))"``, ``"weather_data!<fkey>(*)"``),
+the ``eq/neq/gt/gte/lt/lte/in_/is_/like/ilike`` filters and ``not_``,
+``order``, ``limit``, ``range``, ``insert``, ``upsert`` (``on_conflict``,
+``ignore_duplicates``), ``update``, ``delete`` and ``execute``, plus ``rpc``
+(with ``apply_unit_of_work`` built in) and enough of ``auth`` to sign users
+up and in.
+
+Every ``execute()`` counts as one round trip and can be made to cost a fixed
+or computed latency, so round-trip-bound code paths can be measured locally:
+
+    client = InMemorySupabase(latency=0.02)      # 20 ms per call
+    client.seed('users', [{'id': 'u1', 'phone': '+919000000001'}])
+    ...
+    client.round_trips, client.calls              # totals and per (method, table)
+
+Embedding follows the foreign keys of complete_database_schema_fixed.sql
+(``FOREIGN_KEYS``); ``UNIQUE_COLUMNS`` and ``DEFAULTS`` mirror its unique
+constraints and column defaults.
+Set ``SUPABASE_URL=memory://`` to have utils.supabase_client hand this
+client to the whole app.
+"""
+import copy
+import functools
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Optional, Union
+
+from utils import request_budget
+
+
+# table -> {foreign key column: referenced table (always on its id)}
+FOREIGN_KEYS = {
+    'incidents': {'user_id': 'users'},
+    'donations': {'user_id': 'users'},
+    'sms_notifications': {'user_id': 'users', 'incident_id': 'incidents'},
+    'weather_alerts_sent': {'weather_id': 'weather_data'},
+    'announcements': {'admin_id': 'users', 'weather_data_id': 'weather_data'},
+    'requests': {'admin_id': 'users', 'incident_id': 'incidents'},
+    'team_allocations': {'gov_id': 'users', 'request_id': 'requests'},
+    'emergency_assignments': {'request_id': 'requests', 'team_lead_id': 'users', 'unit_id': 'emergency_units'},
+    'emergency_updates': {'assignment_id': 'emergency_assignments', 'author_id': 'users'},
+    'emergency_units': {'head_id': 'users'},
+    'emergency_notifications': {'request_id': 'requests', 'gov_id': 'users', 'head_id': 'users'},
+    'medical_requests': {'user_id': 'users'},
+    'resources': {'gov_id': 'users', 'shelter_id': 'shelters'},
+    'notification_inbox': {'user_id': 'users', 'incident_id': 'incidents'},
+    'push_subscriptions': {'user_id': 'users'},
+}
+
+# table -> unique column sets (the primary key id is always unique)
+UNIQUE_COLUMNS = {
+    'users': [('email',)],
+    'weather_alerts_sent': [('weather_id',)],
+    'push_subscriptions': [('endpoint',)],
+    'shelters': [('osm_id',)],
+    'incident_clusters': [('pincode', 'lane')],
+    'incident_signatures': [('incident_id',)],
+}
+
+# Column defaults from the schema; NOW marks DEFAULT NOW()
+NOW = object()
+DEFAULTS = {
+    'users': {'role': 'user', 'is_emergency_head': False, 'created_at': NOW, 'updated_at': NOW},
+    'incidents': {'severity': 'medium', 'status': 'pending', 'timestamp': NOW},
+    'donations': {'status': 'pending', 'created_at': NOW, 'updated_at': NOW},
+    'sms_notifications': {'created_at': NOW, 'updated_at': NOW},
+    'weather_data': {'is_extreme': False, 'fetched_at': NOW},
+    'weather_alerts_sent': {'sent_at': NOW},
+    'shelters': {'available': 0, 'created_at': NOW},
+    'announcements': {'severity': 'medium', 'is_weather_alert': False, 'timestamp': NOW},
+    'requests': {'status': 'pending', 'created_at': NOW},
+    'team_allocations': {'assigned_at': NOW},
+    'emergency_assignments': {'status': 'Assigned', 'assigned_at': NOW},
+    'emergency_updates': {'status': 'active', 'created_at': NOW},
+    'emergency_units': {'status': 'Free', 'last_update': NOW},
+    'emergency_notifications': {'status': 'Pending', 'created_at': NOW},
+    'medical_requests': {'status': 'Pending', 'created_at': NOW},
+    'resources': {'food': 0, 'water': 0, 'medicine': 0, 'allocated_at': NOW},
+    'incident_clusters': {'lane': 'pending', 'report_count': 0, 'term_freq': {}, 'recent_descriptions': [], 'version': 0},
+    'incident_signatures': {'created_at': NOW},
+    'incident_duplicate_groups': {'groups': [], 'computed_at': NOW},
+    'notification_inbox': {'created_at': NOW},
+    'push_subscriptions': {'created_at': NOW},
+}
+
+# Tables whose update_*_updated_at trigger sets updated_at = NOW() on every update
+TOUCHED_ON_UPDATE = {'users', 'donations', 'sms_notifications'}
+
+# Tables keyed by a UUID instead of a BIGSERIAL id
+UUID_TABLES = {'users'}
+
+
+class InMemoryAPIError(Exception):
+    """Raised where PostgREST would answer with an error; carries the same ``code``."""
+
+    def __init__(self, message: str, code: Optional[str] = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class Response:
+    def __init__(self, data, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _coerce(current, value):
+    """Compare like PostgREST, which receives every filter value as text and casts it to the column type."""
+    if value is None or current is None or type(current) is type(value):
+        return value
+    try:
+        if isinstance(current, bool):
+            return str(value).lower() in ('true', 't', '1') if isinstance(value, str) else bool(value)
+        if isinstance(current, int):
+            return int(value)
+        if isinstance(current, float):
+            return float(value)
+        if isinstance(current, str):
+            return str(value).lower() if isinstance(value, bool) else str(value)
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+def _like(pattern: str, flags=0):
+    regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+    return re.compile(f'^{regex}$', flags | re.S)
+
+
+def _parse_select(columns: str) -> list:
+    """``"id, requests(incidents(*))"`` -> ['id', ('requests', None, [('incidents', None, ['*'])])]."""
+    items, depth, start = [], 0, 0
+    columns = columns or '*'
+    for i, c in enumerate(columns + ','):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            item = columns[start:i].strip()
+            start = i + 1
+            if not item:
+                continue
+            if '(' in item:
+                head, inner = item.split('(', 1)
+                name, _, hint = head.strip().partition('!')
+                alias, _, name = name.rpartition(':')
+                items.append((name, hint or None, _parse_select(inner[:inner.rindex(')')]), alias or name))
+            else:
+                items.append(item)
+    return items
+
+
+class _Query:
+    def __init__(self, client: 'InMemorySupabase', table: str):
+        self.client = client
+        self.table = table
+        self.method = 'select'
+        self.columns = '*'
+        self.count_mode = None
+        self.payload = None
+        self.on_conflict = 'id'
+        self.ignore_duplicates = False
+        self.filters = []
+        self.equals = []
+        self.orders = []
+        self.limit_n = None
+        self.offset = 0
+        self._negate = False
+
+    # ---- verbs ----
+    def select(self, columns: str = '*', count: Optional[str] = None):
+        self.columns = columns
+        self.count_mode = count
+        return self
+
+    def insert(self, rows: Union[dict, list], **_):
+        self.method, self.payload = 'insert', rows
+        return self
+
+    def upsert(self, rows: Union[dict, list], on_conflict: str = 'id', ignore_duplicates: bool = False, **_):
+        self.method, self.payload = 'upsert', rows
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, values: dict, **_):
+        self.method, self.payload = 'update', values
+        return self
+
+    def delete(self, **_):
+        self.method = 'delete'
+        return self
+
+    # ---- filters ----
+    @property
+    def not_(self):
+        self._negate = not self._negate
+        return self
+
+    def _filter(self, column: str, test: Callable):
+        negate, self._negate = self._negate, False
+        self.filters.append((column, (lambda v: not test(v)) if negate else test))
+        return self
+
+    def _compare(self, column, value, op):
+        def test(current):
+            if current is None:
+                return False
+            other = _coerce(current, value)
+            try:
+                return op(current, other)
+            except TypeError:
+                return False
+        return self._filter(column, test)
+
+    def eq(self, column, value):
+        if not self._negate:
+            self.equals.append((column, value))
+        return self._compare(column, value, lambda a, b: a == b)
+
+    def neq(self, column, value):
+        return self._compare(column, value, lambda a, b: a != b)
+
+    def gt(self, column, value):
+        return self._compare(column, value, lambda a, b: a > b)
+
+    def gte(self, column, value):
+        return self._compare(column, value, lambda a, b: a >= b)
+
+    def lt(self, column, value):
+        return self._compare(column, value, lambda a, b: a < b)
+
+    def lte(self, column, value):
+        return self._compare(column, value, lambda a, b: a <= b)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._filter(column, lambda v: v is not None and any(v == _coerce(v, x) for x in values))
+
+    def is_(self, column, value):
+        if value in (None, 'null'):
+            return self._filter(column, lambda v: v is None)
+        expected = str(value).lower() == 'true'
+        return self._filter(column, lambda v: v is expected)
+
+    def like(self, column, pattern):
+        regex = _like(pattern)
+        return self._filter(column, lambda v: v is not None and bool(regex.match(str(v))))
+
+    def ilike(self, column, pattern):
+        regex = _like(pattern, re.I)
+        return self._filter(column, lambda v: v is not None and bool(regex.match(str(v))))
+
+    # ---- modifiers ----
+    def order(self, column: str, desc: bool = False, nullsfirst: Optional[bool] = None, **_):
+        # Postgres default: NULLS LAST ascending, NULLS FIRST descending
+        self.orders.append((column, desc, desc if nullsfirst is None else nullsfirst))
+        return self
+
+    def limit(self, n: int, **_):
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int, **_):
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def matches(self, row: dict) -> bool:
+        return all(test(row.get(column)) for column, test in self.filters)
+
+    def sort(self, rows: list) -> list:
+        def compare(a, b):
+            for column, desc, nulls_first in self.orders:
+                x, y = a.get(column), b.get(column)
+                if x == y:
+                    continue
+                if x is None:
+                    return -1 if nulls_first else 1
+                if y is None:
+                    return 1 if nulls_first else -1
+                result = -1 if x < y else 1
+                return -result if desc else result
+            return 0
+        return sorted(rows, key=functools.cmp_to_key(compare)) if self.orders else rows
+
+    def execute(self) -> Response:
+        return self.client._execute(self)
+
+
+class _RPC:
+    def __init__(self, client: 'InMemorySupabase', name: str, params: dict):
+        self.client, self.name, self.params = client, name, params or {}
+
+    def execute(self) -> Response:
+        return self.client._call(self.name, self.params)
+
+
+class _User:
+    def __init__(self, user_id: str, email: str, metadata: dict):
+        self.id = user_id
+        self.email = email
+        self.user_metadata = metadata
+
+
+class _AuthResponse:
+    def __init__(self, user: Optional[_User]):
+        self.user = user
+        self.session = {'access_token': uuid.uuid4().hex} if user else None
+
+
+class _InMemoryAuth:
+    def __init__(self):
+        self.accounts = {}
+
+    def sign_up(self, credentials: dict) -> _AuthResponse:
+        email = credentials['email'].lower()
+        if email in self.accounts:
+            raise InMemoryAPIError("User already registered", code='user_already_exists')
+        metadata = (credentials.get('options') or {}).get('data') or {}
+        self.accounts[email] = (credentials['password'], _User(str(uuid.uuid4()), email, metadata))
+        return _AuthResponse(self.accounts[email][1])
+
+    def sign_in_with_password(self, credentials: dict) -> _AuthResponse:
+        password, user = self.accounts.get(credentials['email'].lower(), (None, None))
+        if user is None or password != credentials['password']:
+            raise InMemoryAPIError("Invalid login credentials", code='invalid_credentials')
+        return _AuthResponse(user)
+
+    def sign_out(self):
+        return None
+
+
+class InMemorySupabase:
+    """Drop-in for the Supabase client backed by Python dicts; thread-safe.
+
+    Each table is a dict of rows keyed by id (so lookups by id and many-to-one
+    embeds are O(1)) plus hash indexes for its unique columns. ``latency`` is
+    the simulated seconds per round trip: a number, or a function
+    ``(method, table) -> seconds``. The sleep happens outside the store lock,
+    so concurrent callers overlap like real network calls.
+    """
+
+    def __init__(self, tables: Optional[dict] = None, latency: Union[float, Callable] = 0.0):
+        self.tables = {}
+        self.latency = latency
+        self.auth = _InMemoryAuth()
+        self.functions = {'apply_unit_of_work': InMemorySupabase._apply_unit_of_work}
+        self.calls = Counter()
+        self.round_trips = 0
+        self._ids = Counter()
+        self._unique = {}
+        self._lock = threading.RLock()
+        for table, rows in (tables or {}).items():
+            self.seed(table, rows)
+
+    # ---- client surface ----
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    from_ = table
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> _RPC:
+        return _RPC(self, name, params)
+
+    # ---- test / benchmark helpers ----
+    def seed(self, table: str, rows: list[dict]) -> list[dict]:
+        """Insert rows without counting a round trip; returns them with defaults filled in."""
+        with self._lock:
+            return self._insert(table, rows)
+
+    def rows(self, table: str) -> list[dict]:
+        with self._lock:
+            return copy.deepcopy(list(self.tables.get(table, {}).values()))
+
+    def register_function(self, name: str, fn: Callable):
+        """Make ``rpc(name, params)`` call ``fn(client, params)``."""
+        self.functions[name] = fn
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.round_trips = 0
+
+    # ---- execution ----
+    def _round_trip(self, method: str, table: str):
+        with self._lock:
+            self.calls[(method, table)] += 1
+            self.round_trips += 1
+        delay = self.latency(method, table) if callable(self.latency) else self.latency
+        if delay:
+            time.sleep(delay)
+        request_budget.record(method, table, delay or 0.0)
+
+    def _matching(self, query: _Query) -> list[dict]:
+        rows = self.tables.get(query.table, {})
+        for column, value in query.equals:
+            # Equality on the id is an index lookup, as it would be in Postgres
+            if column == 'id':
+                row = rows.get(_coerce(next(iter(rows), None), value)) if rows else None
+                return [row] if row is not None and query.matches(row) else []
+        return [r for r in rows.values() if query.matches(r)]
+
+    def _execute(self, query: _Query) -> Response:
+        self._round_trip(query.method, query.table)
+        with self._lock:
+            if query.method == 'select':
+                matched = query.sort(self._matching(query))
+                count = len(matched) if query.count_mode else None
+                end = None if query.limit_n is None else query.offset + query.limit_n
+                selected = [self._project(query.table, r, _parse_select(query.columns)) for r in matched[query.offset:end]]
+                return Response(selected, count)
+            if query.method == 'insert':
+                return Response(self._insert(query.table, query.payload))
+            if query.method == 'upsert':
+                return Response(self._upsert(query.table, query.payload, query.on_conflict, query.ignore_duplicates))
+            if query.method == 'update':
+                return Response(self._update(query.table, query.payload, self._matching(query)))
+            if query.method == 'delete':
+                deleted = self._matching(query)
+                for row in deleted:
+                    self._unindex(query.table, row)
+                    del self.tables[query.table][row['id']]
+                return Response(copy.deepcopy(deleted))
+        raise InMemoryAPIError(f"Unsupported method {query.method}")
+
+    def _call(self, name: str, params: dict) -> Response:
+        self._round_trip('rpc', name)
+        fn = self.functions.get(name)
+        if fn is None:
+            raise InMemoryAPIError(f"Could not find the function public.{name}", code='PGRST202')
+        return Response(fn(self, params))
+
+    # ---- storage ----
+    def _new_row(self, table: str, row: dict) -> dict:
+        row = {k: (_now() if v == 'now()' else copy.deepcopy(v)) for k, v in row.items()}
+        if row.get('id') is None:
+            if table in UUID_TABLES:
+                row['id'] = str(uuid.uuid4())
+            else:
+                self._ids[table] += 1
+                row['id'] = self._ids[table]
+        elif isinstance(row['id'], int):
+            self._ids[table] = max(self._ids[table], row['id'])
+        for column, default in DEFAULTS.get(table, {}).items():
+            if column not in row:
+                row[column] = _now() if default is NOW else copy.deepcopy(default)
+        return row
+
+    def _unique_keys(self, table: str, row: dict):
+        for columns in UNIQUE_COLUMNS.get(table, []):
+            key = tuple(row.get(c) for c in columns)
+            if None not in key:  # NULLs never conflict
+                yield columns, key
+
+    def _index(self, table: str, row: dict):
+        for columns, key in self._unique_keys(table, row):
+            self._unique.setdefault((table, columns), {})[key] = row['id']
+
+    def _unindex(self, table: str, row: dict):
+        for columns, key in self._unique_keys(table, row):
+            self._unique.get((table, columns), {}).pop(key, None)
+
+    def _conflicting(self, table: str, row: dict, columns: tuple) -> Optional[dict]:
+        rows = self.tables.get(table, {})
+        if columns == ('id',):
+            return rows.get(row.get('id'))
+        key = tuple(row.get(c) for c in columns)
+        row_id = self._unique.get((table, columns), {}).get(key)
+        if row_id is None and None not in key:
+            # Not a declared unique constraint: fall back to a scan
+            row_id = next((r['id'] for r in rows.values() if all(r.get(c) == k for c, k in zip(columns, key))), None)
+        return rows.get(row_id)
+
+    def _insert(self, table: str, rows: Union[dict, list]) -> list[dict]:
+        new_rows = [self._new_row(table, r) for r in ([rows] if isinstance(rows, dict) else rows)]
+        stored = self.tables.setdefault(table, {})
+        added = []
+        try:
+            for row in new_rows:
+                for columns in [('id',)] + [c for c, _ in self._unique_keys(table, row)]:
+                    if self._conflicting(table, row, columns):
+                        raise InMemoryAPIError(f"duplicate key value violates unique constraint on {table}({', '.join(columns)})", code='23505')
+                stored[row['id']] = row
+                self._index(table, row)
+                added.append(row)
+        except InMemoryAPIError:
+            # One request is one statement: all rows or none
+            for row in added:
+                self._unindex(table, row)
+                del stored[row['id']]
+            raise
+        return copy.deepcopy(new_rows)
+
+    def _upsert(self, table: str, rows: Union[dict, list], on_conflict: str, ignore_duplicates: bool) -> list[dict]:
+        columns = tuple(c.strip() for c in on_conflict.split(','))
+        written = []
+        for row in ([rows] if isinstance(rows, dict) else rows):
+            existing = self._conflicting(table, row, columns)
+            if existing is None:
+                written.extend(self._insert(table, row))
+            elif not ignore_duplicates:
+                written.extend(self._update(table, {k: v for k, v in row.items() if k != 'id'}, [existing]))
+        return written
+
+    def _update(self, table: str, values: dict, rows: list[dict]) -> list[dict]:
+        updated = []
+        for row in rows:
+            self._unindex(table, row)
+            row.update({k: (_now() if v == 'now()' else copy.deepcopy(v)) for k, v in values.items()})
+            if table in TOUCHED_ON_UPDATE:
+                row['updated_at'] = _now()
+            self._index(table, row)
+            updated.append(copy.deepcopy(row))
+        return updated
+
+    def _project(self, table: str, row: dict, items: list) -> dict:
+        out = {}
+        for item in items:
+            if isinstance(item, tuple):
+                name, hint, sub, alias = item
+                out[alias] = self._embed(table, row, name, hint, sub)
+            elif item == '*':
+                out.update(copy.deepcopy(row))
+            else:
+                alias, _, column = item.rpartition(':')
+                out[alias or column] = copy.deepcopy(row.get(column))
+        return out
+
+    def _embed(self, table: str, row: dict, name: str, hint: Optional[str], sub: list):
+        # Many-to-one: a foreign key on this table pointing at ``name``
+        outgoing = [c for c, ref in FOREIGN_KEYS.get(table, {}).items() if ref == name]
+        if hint:
+            outgoing = [c for c in outgoing if hint in (c, f'{table}_{c}_fkey')]
+        if len(outgoing) == 1:
+            parents = self.tables.get(name, {})
+            key = row.get(outgoing[0])
+            parent = parents.get(_coerce(next(iter(parents), None), key)) if key is not None and parents else None
+            return self._project(name, parent, sub) if parent is not None else None
+        if len(outgoing) > 1:
+            raise InMemoryAPIError(f"More than one relationship was found for '{table}' and '{name}'", code='PGRST201')
+        # One-to-many: rows of ``name`` whose foreign key points at this row
+        incoming = [c for c, ref in FOREIGN_KEYS.get(name, {}).items() if ref == table]
+        if hint:
+            incoming = [c for c in incoming if hint in (c, f'{name}_{c}_fkey')]
+        if len(incoming) != 1:
+            raise InMemoryAPIError(f"Could not find a relationship between '{table}' and '{name}'", code='PGRST200')
+        children = self.tables.get(name, {}).values()
+        return [self._project(name, r, sub) for r in children if r.get(incoming[0]) == row.get('id')]
+
+    @staticmethod
+    def _apply_unit_of_work(client: 'InMemorySupabase', params: dict) -> list:
+        """Same contract as the apply_unit_of_work SQL function: all ops or none."""
+        ops = params.get('ops') or []
+        with client._lock:
+            touched = {op['table'] for op in ops}
+            snapshot = ({t: copy.deepcopy(client.tables.get(t, {})) for t in touched},
+                        {k: dict(v) for k, v in client._unique.items() if k[0] in touched}, client._ids.copy())
+            results = []
+            try:
+                for index, op in enumerate(ops):
+                    if op['op'] == 'insert':
+                        written = client._insert(op['table'], op['values'])
+                    else:
+                        query = client.table(op['table'])
+                        for column, value in (op.get('match') or {}).items():
+                            query.eq(column, value)
+                        for column, value in (op.get('exclude') or {}).items():
+                            query.neq(column, value)
+                        written = client._update(op['table'], op['values'], client._matching(query))
+                    if op.get('expect') and not written:
+                        raise InMemoryAPIError(f"unit_of_work_conflict: op {index} on {op['table']} matched no rows", code='P0001')
+                    results.append(written)
+            except Exception:
+                tables, unique, ids = snapshot
+                client.tables.update(tables)
+                for key in [k for k in client._unique if k[0] in touched]:
+                    del client._unique[key]
+                client._unique.update(unique)
+                client._ids = ids
+                raise
+            return results
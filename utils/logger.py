@@ -1,4 +1,5 @@
 import logging
+import os
 from logging.handlers import RotatingFileHandler
 
 
@@ -20,12 +21,14 @@ def get_logger():
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
-    # Rotating file handler (optional; ignored if file not permitted)
+    # Rotating file handler (optional; LOG_FILE= disables it, ignored if file not permitted)
+    log_file = os.environ.get("LOG_FILE", "app.log")
     try:
-        fh = RotatingFileHandler("app.log", maxBytes=512000, backupCount=3)
-        fh.setLevel(logging.INFO)
-        fh.setFormatter(formatter)
-        logger.addHandler(fh)
+        if log_file:
+            fh = RotatingFileHandler(log_file, maxBytes=512000, backupCount=3)
+            fh.setLevel(logging.INFO)
+            fh.setFormatter(formatter)
+            logger.addHandler(fh)
     except Exception:
         pass
 
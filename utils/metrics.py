@@ -0,0 +1,355 @@
+import atexit
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+from utils.redis_client import get_redis, mark_redis_down
+
+
+def _label_key(label) -> str:
+    """Labels are stored as one string; multi-label values are joined with ``|``."""
+    return '|'.join(str(v) for v in label) if isinstance(label, tuple) else str(label)
+
+
+# Seconds between background pushes of this process's new observations to Redis
+FLUSH_INTERVAL = 5.0
+
+_registry = []
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    # Forked workers (Celery prefork, gunicorn) inherit the metrics but not the thread
+    if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _flusher_lock:
+        if _flusher is None or _flusher_pid != os.getpid() or not _flusher.is_alive():
+            if _flusher_pid is not None and _flusher_pid != os.getpid():
+                # Increments inherited over fork are the parent's to push
+                for metric in _registry:
+                    metric._take_pending()
+            _flusher_pid = os.getpid()
+            _flusher = threading.Thread(target=_flush_loop, name='metrics-flusher', daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """Push every metric's unflushed increments to Redis in one pipeline; kept for later if Redis is down."""
+    client = get_redis()
+    if client is None:
+        return
+    taken = [(metric, metric._take_pending()) for metric in _registry]
+    taken = [(metric, pending) for metric, pending in taken if pending]
+    if not taken:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        for metric, pending in taken:
+            metric._write(pipe, pending)
+        pipe.execute()
+    except Exception as e:
+        for metric, pending in taken:
+            metric._restore_pending(pending)
+        mark_redis_down(e)
+
+
+atexit.register(flush)
+
+
+class LatencyHistogram:
+    """Labelled latency histogram shared across processes through Redis.
+
+    Celery workers observe values and the web process reads them, so counts
+    are summed in one Redis hash per label (``metrics:<name>:<label>``) with
+    the labels kept in a set. :meth:`observe` only updates this process's
+    counters; a background thread pushes the increments to Redis every
+    ``FLUSH_INTERVAL`` seconds, so recording never waits on Redis. Bucket
+    fields hold per-bucket counts; :meth:`snapshot` turns them into cumulative
+    Prometheus-style ``le`` buckets. Without Redis, the snapshot covers this
+    process only. A label may be a tuple of values, one per entry of
+    ``labelnames``.
+    """
+
+    BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900)
+
+    def __init__(self, name: str, buckets: tuple = BUCKETS, labelnames: tuple = ('label',), doc: str = ''):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        self.doc = doc
+        self._local = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _bucket_field(self, seconds: float) -> str:
+        i = bisect.bisect_left(self.buckets, seconds)
+        return f"le_{self.buckets[i]}" if i < len(self.buckets) else "le_inf"
+
+    def observe(self, label, seconds: float):
+        label = _label_key(label)
+        seconds = max(0.0, float(seconds))
+        field = self._bucket_field(seconds)
+        _ensure_flusher()
+        with self._lock:
+            for totals in (self._local, self._pending):
+                stats = totals.setdefault(label, {})
+                stats[field] = stats.get(field, 0) + 1
+                stats['count'] = stats.get('count', 0) + 1
+                stats['sum'] = stats.get('sum', 0.0) + seconds
+
+    def _take_pending(self) -> dict:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore_pending(self, pending: dict):
+        with self._lock:
+            _merge(self._pending, pending)
+
+    def _write(self, pipe, pending: dict):
+        for label, stats in pending.items():
+            key = f"metrics:{self.name}:{label}"
+            pipe.sadd(f"metrics:{self.name}:labels", label)
+            for field, value in stats.items():
+                if field == 'sum':
+                    pipe.hincrbyfloat(key, field, value)
+                else:
+                    pipe.hincrby(key, field, value)
+
+    def _raw(self) -> dict:
+        client = get_redis()
+        if client is not None:
+            try:
+                labels = sorted(_decode(v) for v in client.smembers(f"metrics:{self.name}:labels"))
+                pipe = client.pipeline(transaction=False)
+                for label in labels:
+                    pipe.hgetall(f"metrics:{self.name}:{label}")
+                raw = {label: {_decode(k): float(v) for k, v in fields.items()}
+                       for label, fields in zip(labels, pipe.execute())}
+                with self._lock:
+                    return _merge(raw, self._pending)
+            except Exception as e:
+                mark_redis_down(e)
+        with self._lock:
+            return {label: dict(stats) for label, stats in self._local.items()}
+
+    def snapshot(self) -> dict:
+        """``{label: {'buckets': [(le, cumulative count)], 'count', 'sum'}}``, with ``le`` ending at inf."""
+        result = {}
+        for label, stats in self._raw().items():
+            cumulative = 0
+            buckets = []
+            for le in self.buckets + (float('inf'),):
+                cumulative += int(stats.get(f"le_{le}" if le != float('inf') else "le_inf", 0))
+                buckets.append((le, cumulative))
+            result[label] = {'buckets': buckets, 'count': int(stats.get('count', 0)), 'sum': float(stats.get('sum', 0.0))}
+        return result
+
+
+def _merge(into: dict, extra: dict) -> dict:
+    """Add ``extra``'s ``{label: {field: n}}`` (or ``{label: n}``) increments into ``into``."""
+    for label, value in extra.items():
+        if isinstance(value, dict):
+            stats = into.setdefault(label, {})
+            for field, n in value.items():
+                stats[field] = stats.get(field, 0) + n
+        else:
+            into[label] = into.get(label, 0) + value
+    return into
+
+
+class LabelledCounter:
+    """Monotonic counter per label, shared across processes through Redis like :class:`LatencyHistogram`.
+
+    Values are summed in one Redis hash (``metrics:<name>``), one field per
+    label, and flushed there in the background the same way.
+    """
+
+    def __init__(self, name: str, labelnames: tuple = ('label',), doc: str = ''):
+        self.name = name
+        self.labelnames = labelnames
+        self.doc = doc
+        self._local = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, label, amount: float = 1):
+        label = _label_key(label)
+        _ensure_flusher()
+        with self._lock:
+            self._local[label] = self._local.get(label, 0) + amount
+            self._pending[label] = self._pending.get(label, 0) + amount
+
+    def _take_pending(self) -> dict:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore_pending(self, pending: dict):
+        with self._lock:
+            _merge(self._pending, pending)
+
+    def _write(self, pipe, pending: dict):
+        for label, amount in pending.items():
+            pipe.hincrbyfloat(f"metrics:{self.name}", label, amount)
+
+    def snapshot(self) -> dict:
+        """``{label: value}``."""
+        client = get_redis()
+        if client is not None:
+            try:
+                values = {_decode(k): float(v) for k, v in client.hgetall(f"metrics:{self.name}").items()}
+                with self._lock:
+                    return _merge(values, self._pending)
+            except Exception as e:
+                mark_redis_down(e)
+        with self._lock:
+            return dict(self._local)
+
+
+# Time from a send_sms_batch task being queued to a worker starting it, by lane
+sms_lane_latency = LatencyHistogram('sms_lane_wait_seconds', labelnames=('lane',),
+                                    doc='Time from a send_sms_batch task being queued to a worker starting it')
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+request_latency = LatencyHistogram('http_request_duration_seconds', buckets=HTTP_BUCKETS,
+                                   labelnames=('method', 'route', 'status'), doc='Flask request latency')
+request_backend_calls = LatencyHistogram('http_request_backend_calls', buckets=(1, 2, 5, 10, 20, 50, 100),
+                                         labelnames=('method', 'route'),
+                                         doc='Supabase round trips made per request (see utils.request_budget)')
+celery_task_duration = LatencyHistogram('celery_task_duration_seconds', labelnames=('task', 'state'),
+                                        doc='Celery task run time by final state')
+outbound_latency = LatencyHistogram('outbound_request_duration_seconds', buckets=HTTP_BUCKETS, labelnames=('host',),
+                                    doc='Outbound HTTP call latency by host')
+outbound_errors = LabelledCounter('outbound_request_errors_total', labelnames=('host',),
+                                  doc='Outbound HTTP calls that raised or returned 429/5xx, by host')
+
+# Every queue workers consume, see celery_config.task_routes and the notification engine's channels
+CELERY_QUEUES = ('sms_critical', 'sms_high', 'sms_bulk', 'notify_inapp', 'notify_push', 'notify_email',
+                 'incidents', 'alerts')
+
+
+@contextmanager
+def outbound_call(host: str):
+    """Time an outbound call to ``host``; an exception counts as an error and is re-raised."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        outbound_errors.inc(host)
+        raise
+    finally:
+        outbound_latency.observe(host, time.perf_counter() - start)
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """requests adapter that records latency and errors per host (retries included in the latency)."""
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname or 'unknown'
+        with outbound_call(host):
+            response = super().send(request, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            outbound_errors.inc(host)
+        return response
+
+
+def celery_queue_depths(queues: tuple = CELERY_QUEUES) -> dict:
+    """Messages waiting per queue, read from the Redis broker (empty when Redis is unavailable)."""
+    client = get_redis()
+    if client is None:
+        return {}
+    try:
+        pipe = client.pipeline(transaction=False)
+        for queue in queues:
+            pipe.llen(queue)
+        return dict(zip(queues, pipe.execute()))
+    except Exception as e:
+        mark_redis_down(e)
+        return {}
+
+
+def init_app(app):
+    """Observe every request's latency (by method, route and status class) and Supabase call count."""
+    from flask import g, request
+
+    from utils import request_budget
+
+    @app.before_request
+    def _start_request_timer():
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('_request_started', None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe((request.method, route, f"{response.status_code // 100}xx"),
+                                time.perf_counter() - started)
+        ledger = request_budget.current()
+        if ledger is not None:
+            request_backend_calls.observe((request.method, route), ledger.total_calls)
+        return response
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labelnames: tuple, label: str, extra: str = '') -> str:
+    values = label.split('|') if len(labelnames) > 1 else [label]
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_histogram(histogram: LatencyHistogram) -> list[str]:
+    lines = [f"# HELP {histogram.name} {histogram.doc or histogram.name}", f"# TYPE {histogram.name} histogram"]
+    for label, stats in sorted(histogram.snapshot().items()):
+        for le, count in stats['buckets']:
+            le_pair = 'le="%s"' % _number(le)
+            lines.append(f"{histogram.name}_bucket{_labels(histogram.labelnames, label, le_pair)} {count}")
+        lines.append(f"{histogram.name}_sum{_labels(histogram.labelnames, label)} {_number(stats['sum'])}")
+        lines.append(f"{histogram.name}_count{_labels(histogram.labelnames, label)} {stats['count']}")
+    return lines
+
+
+def render_values(name: str, kind: str, doc: str, labelnames: tuple, values: dict) -> list[str]:
+    """Gauge or counter lines for ``{label: value}`` (label ``''`` for an unlabelled metric)."""
+    lines = [f"# HELP {name} {doc or name}", f"# TYPE {name} {kind}"]
+    for label, value in sorted(values.items()):
+        lines.append(f"{name}{_labels(labelnames, label) if labelnames else ''} {_number(value)}")
+    return lines
+
+
+def render_counter(counter: LabelledCounter) -> list[str]:
+    return render_values(counter.name, 'counter', counter.doc, counter.labelnames, counter.snapshot())
@@ -0,0 +1,41 @@
+import hashlib
+import re
+from typing import Optional
+
+from config import Config
+
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone(raw, default_country_code: Optional[str] = None) -> Optional[str]:
+    """E.164 form of a phone number ('+919876543210'), or None when it cannot be one.
+
+    Handles spaces/dashes/brackets, the '00' international prefix, a national
+    trunk '0', and bare national numbers. A number without a country code is
+    assumed to be in ``default_country_code``, which defaults to
+    ``Config.DEFAULT_PHONE_COUNTRY_CODE`` (91, India).
+    """
+    default_country_code = default_country_code or Config.DEFAULT_PHONE_COUNTRY_CODE
+    if raw is None:
+        return None
+    text = str(raw).strip()
+    if not text:
+        return None
+    digits = _NON_DIGITS.sub('', text)
+    if text.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith(default_country_code) and len(digits) == len(default_country_code) + 10:
+        pass
+    else:
+        digits = default_country_code + digits.lstrip('0')
+    if not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+    return '+' + digits
+
+
+def idempotency_key(alert_key: str, phone: str) -> str:
+    """Stable key for one (alert, recipient) delivery."""
+    return hashlib.sha256(f"{alert_key}|{phone}".encode('utf-8')).hexdigest()[:32]
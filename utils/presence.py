@@ -0,0 +1,55 @@
+import threading
+import time
+
+from utils.cache import TTLCache
+from utils.redis_client import get_redis, mark_redis_down
+
+
+# Sorted set of user id -> last request time (epoch seconds), shared by every web process
+PRESENCE_KEY = 'presence:users'
+# A user is only re-recorded this often, so page views do not each cost a Redis write
+_MARK_EVERY_SECONDS = 30
+
+# Last mark per user in this process (throttling, and presence when Redis is down); idle users age out
+_local = TTLCache(ttl=3600, max_entries=100000)
+_lock = threading.Lock()
+
+
+def mark_active(user_id):
+    """Record that a signed-in user just made a request to the web app."""
+    if not user_id:
+        return
+    user_id = str(user_id)
+    now = time.time()
+    with _lock:
+        last = _local.get(user_id)
+        if last is not None and now - last < _MARK_EVERY_SECONDS:
+            return
+        _local.set(user_id, now)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(PRESENCE_KEY, {user_id: now})
+        # Keep the set small: anyone idle for a day is irrelevant to presence checks
+        pipe.zremrangebyscore(PRESENCE_KEY, 0, now - 86400)
+        pipe.execute()
+    except Exception as e:
+        mark_redis_down(e)
+
+
+def active_users(user_ids, within_seconds: int = 300) -> set:
+    """The subset of ``user_ids`` seen in the web app during the last ``within_seconds``."""
+    ids = [str(u) for u in user_ids if u]
+    if not ids:
+        return set()
+    cutoff = time.time() - within_seconds
+    client = get_redis()
+    if client is not None:
+        try:
+            scores = client.zmscore(PRESENCE_KEY, ids)
+            return {uid for uid, score in zip(ids, scores) if score is not None and score >= cutoff}
+        except Exception as e:
+            mark_redis_down(e)
+    return {uid for uid in ids if _local.get(uid, 0) >= cutoff}
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from utils.redis_client import get_redis, mark_redis_down
+
+
+# KEYS[1] bucket hash; ARGV rate (tokens/s), burst, requested tokens.
+# Returns 0 when the tokens were taken, otherwise the milliseconds until they will be available.
+_TOKEN_BUCKET_LUA = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now_ms
+tokens = math.min(burst, tokens + math.max(0, now_ms - ts) * rate / 1000)
+local wait_ms = 0
+if tokens >= requested then
+  tokens = tokens - requested
+else
+  wait_ms = math.ceil((requested - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now_ms)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait_ms
+"""
+
+
+class _LocalBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, requested: float) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            if self.tokens >= requested:
+                self.tokens -= requested
+                return 0.0
+            return (requested - self.tokens) / self.rate
+
+
+class TokenBucketLimiter:
+    """Token bucket per key, shared by every worker through Redis.
+
+    The refill and take happen atomically in one Lua script using the Redis
+    server clock, so all Celery workers draw from the same bucket and the
+    aggregate send rate tracks ``rate`` per second (with bursts up to
+    ``burst``). When Redis is unreachable each process falls back to a local
+    bucket with the same settings, which over-admits by the number of workers
+    but never stops sending.
+    """
+
+    def __init__(self, rate: float, burst: float = None, prefix: str = 'ratelimit'):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.prefix = prefix
+        self._script = None
+        self._local = {}
+        self._local_lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def _local_bucket(self, key: str) -> _LocalBucket:
+        with self._local_lock:
+            if key not in self._local:
+                self._local[key] = _LocalBucket(self.rate, self.burst)
+            return self._local[key]
+
+    def try_acquire(self, key: str, tokens: float = 1) -> float:
+        """Take ``tokens`` if available; returns 0, or the seconds to wait before retrying."""
+        client = get_redis()
+        if client is not None:
+            try:
+                if self._script is None:
+                    self._script = client.register_script(_TOKEN_BUCKET_LUA)
+                wait_ms = self._script(keys=[f"{self.prefix}:{key}"], args=[self.rate, self.burst, tokens])
+                return int(wait_ms) / 1000.0
+            except Exception as e:
+                self._script = None
+                mark_redis_down(e)
+        return self._local_bucket(key).take(tokens)
+
+    def acquire(self, key: str, tokens: float = 1, timeout: float = None) -> bool:
+        """Block until ``tokens`` are granted; returns False if that would take longer than ``timeout``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(key, tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            self.waited_seconds += wait
+            time.sleep(wait)
@@ -0,0 +1,45 @@
+import os
+import threading
+import time
+
+from config import Config
+from utils.logger import get_logger
+
+
+_client = None
+_client_pid = None
+_down_until = 0.0
+_lock = threading.Lock()
+
+# After a connection failure, callers use their local fallback for this long before Redis is tried again
+RETRY_AFTER_SECONDS = 30
+
+
+def get_redis():
+    """Shared Redis client for coordination state, or None when Redis is unavailable.
+
+    The client is created lazily per process (so forked Celery workers get their
+    own connection pool) with short timeouts: everything built on it has a local
+    fallback and must never stall a request waiting on Redis.
+    """
+    global _client, _client_pid
+    if time.monotonic() < _down_until:
+        return None
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            try:
+                import redis
+                _client = redis.Redis.from_url(Config.REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+                _client_pid = os.getpid()
+            except Exception as e:
+                mark_redis_down(e)
+                return None
+    return _client
+
+
+def mark_redis_down(err: Exception):
+    """Record a Redis failure so callers skip it for a while instead of timing out on every call."""
+    global _down_until
+    if time.monotonic() >= _down_until:
+        get_logger().warning(f"Redis unavailable, using local fallbacks for {RETRY_AFTER_SECONDS}s: {err}")
+    _down_until = time.monotonic() + RETRY_AFTER_SECONDS
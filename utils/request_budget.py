@@ -0,0 +1,153 @@
+"""
+Per-request accounting of Supabase calls, with call and latency budgets
+
+Every Supabase round trip (the shared HTTP transport in utils.supabase_client,
+or the in-memory stand-in) is recorded into the ledger of the request being
+served, grouped by operation and table. ``init_app`` opens a ledger per
+request, reports it in the ``X-Backend-Calls`` and ``Server-Timing`` headers
+and logs requests that go over budget or repeat the same query many times
+(the usual shape of an N+1 loop).
+"""
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+from utils.logger import get_logger
+
+
+_current = contextvars.ContextVar('request_budget_ledger', default=None)
+
+
+class CallLedger:
+    """Supabase calls made while serving one request (or inside one ``track()`` block)."""
+
+    def __init__(self, parent: Optional['CallLedger'] = None):
+        self.parent = parent
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, table: str, seconds: float):
+        with self._lock:
+            self.calls[(operation, table)] += 1
+            self.seconds[(operation, table)] += seconds
+        if self.parent is not None:
+            self.parent.record(operation, table, seconds)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.seconds.values()) * 1000
+
+    def repeated(self, threshold: int) -> list[tuple[str, str, int]]:
+        """(operation, table, count) for every query issued at least ``threshold`` times."""
+        return sorted(((op, table, n) for (op, table), n in self.calls.items() if n >= threshold), key=lambda r: -r[2])
+
+    def summary(self) -> str:
+        parts = sorted(self.calls.items(), key=lambda item: (-item[1], item[0]))
+        return ', '.join(f"{op} {table} x{n} ({self.seconds[(op, table)] * 1000:.0f} ms)" for (op, table), n in parts)
+
+
+def current() -> Optional[CallLedger]:
+    return _current.get()
+
+
+def record(operation: str, table: str, seconds: float):
+    """Called by the Supabase transports for each round trip; a no-op outside a request."""
+    ledger = _current.get()
+    if ledger is not None:
+        ledger.record(operation, table, seconds)
+
+
+class track:
+    """``with track() as ledger:`` collects the calls made in the block, including nested requests."""
+
+    def __enter__(self) -> CallLedger:
+        self.ledger = CallLedger(parent=_current.get())
+        self._token = _current.set(self.ledger)
+        return self.ledger
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+        return False
+
+
+_HTTP_OPERATIONS = {'GET': 'select', 'HEAD': 'count', 'POST': 'insert', 'PATCH': 'update', 'DELETE': 'delete'}
+
+
+def describe_rest_call(method: str, path: str, prefer: str = '') -> tuple[str, str]:
+    """(operation, table) for a PostgREST/GoTrue request, e.g. ('select', 'incidents') or ('rpc', 'fn')."""
+    parts = [p for p in path.split('/') if p]
+    if len(parts) >= 3 and parts[0] == 'auth':
+        return 'auth', parts[-1]
+    if len(parts) >= 4 and parts[2] == 'rpc':
+        return 'rpc', parts[3]
+    operation = _HTTP_OPERATIONS.get(method.upper(), method.lower())
+    if operation == 'insert' and 'resolution=' in prefer:
+        operation = 'upsert'
+    return operation, parts[-1] if parts else ''
+
+
+def init_app(app, max_calls: int = 20, max_ms: float = 1000.0, repeat_threshold: int = 5):
+    """Open a ledger per request and log requests over ``max_calls`` or ``max_ms`` of backend time.
+
+    A query repeated ``repeat_threshold`` times in one request is logged as a
+    likely N+1 even when the request stays within budget.
+    """
+    from flask import g, request
+
+    logger = get_logger()
+
+    @app.before_request
+    def _open_call_ledger():
+        g._call_ledger = CallLedger(parent=_current.get())
+        g._call_ledger_token = _current.set(g._call_ledger)
+
+    @app.after_request
+    def _close_call_ledger(response):
+        ledger = g.pop('_call_ledger', None)
+        if ledger is None:
+            return response
+        calls, ms = ledger.total_calls, ledger.total_ms
+        response.headers['X-Backend-Calls'] = str(calls)
+        response.headers['Server-Timing'] = f'supabase;dur={ms:.1f};desc="{calls} calls"'
+        if calls > max_calls or ms > max_ms:
+            logger.warning(f"Backend budget exceeded on {request.method} {request.path}: {calls} calls, "
+                           f"{ms:.0f} ms (budget {max_calls} calls / {max_ms:.0f} ms): {ledger.summary()}")
+        for op, table, n in ledger.repeated(repeat_threshold):
+            logger.warning(f"Possible N+1 on {request.method} {request.path}: {op} {table} issued {n} times")
+        return response
+
+    @app.teardown_request
+    def _reset_call_ledger(exc):
+        token = g.pop('_call_ledger_token', None)
+        if token is not None:
+            _current.reset(token)
+
+
+def assert_constant_calls(run: Callable[[int], object], sizes: Iterable[int] = (2, 20)) -> dict[int, CallLedger]:
+    """Fail when the number of backend calls grows with the size of the data.
+
+    ``run(n)`` must seed a dataset of size ``n`` and serve the request under
+    test; it is called once per size inside :class:`track`. Raises
+    AssertionError naming the queries whose count changed, e.g. an N+1 loop.
+    """
+    ledgers = {}
+    for n in sizes:
+        with track() as ledger:
+            run(n)
+        ledgers[n] = ledger
+    first, *rest = sizes
+    for n in rest:
+        grown = {key: (ledgers[first].calls.get(key, 0), count) for key, count in ledgers[n].calls.items()
+                 if count > ledgers[first].calls.get(key, 0)}
+        if grown:
+            detail = ', '.join(f"{op} {table}: {a} -> {b}" for (op, table), (a, b) in sorted(grown.items()))
+            raise AssertionError(f"Backend calls grow with data size ({first} -> {n} rows): {detail}")
+    return ledgers
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from config import Config
+from utils import request_budget
+from utils.logger import get_logger
+
+
+_client = None
+_client_pid = None
+_auth_transport = None
+_auth_transport_pid = None
+_lock = threading.Lock()
+_stats = {'clients_created': 0, 'requests': 0, 'errors': 0, 'in_flight': 0, 'request_seconds': 0.0}
+_stats_lock = threading.Lock()
+
+
+def _counting_transport():
+    import httpx
+
+    from utils.metrics import outbound_call, outbound_errors
+
+    class CountingTransport(httpx.HTTPTransport):
+        """HTTP transport that records request counts, errors and time for pool_stats() and /metrics."""
+
+        def handle_request(self, request):
+            with _stats_lock:
+                _stats['in_flight'] += 1
+            start = time.perf_counter()
+            try:
+                with outbound_call(request.url.host):
+                    response = super().handle_request(request)
+                if response.status_code >= 500:
+                    outbound_errors.inc(request.url.host)
+                return response
+            except Exception:
+                with _stats_lock:
+                    _stats['errors'] += 1
+                raise
+            finally:
+                with _stats_lock:
+                    _stats['in_flight'] -= 1
+                    _stats['requests'] += 1
+                    _stats['request_seconds'] += time.perf_counter() - start
+                operation, table = request_budget.describe_rest_call(
+                    request.method, request.url.path, request.headers.get('prefer', ''))
+                request_budget.record(operation, table, time.perf_counter() - start)
+
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    limits = httpx.Limits(max_connections=Config.SUPABASE_POOL_SIZE,
+                          max_keepalive_connections=Config.SUPABASE_KEEPALIVE, keepalive_expiry=30)
+    return CountingTransport(limits=limits, http2=http2, retries=1)
+
+
+def _create_client():
+    if Config.SUPABASE_URL.startswith('memory://'):
+        # Offline stand-in for local benchmarks and tests (utils.inmemory_supabase)
+        from utils.inmemory_supabase import InMemorySupabase
+        return InMemorySupabase(latency=Config.SUPABASE_MEMORY_LATENCY_MS / 1000)
+    import httpx
+    from supabase import ClientOptions, create_client
+
+    http = httpx.Client(transport=_counting_transport(), follow_redirects=True,
+                        timeout=httpx.Timeout(Config.SUPABASE_TIMEOUT, connect=3.0))
+    return create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY, options=ClientOptions(httpx_client=http))
+
+
+def get_supabase():
+    """The process-wide Supabase client, or None when Supabase is not configured.
+
+    Created on first use rather than at import, and once per process: a client
+    inherited through fork (gunicorn --preload, Celery prefork) is discarded
+    and the child builds its own, so no connection is ever shared between
+    processes. Every caller in the process shares one keep-alive HTTP pool.
+    """
+    global _client, _client_pid
+    if not Config.is_supabase_configured():
+        return None
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = _create_client()
+            _client_pid = os.getpid()
+            with _stats_lock:
+                _stats['clients_created'] += 1
+            get_logger().info(f"Supabase client created for pid {_client_pid}")
+    return _client
+
+
+def get_auth_client():
+    """A fresh client for one sign-up or sign-in, or None when Supabase is not configured.
+
+    supabase-py rewrites a client's Authorization header to the JWT of whoever
+    signs in through it, so auth never goes through the shared service-key
+    client from get_supabase(). Each call gets its own client that keeps no
+    session; the clients of one process share a single pooled transport.
+    """
+    global _auth_transport, _auth_transport_pid
+    if not Config.is_supabase_configured():
+        return None
+    if Config.SUPABASE_URL.startswith('memory://'):
+        # The in-memory stand-in never changes its own headers on sign-in
+        return get_supabase()
+    import httpx
+    from supabase import ClientOptions, create_client
+
+    with _lock:
+        if _auth_transport is None or _auth_transport_pid != os.getpid():
+            _auth_transport = _counting_transport()
+            _auth_transport_pid = os.getpid()
+    http = httpx.Client(transport=_auth_transport, follow_redirects=True,
+                        timeout=httpx.Timeout(Config.SUPABASE_TIMEOUT, connect=3.0))
+    options = ClientOptions(httpx_client=http, persist_session=False, auto_refresh_token=False)
+    return create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY, options=options)
+
+
+class SupabaseProxy:
+    """Stands in for the client in module globals; resolves get_supabase() on each attribute access."""
+
+    def __getattr__(self, name):
+        return getattr(get_supabase(), name)
+
+    def __repr__(self):
+        return f"<SupabaseProxy client={'created' if _client is not None and _client_pid == os.getpid() else 'pending'}>"
+
+
+def supabase_or_none() -> Optional[SupabaseProxy]:
+    """A lazy client handle for module-level use, or None when Supabase is not configured.
+
+    Keeps the existing ``if supabase:`` / ``supabase is not None`` checks working
+    without creating a client (or its connection pool) at import time.
+    """
+    return SupabaseProxy() if Config.is_supabase_configured() else None
+
+
+def pool_stats() -> dict:
+    """Counters for the shared pool: requests, errors, in-flight, time spent and open connections."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['connections'] = stats['idle_connections'] = 0
+    client = _client if _client_pid == os.getpid() else None
+    try:
+        pool = client.postgrest.session._transport._pool
+        connections = list(pool.connections)
+        stats['connections'] = len(connections)
+        stats['idle_connections'] = sum(1 for c in connections if c.is_idle())
+    except Exception:
+        pass
+    return stats